@@ -1,7 +1,6 @@
 """conftest.py for Shadow-utils"""
 
 from __future__ import print_function
-import subprocess
 import pytest
 import os
 import re
@@ -11,22 +10,79 @@ from pytest_multihost import make_multihost_fixture
 from sssd.testlib.common.qe_class import session_multihost
 from sssd.testlib.common.paths import SSSD_DEFAULT_CONF
 from sssd.testlib.ipa.utils import ipaTools
-from sssd.testlib.common.utils import PkiTools, sssdTools, LdapOperations
+from sssd.testlib.common.utils import PkiCertFactory, sssdTools
+from sssd.testlib.common.utils import LdapOperations
 from sssd.testlib.common.libdirsrv import DirSrvWrap
 from sssd.testlib.common.exceptions import PkiLibException, LdapException
 from sssd.testlib.common.libkrb5 import krb5srv
+from sssd.testlib.common.provision import PackageProvisioner
+from sssd.testlib.common.provision import required_packages
+from sssd.testlib.common.scheduler import assign_groups, configure_pool
+from sssd.testlib.common.scheduler import record_report, save_timings
+from sssd.testlib.common.scheduler import shard_items, xdist_worker
+from sssd.testlib.common.shadowperf import SHADOW_FILES, ShadowPerf
 
+# per-phase durations of this run, saved to the timing database
+TIMINGS = {}
 
-def pytest_configure():
+
+def pytest_addoption(parser):
+    """ Options to split the tests into shards of equal run time """
+    parser.addoption('--num-shards', type=int, default=1,
+                     help='Number of shards the tests are split into')
+    parser.addoption('--shard-id', type=int, default=0,
+                     help='Shard to run, 0 to num-shards - 1')
+
+
+def pytest_configure(config):
     """ Namespace hook to add below dict in the pytest namespace """
     pytest.num_masters = 0
     pytest.num_ad = 0
     pytest.num_atomic = 0
     pytest.num_replicas = 0
-    pytest.num_clients = 1
+    # one client, or the whole pool when running with pytest-xdist
+    pytest.num_clients = configure_pool(config)
     pytest.num_others = 0
 
 
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(config, items):
+    """ Balance tests over shards and xdist workers by their historical
+    duration, before xdist reads the xdist_group markers """
+    num_shards = config.getoption('num_shards')
+    shard_id = config.getoption('shard_id')
+    if num_shards < 1 or not 0 <= shard_id < num_shards:
+        raise pytest.UsageError('--shard-id must be in 0..%d'
+                                % (max(num_shards, 1) - 1))
+    if num_shards > 1:
+        items[:], deselected = shard_items(items, shard_id, num_shards)
+        config.hook.pytest_deselected(items=deselected)
+    _, workers = xdist_worker()
+    if workers:
+        assign_groups(items, workers)
+
+
+def pytest_runtest_logreport(report):
+    """ Record setup, call and teardown durations, with xdist the
+    controller receives the reports of all workers """
+    record_report(TIMINGS, report)
+
+
+def pytest_sessionfinish(session):
+    """ Save durations of this run to the timing database """
+    index, _ = xdist_worker()
+    if index is None:
+        save_timings(TIMINGS)
+
+
+def crb_repos(host):
+    """ Repositories needed for devel packages (shadow-utils-subid-devel)
+    """
+    if "Fedora" in host.distro:
+        return []
+    return ['*-CRB']
+
+
 def execute_cmd(session_multihost, command):
     cmd = session_multihost.client[0].run_command(command)
     return cmd
@@ -70,66 +126,87 @@ def backupsssdconf(session_multihost, request):
 def compile_list_subid_ranges(session_multihost, request):
     """
     Compile list_subid_ranges.c file And install
-    necessary packages
+    necessary packages, returns a function running its in-process lookup
+    benchmark, see ShadowPerf.libsubid_bench
     """
-    client = session_multihost.client[0]
-    if "Fedora" in client.distro:
-        client.run_command("yum install -y shadow-utils*")
-    else:
-        client.run_command("yum --enablerepo=*-CRB install -y shadow-utils*")
-
-    session_multihost.client[0].run_command("yum "
-                                            "install -y gcc")
+    # no-op when setup_session provisioned them from the packages marker
+    PackageProvisioner(session_multihost.client).provision(
+        install=['shadow-utils*', 'gcc'], enablerepo=crb_repos)
 
     file_location = "/multihost_test/Bugzillas/data/list_subid_ranges.c"
     session_multihost.client[0].transport.put_file(os.getcwd() +
                                                    file_location,
                                                    '/tmp/list_subid_ranges.c')
     session_multihost.client[0].run_command("gcc /tmp/list_subid_ranges.c "
-                                            "-lsubid -o  /tmp/list_subid_ranges")
+                                            "-lsubid -lpthread "
+                                            "-o  /tmp/list_subid_ranges")
 
     def remove():
         """ Remove file """
         session_multihost.client[0].run_command("rm -vf /tmp/list_subid_ranges")
 
     request.addfinalizer(remove)
+    return ShadowPerf(session_multihost.client[0]).libsubid_bench
+
+
+@pytest.fixture(scope="session")
+def server_certs(session_multihost):
+    """ NSS DB with the CA and a Server Cert of every client. The CA and
+    the certs of earlier sessions are reused from the PkiCertFactory
+    cache, only certs of new clients are issued """
+    serverlist = [client.sys_hostname for client in session_multihost.client]
+    return PkiCertFactory().get_certs(serverlist)
 
 
 @pytest.fixture(scope='function')
 def create_backup(session_multihost, request):
     """ Create backup for necessary files used in test """
     user = "local_anuj"
-    for place in ['subuid', 'subgid']:
-        with pytest.raises(subprocess.CalledProcessError):
-            session_multihost.client[0].run_command(f"grep {user} "
-                                                    f"/etc/{place}")
-    with pytest.raises(subprocess.CalledProcessError):
-        session_multihost.client[0].run_command(f"grep subid "
-                                                f"/etc/nsswitch.conf")
-    for f_file in ['subuid',
-                   'subgid',
-                   'nsswitch.conf',
-                   'shadow',
-                   'group',
-                   'gshadow',
-                   'passwd']:
-        session_multihost.client[0].run_command(f"cp -vf  "
-                                                f"/etc/{f_file} "
-                                                f"/tmp/{f_file}_bkp")
+    client = session_multihost.client[0]
+    precondition = client.run_command(f"! grep {user} /etc/subuid && "
+                                      f"! grep {user} /etc/subgid && "
+                                      f"! grep subid /etc/nsswitch.conf",
+                                      raiseonerr=False)
+    assert precondition.returncode == 0, precondition.stdout_text
+    snapshot = client.snapshot_files([f"/etc/{f_file}" for f_file in
+                                      ['subuid',
+                                       'subgid',
+                                       'nsswitch.conf',
+                                       'shadow',
+                                       'group',
+                                       'gshadow',
+                                       'passwd']])
 
     def restore():
         """ Restore files """
-        for f_file in ['subuid',
-                       'subgid',
-                       'nsswitch.conf',
-                       'shadow',
-                       'group',
-                       'gshadow',
-                       'passwd']:
-            session_multihost.client[0].run_command(f"mv -vf  "
-                                                    f"/tmp/{f_file}_bkp "
-                                                    f"/etc/{f_file}")
+        client.restore_files(snapshot)
+    request.addfinalizer(restore)
+
+
+@pytest.fixture(scope='function')
+def sandbox(session_multihost, request):
+    """ Sandboxed client: commands and file transfers of the test run in
+    a mount namespace of its own where /etc, /home and the mail spools
+    are overlays, changes are thrown away on teardown, see
+    QeHost.sandbox_start """
+    client = session_multihost.client[0].sandbox_start(
+        paths=['/etc', '/home', '/var/spool/mail'])
+    request.addfinalizer(client.sandbox_stop)
+    return client
+
+
+@pytest.fixture(scope='function')
+def shadow_perf(session_multihost, request):
+    """ Benchmark helper, the local databases are restored on teardown """
+    client = session_multihost.client[0]
+    snapshot = client.snapshot_files(SHADOW_FILES)
+
+    def restore():
+        """ Restore databases and remove mail spools of benchmark users """
+        client.restore_files(snapshot)
+        client.run_command("rm -f /var/spool/mail/perf*", raiseonerr=False)
     request.addfinalizer(restore)
+    return ShadowPerf(client)
 
 
 @pytest.fixture(scope='function')
@@ -156,6 +233,7 @@ def setup_session(session_multihost, request):
     :param obj session_multihost: multihost object
     :param obj request: pytest request object
     """
-    execute_cmd(session_multihost, "yum update -y shadow-utils")
-    execute_cmd(session_multihost, 'yum install -y expect')
-    execute_cmd(session_multihost, 'yum install -y libeconf*')
+    packages = required_packages(request.session.items,
+                                 base=['expect', 'libeconf*'])
+    PackageProvisioner(session_multihost.client).provision(
+        install=packages, update=['shadow-utils'], enablerepo=crb_repos)
@@ -1,5 +1,10 @@
 #include <stdio.h>
 #include <string.h>
+#include <errno.h>
+#include <stdint.h>
+#include <time.h>
+#include <unistd.h>
+#include <pthread.h>
 #include "shadow/subid.h"
 #include "stdlib.h"
 #if !defined(SUBID_ABI_MAJOR) || (SUBID_ABI_MAJOR < 4)
@@ -7,17 +12,234 @@
 #define subid_get_uid_ranges get_subuid_ranges
 #endif
 
+/* log2 buckets of the latency histogram, bucket i counts calls < 2^i ns */
+#define BUCKETS 40
+
 const char *Prog;
 FILE *shadow_logfd = NULL;
 
+struct bench {
+	const char **owners;
+	size_t nowners;
+	long iterations;
+	int group;
+	int serialize;
+	pthread_mutex_t lock;
+};
+
+struct worker {
+	struct bench *bench;
+	uint64_t *latencies;
+	size_t calls;
+	size_t failures;
+	pthread_t thread;
+};
+
 void usage(void)
 {
 	fprintf(stderr, "Usage: %s [-g] user\n", Prog);
 	fprintf(stderr, "    list subuid ranges for user\n");
 	fprintf(stderr, "    pass -g to list subgid ranges\n");
+	fprintf(stderr, "       %s -b [-g] [-i iterations] [-t threads] "
+		"[user...]\n", Prog);
+	fprintf(stderr, "    time lookups of users (read from stdin if none)"
+		" in one process\n");
+	fprintf(stderr, "    and print latency statistics as JSON, threads "
+		"look up one at a time\n");
 	exit(EXIT_FAILURE);
 }
 
+static uint64_t now_ns(void)
+{
+	struct timespec ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return (uint64_t)ts.tv_sec * 1000000000ULL + ts.tv_nsec;
+}
+
+static void *run_worker(void *arg)
+{
+	struct worker *worker = arg;
+	struct bench *bench = worker->bench;
+	struct subid_range *ranges;
+	uint64_t start;
+	long i;
+	size_t j;
+	int count;
+
+	for (i = 0; i < bench->iterations; i++) {
+		for (j = 0; j < bench->nowners; j++) {
+			ranges = NULL;
+			if (bench->serialize)
+				pthread_mutex_lock(&bench->lock);
+			start = now_ns();
+			if (bench->group)
+				count = subid_get_gid_ranges(bench->owners[j],
+							     &ranges);
+			else
+				count = subid_get_uid_ranges(bench->owners[j],
+							     &ranges);
+			worker->latencies[worker->calls++] = now_ns() - start;
+			if (bench->serialize)
+				pthread_mutex_unlock(&bench->lock);
+			if (!ranges || count < 0)
+				worker->failures++;
+			free(ranges);
+		}
+	}
+	return NULL;
+}
+
+static int compare_u64(const void *a, const void *b)
+{
+	uint64_t x = *(const uint64_t *)a, y = *(const uint64_t *)b;
+
+	return (x > y) - (x < y);
+}
+
+static const char **read_owners(size_t *nowners)
+{
+	const char **owners = NULL;
+	char *line = NULL;
+	size_t size = 0, allocated = 0;
+	ssize_t len;
+
+	*nowners = 0;
+	while ((len = getline(&line, &size, stdin)) != -1) {
+		while (len > 0 && (line[len - 1] == '\n' || line[len - 1] == ' '))
+			line[--len] = '\0';
+		if (len == 0)
+			continue;
+		if (*nowners == allocated) {
+			allocated = allocated ? allocated * 2 : 64;
+			owners = realloc(owners, allocated * sizeof(*owners));
+			if (!owners) {
+				perror("realloc");
+				exit(EXIT_FAILURE);
+			}
+		}
+		owners[(*nowners)++] = strdup(line);
+	}
+	free(line);
+	return owners;
+}
+
+static int benchmark(int argc, char *argv[])
+{
+	struct bench bench = { NULL, 0, 1000, 0, 0,
+			       PTHREAD_MUTEX_INITIALIZER };
+	struct worker *workers;
+	uint64_t *all, histogram[BUCKETS] = { 0 }, total = 0, wall;
+	size_t calls = 0, failures = 0, n, k;
+	int opt, threads = 1, t, bucket, first = 1;
+
+	optind = 2;
+	while ((opt = getopt(argc, argv, "gi:t:")) != -1) {
+		switch (opt) {
+		case 'g':
+			bench.group = 1;
+			break;
+		case 'i':
+			bench.iterations = atol(optarg);
+			break;
+		case 't':
+			threads = atoi(optarg);
+			break;
+		default:
+			usage();
+		}
+	}
+	if (bench.iterations < 1 || threads < 1)
+		usage();
+	/* the files backend keeps the database in library globals and is
+	 * not thread-safe, concurrent lookups would race */
+	bench.serialize = threads > 1;
+	if (optind < argc) {
+		bench.owners = (const char **)&argv[optind];
+		bench.nowners = argc - optind;
+	} else {
+		bench.owners = read_owners(&bench.nowners);
+	}
+	if (bench.nowners == 0)
+		usage();
+
+	workers = calloc(threads, sizeof(*workers));
+	if (!workers) {
+		perror("calloc");
+		return EXIT_FAILURE;
+	}
+	for (t = 0; t < threads; t++) {
+		workers[t].bench = &bench;
+		workers[t].latencies = malloc(bench.iterations * bench.nowners *
+					      sizeof(uint64_t));
+		if (!workers[t].latencies) {
+			perror("malloc");
+			return EXIT_FAILURE;
+		}
+	}
+	wall = now_ns();
+	for (t = 0; t < threads; t++) {
+		errno = pthread_create(&workers[t].thread, NULL, run_worker,
+				       &workers[t]);
+		if (errno) {
+			perror("pthread_create");
+			exit(EXIT_FAILURE);
+		}
+	}
+	for (t = 0; t < threads; t++)
+		pthread_join(workers[t].thread, NULL);
+	wall = now_ns() - wall;
+
+	n = (size_t)threads * bench.iterations * bench.nowners;
+	all = malloc(n * sizeof(uint64_t));
+	if (!all) {
+		perror("malloc");
+		return EXIT_FAILURE;
+	}
+	for (t = 0; t < threads; t++) {
+		memcpy(all + calls, workers[t].latencies,
+		       workers[t].calls * sizeof(uint64_t));
+		calls += workers[t].calls;
+		failures += workers[t].failures;
+		free(workers[t].latencies);
+	}
+	free(workers);
+	qsort(all, calls, sizeof(uint64_t), compare_u64);
+	for (k = 0; k < calls; k++) {
+		total += all[k];
+		for (bucket = 0; bucket < BUCKETS - 1 &&
+		     all[k] >= (1ULL << bucket); bucket++)
+			;
+		histogram[bucket]++;
+	}
+
+	printf("{\"type\": \"%s\", \"owners\": %zu, \"iterations\": %ld, "
+	       "\"threads\": %d, \"serialized\": %s, \"calls\": %zu, "
+	       "\"failures\": %zu, \"wall_ns\": %llu, \"total_ns\": %llu, "
+	       "\"min_ns\": %llu, \"max_ns\": %llu, \"mean_ns\": %llu, "
+	       "\"p50_ns\": %llu, \"p90_ns\": %llu, \"p99_ns\": %llu, "
+	       "\"histogram\": [",
+	       bench.group ? "gid" : "uid", bench.nowners, bench.iterations,
+	       threads, bench.serialize ? "true" : "false", calls, failures,
+	       (unsigned long long)wall, (unsigned long long)total,
+	       (unsigned long long)all[0],
+	       (unsigned long long)all[calls - 1],
+	       (unsigned long long)(total / calls),
+	       (unsigned long long)all[(calls - 1) / 2],
+	       (unsigned long long)all[(calls - 1) * 90 / 100],
+	       (unsigned long long)all[(calls - 1) * 99 / 100]);
+	for (bucket = 0; bucket < BUCKETS; bucket++) {
+		if (!histogram[bucket])
+			continue;
+		printf("%s{\"lt_ns\": %llu, \"count\": %llu}", first ? "" : ", ",
+		       1ULL << bucket, (unsigned long long)histogram[bucket]);
+		first = 0;
+	}
+	printf("]}\n");
+	free(all);
+	return failures ? EXIT_FAILURE : EXIT_SUCCESS;
+}
+
 int main(int argc, char *argv[])
 {
 	int i, count=0;
@@ -28,6 +250,8 @@ int main(int argc, char *argv[])
 	shadow_logfd = stderr;
 	if (argc < 2)
 		usage();
+	if (strcmp(argv[1], "-b") == 0)
+		return benchmark(argc, argv);
 	owner = argv[1];
 	if (argc == 3 && strcmp(argv[1], "-g") == 0) {
 		owner = argv[2];
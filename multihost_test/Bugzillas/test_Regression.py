@@ -11,7 +11,6 @@ from __future__ import print_function
 import pytest
 import subprocess
 import os
-import time
 import re
 from sssd.testlib.common.utils import SSHClient, sssdTools
 
@@ -617,41 +616,46 @@ class TestShadowUtilsRegression():
 
         # Test that newuidmap and newgidmap works without altering the capability bounding set
         ssh1 = SSHClient(multihost.client[0].ip, username="testUser1", password=password)
+        client.run_command(f"rm -f {pidfile}")
         (r, r2, r3) = ssh1.exec_command(f"unshare -U bash -c 'grep PPid /proc/self/status | "
                                         f"cut -f 2 ; sleep 30' >{pidfile} &")
-        time.sleep(2)
+        client.wait_for_file(pidfile, pattern='^[0-9]+$', timeout=30)
         assert subuid not in client.run_command(f'cat "/proc/$(cat {pidfile})/uid_map"').stdout_text
         client.run_command(f"runuser -u testUser1 -- newuidmap $(cat {pidfile}) {testUserUid} {subuid} 10")
         assert subuid in client.run_command(f'cat "/proc/$(cat {pidfile})/uid_map"').stdout_text
 
+        client.run_command(f"rm -f {pidfile}")
         (r1, r2, r3) = ssh1.exec_command(f"unshare -U bash -c 'grep PPid /proc/self/status | "
                                          f"cut -f 2 ; sleep 30' >{pidfile} &")
-        time.sleep(2)
+        client.wait_for_file(pidfile, pattern='^[0-9]+$', timeout=30)
         assert subgid not in client.run_command(f'cat "/proc/$(cat {pidfile})/gid_map"').stdout_text
         client.run_command(f"runuser -u testUser1 -- newgidmap $(cat {pidfile}) {testUserGid} {subgid} 10")
         assert subuid in client.run_command(f'cat "/proc/$(cat {pidfile})/gid_map"').stdout_text
 
         # Test that newuidmap and newgidmap does not allow mapping subuids outside of allowed range
+        client.run_command(f"rm -f {pidfile}")
         (r1, r2, r3) = ssh1.exec_command(f"unshare -U bash -c 'grep PPid /proc/self/status | "
                                          f"cut -f 2 ; sleep 30' >{pidfile} &")
-        time.sleep(2)
+        client.wait_for_file(pidfile, pattern='^[0-9]+$', timeout=30)
         assert subuid not in client.run_command(f'cat "/proc/$(cat {pidfile})/uid_map"').stdout_text
         with pytest.raises(Exception):
             client.run_command(f"runuser -u testUser1 -- newuidmap $(cat {pidfile}) {testUserUid} {subuid} 1 10")
         assert subuid not in client.run_command(f'cat "/proc/$(cat {pidfile})/uid_map"').stdout_text
 
+        client.run_command(f"rm -f {pidfile}")
         (r1, r2, r3) = ssh1.exec_command(f"unshare -U bash -c 'grep PPid /proc/self/status | "
                                          f"cut -f 2 ; sleep 30' >{pidfile} &")
-        time.sleep(2)
+        client.wait_for_file(pidfile, pattern='^[0-9]+$', timeout=30)
         assert subgid not in client.run_command(f'cat "/proc/$(cat {pidfile})/gid_map"').stdout_text
         with pytest.raises(Exception):
             client.run_command(f"runuser -u testUser1 -- newgidmap $(cat {pidfile}) {testUserGid} {subgid} 1 10")
         assert subuid not in client.run_command(f'cat "/proc/$(cat {pidfile})/gid_map"').stdout_text
 
         # Test that newuidmap and newgidmap works when called from process with cap_sys_admin removed from bounding set
+        client.run_command(f"rm -f {pidfile}")
         (r1, r2, r3) = ssh1.exec_command(f"unshare -U bash -c 'grep PPid /proc/self/status | "
                                          f"cut -f 2 ; sleep 30' >{pidfile} &")
-        time.sleep(2)
+        client.wait_for_file(pidfile, pattern='^[0-9]+$', timeout=30)
         assert subuid not in client.run_command(f'cat "/proc/$(cat {pidfile})/uid_map"').stdout_text
         client.run_command(f"capsh --gid={testUserGid} "
                            f"--groups= --drop=cap_sys_admin "
@@ -660,9 +664,10 @@ class TestShadowUtilsRegression():
                            f"'$(cat {pidfile})' {testUserUid} '{subuid}' 10'")
         assert subuid in client.run_command(f'cat "/proc/$(cat {pidfile})/uid_map"').stdout_text
 
+        client.run_command(f"rm -f {pidfile}")
         (r1, r2, r3) = ssh1.exec_command(f"unshare -U bash -c 'grep PPid /proc/self/status | "
                                          f"cut -f 2 ; sleep 30' >{pidfile} &")
-        time.sleep(2)
+        client.wait_for_file(pidfile, pattern='^[0-9]+$', timeout=30)
         assert subgid not in client.run_command(f'cat "/proc/$(cat {pidfile})/gid_map"').stdout_text
         client.run_command(f"capsh --gid={testUserGid} "
                            f"--groups= --drop=cap_sys_admin "
@@ -191,7 +191,10 @@ class TestShadowBz(object):
         # Trying no password with sg
         cmd = execute_cmd(multihost, "sh /tmp/bz_667593_4.sh")
         execute_cmd(multihost, "groupdel tgroup00011")
-        execute_cmd(multihost, "pkill -U tuser0011 && sleep 5 || :")
+        execute_cmd(multihost, "pkill -U tuser0011 || :")
+        multihost.client[0].wait_for_command("pgrep -U tuser0011",
+                                             returncode=1, timeout=30,
+                                             raiseonerr=False)
         multihost.client[0].run_command("userdel -r tuser0011", raiseonerr=False)
         execute_cmd(multihost, "rm -vf /tmp/bz_667593*")
         for data_1 in ['tgroup00011', 'groups=', 'tuser0011', 'logout']:
@@ -0,0 +1,89 @@
+"""
+Shadow Utils Performance Test Cases
+
+:requirement: shadow-utils
+:casecomponent: shadow-utils
+:subsystemteam: sst_idm_sssd
+:status: approved
+"""
+
+import pytest
+from sssd.testlib.common.shadowperf import FIRST_ID, SHADOW_FILES
+from sssd.testlib.common.shadowperf import perf_sizes
+
+# number of input lines fed to newusers and chpasswd
+SIZES = perf_sizes('QE_PERF_BULK_SIZES', '10000,100000')
+HOMES = '/tmp/qe-perf-homes'
+
+
+@pytest.mark.perf
+@pytest.mark.packages('time', 'strace')
+class TestBulkProvisioning(object):
+    """
+    newusers and chpasswd with large generated input
+    """
+
+    @pytest.mark.parametrize("method,rounds",
+                             [("SHA512", None),
+                              ("SHA512", 50000),
+                              ("YESCRYPT", None),
+                              ("YESCRYPT", 7)],
+                             ids=["sha512", "sha512-50000",
+                                  "yescrypt", "yescrypt-7"])
+    def test_newusers_chpasswd(self, multihost, shadow_perf, method, rounds):
+        """newusers and chpasswd throughput, peak RSS and /etc/shadow lock
+        and rename cycles per hash method
+
+        :title: Bulk provisioning benchmark for newusers and chpasswd
+        :id: cb46994c-cbbc-11f1-ae49-02fc00000001
+        :steps:
+          1. Create users from a generated newusers file with the hash
+             method and rounds
+          2. Change their passwords from a generated chpasswd file
+          3. Restore the databases and repeat both on a sample of the
+             input under strace to count locks and renames of /etc/shadow
+        :expectedresults:
+          1. Should succeed, the test is skipped if chpasswd does not
+             support the hash method
+          2. Should succeed, passwords are hashed with the method
+          3. Results are written per shadow-utils build
+        """
+        client = multihost.client[0]
+        options = '-c %s' % method
+        if rounds:
+            options += ' -s %d' % rounds
+        prefix = {'SHA512': '$6$', 'YESCRYPT': '$y$'}[method]
+        if not shadow_perf.hash_supported(method):
+            pytest.skip('%s is not supported by chpasswd' % method)
+        results = {}
+        for size in SIZES:
+            users = ['perfbulk%d' % num for num in range(size)]
+            newusers = ['%s:Secret123:%d:%d::%s/%s:/sbin/nologin' % (
+                user, FIRST_ID + num, FIRST_ID + num, HOMES, user)
+                for num, user in enumerate(users)]
+            chpasswd = ['%s:Secret%d' % (user, num)
+                        for num, user in enumerate(users)]
+            snapshot = client.snapshot_files(SHADOW_FILES)
+            # newusers creates the homes with mkdir, not mkdir -p
+            client.run_command('mkdir -p %s' % HOMES)
+            step = {
+                'newusers': shadow_perf.bulk('newusers %s' % options,
+                                             newusers),
+                'chpasswd': shadow_perf.bulk('chpasswd %s' % options,
+                                             chpasswd)}
+            cmd = client.run_command('getent shadow %s' % users[-1])
+            assert cmd.stdout_text.split(':')[1].startswith(prefix)
+            client.run_command('rm -rf %s' % HOMES)
+            client.restore_files(snapshot, discard=False)
+            client.run_command('mkdir -p %s' % HOMES)
+            step['newusers'].update(shadow_perf.lock_cycles(
+                'newusers %s' % options, newusers))
+            step['chpasswd'].update(shadow_perf.lock_cycles(
+                'chpasswd %s' % options, chpasswd))
+            client.run_command('rm -rf %s' % HOMES)
+            client.restore_files(snapshot)
+            results[size] = step
+        name = 'bulk-%s' % method.lower()
+        if rounds:
+            name += '-%d' % rounds
+        shadow_perf.save_scaling(name, SIZES, results)
@@ -0,0 +1,80 @@
+"""
+Shadow Utils Performance Test Cases
+
+:requirement: shadow-utils
+:casecomponent: shadow-utils
+:subsystemteam: sst_idm_sssd
+:status: approved
+"""
+
+import pytest
+from sssd.testlib.common.shadowperf import FIRST_ID, OPS, perf_sizes
+
+# members of the group the operations are measured against
+SIZES = perf_sizes('QE_PERF_MEMBER_SIZES', '1000,10000,50000')
+GROUP = 'perfbig'
+
+
+@pytest.mark.perf
+class TestGroupMembership(object):
+    """
+    gpasswd/groupmems/usermod -aG on groups with many members
+    """
+
+    def test_large_group(self, multihost, shadow_perf):
+        """Membership operation and lookup latency versus number of
+        group members
+
+        :title: Large group membership scaling benchmark
+        :id: 04e9a02c-cbbd-11f1-9a96-02fc00000001
+        :steps:
+          1. Set the members of one group to the next size
+          2. Time gpasswd -a, groupmems -a and usermod -aG of new
+             members and gpasswd -d of them
+          3. Time id of a member and getent group of the group
+          4. Record the length of the group line
+          5. Fit the growth of the mean latency over the sizes
+        :expectedresults:
+          1. Should succeed
+          2. All operations succeed
+          3. All lookups succeed
+          4. Should succeed
+          5. Results are written per shadow-utils build
+        """
+        client = multihost.client[0]
+        users = shadow_perf.populate(max(SIZES) + 3 * OPS, FIRST_ID,
+                                     prefix='perfmem')
+        client.run_command('groupadd %s' % GROUP)
+        gpasswd = users[-3 * OPS:-2 * OPS]
+        groupmems = users[-2 * OPS:-OPS]
+        usermod = users[-OPS:]
+        results = {}
+        for size in SIZES:
+            shadow_perf.set_members(GROUP, users[:size])
+            step = {
+                'gpasswd_add': shadow_perf.benchmark(
+                    ['gpasswd -a %s %s' % (user, GROUP)
+                     for user in gpasswd]),
+                'groupmems_add': shadow_perf.benchmark(
+                    ['groupmems -g %s -a %s' % (GROUP, user)
+                     for user in groupmems]),
+                'usermod_add': shadow_perf.benchmark(
+                    ['usermod -aG %s %s' % (GROUP, user)
+                     for user in usermod]),
+                'id': shadow_perf.benchmark(
+                    ['id %s' % users[0]] * OPS),
+                'getent_group': shadow_perf.benchmark(
+                    ['getent -s files group %s' % GROUP] * OPS),
+                'gpasswd_del': shadow_perf.benchmark(
+                    ['gpasswd -d %s %s' % (user, GROUP)
+                     for user in gpasswd])}
+            for operation, stats in step.items():
+                assert stats['failures'] == 0, operation
+            cmd = client.run_command('getent -s files group %s' % GROUP,
+                                     log_stdout=False)
+            members = cmd.stdout_text.strip().split(':')[-1].split(',')
+            assert len(members) == size + 2 * OPS
+            assert usermod[-1] in members and gpasswd[0] not in members
+            step['line_length'] = len(cmd.stdout_text.strip())
+            results[size] = step
+        shadow_perf.save_scaling('group-membership', SIZES, results)
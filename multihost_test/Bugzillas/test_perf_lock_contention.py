@@ -0,0 +1,75 @@
+"""
+Shadow Utils Performance Test Cases
+
+:requirement: shadow-utils
+:casecomponent: shadow-utils
+:subsystemteam: sst_idm_sssd
+:status: approved
+"""
+
+import os
+import pytest
+from sssd.testlib.common.shadowperf import SHADOW_FILES, perf_sizes
+
+# numbers of concurrent writers, 1 gives the uncontended baseline
+WRITERS = perf_sizes('QE_PERF_WRITERS', '1,2,4,8,16')
+# seconds every number of writers runs
+DURATION = int(os.environ.get('QE_PERF_STRESS_SECONDS', '60'))
+
+
+def integrity(multihost):
+    """ Return return codes and findings of pwck -r and grpck -r """
+    report = {}
+    for check in ('pwck -r', 'grpck -r'):
+        cmd = multihost.client[0].run_command(check, raiseonerr=False)
+        report[check] = (cmd.returncode,
+                         sorted(set(cmd.stdout_text.splitlines())))
+    return report
+
+
+@pytest.mark.perf
+class TestLockContention(object):
+    """
+    Concurrent useradd/usermod/gpasswd/groupmod writers
+    """
+
+    def test_concurrent_writers(self, multihost, shadow_perf):
+        """Throughput, lock wait and failures of concurrent writers of
+        the local databases
+
+        :title: Concurrent useradd lock-contention stress harness
+        :id: f0eecc1e-cbbc-11f1-8c8c-02fc00000001
+        :steps:
+          1. Run K writers doing useradd, usermod, gpasswd -a and
+             groupmod for the duration, for every K
+          2. Classify failures as lock timeouts, EBUSY or other
+          3. Check the databases with pwck -r and grpck -r after every K
+        :expectedresults:
+          1. Should succeed
+          2. Failure rate is recorded per K
+          3. pwck -r and grpck -r report the same as before the writers
+        """
+        client = multihost.client[0]
+        before = integrity(multihost)
+        results = {}
+        baseline = None
+        for writers in WRITERS:
+            user = 'perfst%d_${w}_$n' % writers
+            group = 'perfstg%d_' % writers
+            operations = [
+                ('useradd', 'useradd -M -d /tmp %s' % user),
+                ('usermod', 'usermod -c stress %s' % user),
+                ('gpasswd', 'gpasswd -a %s %s$w' % (user, group)),
+                ('groupmod', "groupmod -p '!' %s$w" % group)]
+            snapshot = client.snapshot_files(SHADOW_FILES)
+            results[writers] = shadow_perf.stress(operations, writers,
+                                                  DURATION, group=group,
+                                                  baseline=baseline)
+            assert integrity(multihost) == before, \
+                'databases damaged by %d writers' % writers
+            client.restore_files(snapshot)
+            if writers == 1:
+                baseline = dict(
+                    (name, stats['p50']) for name, stats in
+                    results[writers]['operations'].items())
+        shadow_perf.save('lock-contention', results)
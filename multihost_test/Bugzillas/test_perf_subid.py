@@ -0,0 +1,105 @@
+"""
+Shadow Utils Performance Test Cases
+
+:requirement: shadow-utils
+:casecomponent: shadow-utils
+:subsystemteam: sst_idm_sssd
+:status: approved
+"""
+
+import pytest
+from sssd.testlib.common.shadowperf import OPS, perf_sizes
+
+# subuid/subgid ranges the operations are measured against
+SIZES = perf_sizes('QE_PERF_SUBID_SIZES', '1000,10000,50000')
+# ranges are laid out from SUB_UID_MIN of login.defs without gaps, so
+# allocation has to skip all of them; the maximum leaves room for 65k
+SUBID_MIN = 100000
+SUBID_SIZE = 65536
+SUBID_MAX = 4294967294
+
+
+@pytest.mark.perf
+@pytest.mark.packages('shadow-utils*', 'gcc')
+class TestSubidScaling(object):
+    """
+    Subordinate id allocation and lookup versus number of ranges
+    """
+
+    @pytest.mark.parametrize("subid_db",
+                             ["",
+                              "subid: files",
+                              "subid: sss"],)
+    def test_subid_ranges(self, multihost, shadow_perf,
+                          compile_list_subid_ranges, subid_db):
+        """useradd subid allocation, usermod --add-subuids, getsubids and
+        libsubid lookup latency versus number of subid ranges
+
+        :title: Subordinate ID allocation scaling benchmark
+        :id: 2740837a-cbbd-11f1-812d-02fc00000001
+        :steps:
+          1. Fill /etc/subuid and /etc/subgid up to the next size with
+             the subid source of nsswitch.conf
+          2. Time getsubids, getsubids -g and list_subid_ranges of the
+             last owner, and libsubid lookups of it in one process
+          3. With files as source, time useradd allocating subids
+             and usermod --add-subuids
+          4. Fit the growth of the mean latency over the sizes
+        :expectedresults:
+          1. Should succeed
+          2. Lookups succeed with files as source, failures of other
+             sources are recorded
+          3. All operations succeed, users get ranges after the
+             populated ones
+          4. Results are written per shadow-utils build and source
+        """
+        client = multihost.client[0]
+        if subid_db != "":
+            client.run_command(f"echo '{subid_db}' >> /etc/nsswitch.conf")
+        files = subid_db in ("", "subid: files")
+        limits = '-K SUB_UID_MIN=%d -K SUB_UID_MAX=%d ' \
+                 '-K SUB_GID_MIN=%d -K SUB_GID_MAX=%d' % (
+                     SUBID_MIN, SUBID_MAX, SUBID_MIN, SUBID_MAX)
+        results = {}
+        populated = 0
+        for size in SIZES:
+            owners = shadow_perf.populate_subids(
+                size - populated, SUBID_MIN + populated * SUBID_SIZE,
+                SUBID_SIZE, first=populated)
+            populated = size
+            owner = owners[-1]
+            step = {
+                'getsubids': shadow_perf.benchmark(
+                    ['getsubids %s' % owner] * OPS),
+                'getsubids_g': shadow_perf.benchmark(
+                    ['getsubids -g %s' % owner] * OPS),
+                'list_subid_ranges': shadow_perf.benchmark(
+                    ['/tmp/list_subid_ranges %s' % owner] * OPS),
+                'libsubid': compile_list_subid_ranges([owner],
+                                                      iterations=10 * OPS)}
+            if files:
+                users = ['perfsubnew%d' % num for num in range(OPS)]
+                # ids past the ranges useradd is going to allocate
+                explicit = SUBID_MIN + (size + OPS) * SUBID_SIZE
+                snapshot = client.snapshot_files(['/etc/passwd',
+                                                  '/etc/shadow',
+                                                  '/etc/group',
+                                                  '/etc/gshadow',
+                                                  '/etc/subuid',
+                                                  '/etc/subgid'])
+                step['useradd'] = shadow_perf.benchmark(
+                    ['useradd -M %s %s' % (limits, user) for user in users])
+                step['usermod_add_subuids'] = shadow_perf.benchmark(
+                    ['usermod --add-subuids %d-%d %s' % (
+                        explicit + num * SUBID_SIZE,
+                        explicit + (num + 1) * SUBID_SIZE - 1, user)
+                     for num, user in enumerate(users)])
+                cmd = client.run_command('getsubids %s' % users[-1])
+                assert str(SUBID_MIN + (size + OPS - 1) * SUBID_SIZE) in \
+                    cmd.stdout_text
+                client.restore_files(snapshot)
+                for operation, stats in step.items():
+                    assert stats['failures'] == 0, operation
+            results[size] = step
+        source = subid_db.split(':')[-1].strip() or 'default'
+        shadow_perf.save_scaling('subid-%s' % source, SIZES, results)
@@ -0,0 +1,83 @@
+"""
+Shadow Utils Performance Test Cases
+
+:requirement: shadow-utils
+:casecomponent: shadow-utils
+:subsystemteam: sst_idm_sssd
+:status: approved
+"""
+
+import pytest
+from sssd.testlib.common.shadowperf import FIRST_ID, OPS, perf_sizes
+
+# number of local users and groups the operations are measured against
+SIZES = perf_sizes('QE_PERF_SIZES', '1000,10000,100000')
+
+
+@pytest.mark.perf
+class TestUserDatabaseScaling(object):
+    """
+    useradd/usermod/userdel/groupadd/groupdel versus database size
+    """
+
+    def test_user_group_ops(self, multihost, shadow_perf):
+        """useradd, usermod, userdel, groupadd and groupdel latency versus
+        number of local users and groups
+
+        :title: useradd/userdel throughput versus database size
+        :id: a460fb4c-cbbc-11f1-9a1b-02fc00000001
+        :steps:
+          1. Populate /etc/passwd, shadow, group and gshadow up to the
+             next size with a bulk append
+          2. Time useradd, usermod -c and userdel of new users
+          3. Time useradd searching a free UID below a full UID_MAX,
+             as covered by test_bz_1994269
+          4. Time groupadd and groupdel of new groups
+          5. Fit the growth of the mean latency over the sizes
+        :expectedresults:
+          1. Should succeed
+          2. All operations succeed
+          3. All operations succeed, users get UIDs below the
+             populated range
+          4. All operations succeed
+          5. Results are written per shadow-utils build
+        """
+        client = multihost.client[0]
+        results = {}
+        populated = 0
+        for size in SIZES:
+            # populated ids start OPS above FIRST_ID, leaving room
+            # for the free UID search below them
+            shadow_perf.populate(size - populated,
+                                 FIRST_ID + OPS + populated,
+                                 prefix='perf%d_' % size)
+            populated = size
+            users = ['perfnew%d' % num for num in range(OPS)]
+            groups = ['perfgrp%d' % num for num in range(OPS)]
+            free = ['perffree%d' % num for num in range(OPS)]
+            # UID_MAX is the highest populated uid, so useradd has to
+            # search the range for unused ids
+            limits = '-K UID_MIN=%d -K UID_MAX=%d -K GID_MIN=%d ' \
+                     '-K GID_MAX=%d' % (FIRST_ID, FIRST_ID + OPS + size - 1,
+                                        FIRST_ID, FIRST_ID + OPS + size - 1)
+            step = {
+                'useradd': shadow_perf.benchmark(
+                    ['useradd -M %s' % user for user in users]),
+                'usermod': shadow_perf.benchmark(
+                    ['usermod -c perf %s' % user for user in users]),
+                'userdel': shadow_perf.benchmark(
+                    ['userdel %s' % user for user in users]),
+                'useradd_free_uid': shadow_perf.benchmark(
+                    ['useradd -M %s %s' % (limits, user) for user in free]),
+                'groupadd': shadow_perf.benchmark(
+                    ['groupadd %s' % group for group in groups]),
+                'groupdel': shadow_perf.benchmark(
+                    ['groupdel %s' % group for group in groups])}
+            cmd = client.run_command('id -u %s' % free[-1])
+            assert FIRST_ID <= int(cmd.stdout_text) < FIRST_ID + OPS
+            client.run_command('for user in %s; do userdel $user; done'
+                               % ' '.join(free))
+            for operation, stats in step.items():
+                assert stats['failures'] == 0, operation
+            results[size] = step
+        shadow_perf.save_scaling('user-database', SIZES, results)
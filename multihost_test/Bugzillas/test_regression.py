@@ -73,7 +73,7 @@ class TestShadowUtilsRegressions():
         cmd = multihost.client[0].run_command("semanage login -l")
         assert 'user_11' not in cmd.stdout_text
 
-    def test_bz_1220504(self, multihost):
+    def test_bz_1220504(self, sandbox):
         """BZ#1220504 (usermod -p allowing colon in encrypted)
 
         :title: BZ#1220504 (usermod -p allowing colon in encrypted)
@@ -90,8 +90,7 @@ class TestShadowUtilsRegressions():
           3. Should not succeed
         """
         user = "bz1220504"
-        client = multihost.client[0]
-        client.run_command("cp -vf /etc/shadow /etc/shadow_anuj")
+        client = sandbox
         client.run_command(f"useradd {user}")
         # Adding user password
         client.run_command(f"echo password123 | passwd --stdin {user}")
@@ -99,8 +98,6 @@ class TestShadowUtilsRegressions():
         with pytest.raises(subprocess.CalledProcessError):
             client.run_command(f"usermod -p 'badPassword:123' {user}")
         cmd2 = client.run_command(f"grep {user} /etc/shadow")
-        client.run_command(f"userdel -rf {user}")
-        client.run_command("cp -vf /etc/shadow_anuj /etc/shadow")
         assert cmd1.returncode == 0
         assert cmd2.returncode == 0
         assert cmd1.stdout_text == cmd2.stdout_text
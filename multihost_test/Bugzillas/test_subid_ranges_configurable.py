@@ -9,7 +9,6 @@ Shadow Utils Test Cases
 
 import pytest
 import subprocess
-import time
 import os
 from sssd.testlib.common.utils import SSHClient
 
@@ -27,6 +26,7 @@ subid_size = "65536"
 
 
 @pytest.mark.usefixtures('compile_list_subid_ranges')
+@pytest.mark.packages('shadow-utils*', 'gcc')
 @pytest.mark.tier1
 class TestSubid(object):
     """
@@ -80,7 +80,8 @@ class TestSubid(object):
         # local_a+ 10131 10105 0 08:30 ? 00:00:00 bash
         # test looks for a most recent 'bash' process
         # started by user local_*
-        time.sleep(3)
+        multihost.client[0].wait_for_command(f"pgrep -u {local_user} -x bash",
+                                             timeout=30)
         find_id = "ps -ef | grep bash | grep local_| tail -1"
         proces_id = [int(word)
                      for word in execute_cmd(multihost,
@@ -7,8 +7,9 @@ except ImportError:
     import configparser as ConfigParser
 import tempfile
 import subprocess
-import socket
-import time
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import ldap
 from sssd.testlib.common.exceptions import DirSrvException
 from sssd.testlib.common.exceptions import LdapException
@@ -18,6 +19,116 @@ DS_USER = 'dirsrv'
 DS_GROUP = 'dirsrv'
 DS_ADMIN = 'admin'
 DS_ROOTDN = 'cn=Directory Manager'
+DS_SNAPSHOT_DIR = os.environ.get('QE_DS_SNAPSHOT_DIR',
+                                 os.path.join(tempfile.gettempdir(),
+                                              'qe-ds-snapshots'))
+DS_PORTS = [389, 1389, 2389, 3389, 4389, 30389, 31389, 32389, 33389,
+            34389, 35389, 36389, 37389, 38389, 39389]
+TLS_PORTS = [636, 1636, 2636, 3636, 4636, 30636, 31636, 32636, 33636,
+             34636, 35636, 36636, 37636, 38636, 39636]
+
+
+class DsPortAllocator(object):
+    """Allocate LDAP and TLS port pairs for DS instances on a host.
+
+    Listening ports of a host are read with one remote ss call (or
+    /proc/net/tcp if ss is missing) on the target itself and cached
+    for the session. Reservations are kept per host and made under a
+    lock, so instances created in parallel, even through different
+    DirSrvWrap objects, never get the same pair.
+    """
+    _lock = threading.Lock()
+    _listening = {}
+    _reserved = {}
+
+    def __init__(self, multihost):
+        """
+        Args:
+            multihost (obj): Multihost object of the DS host
+        """
+        self.multihost = multihost
+        self.hostname = multihost.sys_hostname
+
+    @staticmethod
+    def parse_listening(output):
+        """Parse listening TCP ports from ss -ltn or /proc/net/tcp output.
+
+        Args:
+            output (str): Output of ss -ltnH or /proc/net/tcp{,6}
+
+        Returns:
+            set: Listening port numbers
+        """
+        ports = set()
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) >= 4 and fields[0] == 'LISTEN':
+                # ss: State Recv-Q Send-Q Local-Address:Port Peer:Port
+                port = fields[3].rsplit(':', 1)[-1]
+                if port.isdigit():
+                    ports.add(int(port))
+            elif len(fields) >= 4 and fields[0].endswith(':') and \
+                    fields[3] == '0A':
+                # /proc/net/tcp: sl local_address rem_address st(0A=LISTEN)
+                ports.add(int(fields[1].rsplit(':', 1)[-1], 16))
+        return ports
+
+    def scan(self, refresh=False):
+        """Return listening ports of the host, scanned once per session.
+
+        Args:
+            refresh (bool): Scan again instead of using the cached result
+
+        Returns:
+            set: Listening port numbers
+        """
+        with self._lock:
+            if not refresh and self.hostname in self._listening:
+                return self._listening[self.hostname]
+        scan_cmd = 'ss -ltnH 2>/dev/null || cat /proc/net/tcp /proc/net/tcp6'
+        cmd = self.multihost.run_command(scan_cmd, raiseonerr=False)
+        ports = self.parse_listening(cmd.stdout_text)
+        with self._lock:
+            self._listening[self.hostname] = ports
+        return ports
+
+    def reserve(self, u_port=None, e_port=None):
+        """Reserve a free LDAP and TLS port pair.
+
+        Args:
+            u_port (int): unencrypted LDAP port, picked if None
+            e_port (int): Encrypted port to be used for TLS, picked if None
+
+        Returns:
+            tuple: LDAP and TLS ports
+
+        Exceptions:
+            IndexError: if no port pair is available
+        """
+        listening = self.scan()
+        with self._lock:
+            reserved = self._reserved.setdefault(self.hostname, set())
+            if u_port is None and e_port is None:
+                candidates = zip(DS_PORTS, TLS_PORTS)
+            else:
+                candidates = [(int(u_port), int(e_port))]
+            for ldap_port, ldaps_port in candidates:
+                pair = set([ldap_port, ldaps_port])
+                if pair & listening or pair & reserved:
+                    continue
+                reserved.update(pair)
+                return ldap_port, ldaps_port
+        raise IndexError('No free LDAP/TLS port pair on %s' % self.hostname)
+
+    def release(self, ports):
+        """Release reserved ports.
+
+        Args:
+            ports (list): Ports returned by reserve
+        """
+        with self._lock:
+            reserved = self._reserved.setdefault(self.hostname, set())
+            reserved.difference_update(ports)
 
 
 class DirSrv(object):
@@ -98,8 +209,10 @@ class DirSrv(object):
         Exceptions:
              subprocess.CalledProcessError:
         """
-        self.multihost.transport.put_file(ds_cfg_file, '/tmp/test.cfg')
-        setup_cmd = 'dscreate -v from-file %s' % '/tmp/test.cfg'
+        # instances may be created concurrently, use a per-instance path
+        remote_cfg_file = '/tmp/%s.cfg' % self.ds_inst_name
+        self.multihost.transport.put_file(ds_cfg_file, remote_cfg_file)
+        setup_cmd = 'dscreate -v from-file %s' % remote_cfg_file
         try:
             self.multihost.run_command(setup_cmd)
         except subprocess.CalledProcessError:
@@ -130,6 +243,80 @@ class DirSrv(object):
             self.multihost.log.info("Failed to remove %s instance" % inst_name)
             raise
 
+    def _snapshot_paths(self):
+        """ Return paths making up the instance, relative to / """
+        return ['etc/dirsrv/%s' % self.ds_inst_name,
+                'var/lib/dirsrv/%s' % self.ds_inst_name,
+                'var/log/dirsrv/%s' % self.ds_inst_name,
+                'etc/systemd/system/dirsrv.target.wants/dirsrv@%s.service' %
+                self.instance_name,
+                'etc/openldap/cacerts']
+
+    def create_snapshot(self, archive_path):
+        """Archive config, database and certs of the instance.
+
+        The instance is stopped while the archive is created so that
+        the database files are consistent.
+
+        Args:
+            archive_path (str): Local path of the tar.gz archive
+
+        Returns:
+            str: archive_path
+
+        Exceptions:
+            DirSrvException: if the archive could not be created
+        """
+        remote_archive = '/tmp/%s-snapshot.tar.gz' % self.ds_inst_name
+        snapshot_cmd = 'systemctl stop dirsrv@%s && ' \
+                       'tar --selinux --xattrs --acls -czpf %s -C / ' \
+                       '--ignore-failed-read %s; ret=$?; ' \
+                       'systemctl start dirsrv@%s && exit $ret' % (
+                           self.instance_name, remote_archive,
+                           ' '.join(self._snapshot_paths()),
+                           self.instance_name)
+        cmd = self.multihost.run_command(snapshot_cmd, raiseonerr=False)
+        if cmd.returncode != 0:
+            raise DirSrvException('Failed to snapshot %s instance' %
+                                  self.ds_inst_name)
+        tmp_path = '%s.tmp' % archive_path
+        self.multihost.transport.get_file(remote_archive, tmp_path)
+        os.rename(tmp_path, archive_path)
+        self.multihost.run_command(['rm', '-f', remote_archive],
+                                   raiseonerr=False)
+        return archive_path
+
+    def restore_snapshot(self, archive_path):
+        """Restore the instance from an archive of create_snapshot.
+
+        Args:
+            archive_path (str): Local path of the tar.gz archive
+
+        Returns:
+            bool: True if the instance was restored and started
+
+        Exceptions:
+            DirSrvException: if the instance could not be restored
+        """
+        remote_archive = '/tmp/%s-snapshot.tar.gz' % self.ds_inst_name
+        self.multihost.transport.put_file(archive_path, remote_archive)
+        # non default ports have to be labeled ldap_port_t again
+        label_ports = ''.join(
+            'semanage port -a -t ldap_port_t -p tcp %s 2>/dev/null; ' % port
+            for port in (self.dsldap_port, self.dstls_port)
+            if port and int(port) not in (389, 636))
+        restore_cmd = 'tar --selinux --xattrs --acls -xzpf %s -C / && ' \
+                      '{ %s true; } && systemctl daemon-reload && ' \
+                      'systemctl start dirsrv@%s; ret=$?; ' \
+                      'rm -f %s; exit $ret' % (remote_archive, label_ports,
+                                               self.instance_name,
+                                               remote_archive)
+        cmd = self.multihost.run_command(restore_cmd, raiseonerr=False)
+        if cmd.returncode != 0:
+            raise DirSrvException('Failed to restore %s instance' %
+                                  self.ds_inst_name)
+        return True
+
     def _copy_pkcs12(self, ssl_dir):
         """ Copy the pkcs12 files from ssl_dir to
         DS instance directory """
@@ -341,6 +528,7 @@ class DirSrvWrap(object):
         """
         self.ds_used_ports = {}
         self.dirsrv_info = {}
+        self.dirsrv_objs = {}
         self.dirsrv_obj = None
         self.ds_instance_name = None
         self.multihost = multihost_obj
@@ -354,6 +542,8 @@ class DirSrvWrap(object):
         if self.ssl:
             self.ssl_dir = ssldb
         self.canick = canick
+        self.port_allocator = DsPortAllocator(self.multihost)
+        self._lock = threading.Lock()
 
     def __iter__(self):
         """ iter values of each instance """
@@ -409,6 +599,8 @@ class DirSrvWrap(object):
         try:
             self._validate_options()
         except DirSrvException as err:
+            self.port_allocator.release(
+                self.ds_used_ports.pop(self.ds_instance_name))
             return err.msg, err.rval
         else:
             return "Success", 0
@@ -420,69 +612,23 @@ class DirSrvWrap(object):
         to be created we need ports for LDAP and SSL ports.
         1. check if LDAP port and SSL port is given
         1.1 If given, verify if the ports are available(not used)
-        1.1.1 Bind that port to ldap_port_t using semanage command
-        1.1.2 Use the ports and add it to the self.UsedPorts list
         1.2 else raise exception
-        2. If LDAP port and SSL port is not given
-        2.1 Check if the ports are available(not used)
-        2.1.1 Bind the port to ldap_port_t using semanage command
-        2.1.2 Use the ports and add it to self.ds_used_ports list
+        2. If LDAP port and SSL port is not given, use the first pair
+        of the default ports which is available
+        Ports are available when they are neither listening on the host
+        nor reserved for another instance, see DsPortAllocator.
 
         Args:
            u_port (str): unencrypted LDAP port
            e_port (str): Encrypted port to be used for TLS
 
         Returns:
-              sorted_available_ports[0] (list): LDAP and TLS ports
-        """
-        ds_ports = [389, 1389, 2389, 3389, 4389, 30389, 31389, 32389, 33389,
-                    34389, 35389, 36389, 37389, 38389, 39389]
-        tls_ports = [636, 1636, 2636, 3636, 4636, 30636, 31636, 32636, 33636,
-                     34636, 35636, 36636, 37636, 38636, 39636]
-
-        if u_port is None and e_port is None:
-            for ldap_port, ldaps_port in zip(ds_ports, tls_ports):
-                if (self._check_remote_port(ldap_port) or
-                        self._check_remote_port(ldaps_port)):
-                    pass
-                else:
-                    return ldap_port, ldaps_port
-        else:
-            list_a = []
-            for ports in self.ds_used_ports.values():
-                list_a.append(ports)
-
-            list_b = []
-            for l_port, s_port in zip(ds_ports, tls_ports):
-                list_b.append((l_port, s_port))
-
-            if len(set(list_a)) > len(set(list_b)):
-                available_ports = set(list_a) - set(list_b)
-            else:
-                available_ports = set(list_b) - set(list_a)
-            sorted_available_ports = sorted(available_ports)
-            return sorted_available_ports[0]
-
-    def _check_remote_port(self, port):
-        """check if the port on the remote host is free.
+              tuple: LDAP and TLS ports
 
-        Args:
-            port (int): check if port is available
-
-        Returns:
-            bool: True if port is free else False.
+        Exceptions:
+              IndexError: if no ports are available
         """
-        sock_obj = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock_obj.settimeout(1)
-        try:
-            sock_obj.connect((self.ds_instance_host, port))
-        except socket.error as err:
-            print("fail to connect to port %s due to error %r" % (port,
-                                                                  err.errno))
-            return False
-        else:
-            sock_obj.close()
-            return True
+        return self.port_allocator.reserve(u_port, e_port)
 
     def _validate_options(self):
         """verify if the instance directory already exists.
@@ -503,6 +649,92 @@ class DirSrvWrap(object):
             raise DirSrvException('%s Instance already exists' %
                                   self.ds_instance_name)
 
+    def _new_dirsrv(self,
+                    inst_name,
+                    inst_suffix=None,
+                    root_dn_pwd=None,
+                    ldap_port=None,
+                    tls_port=None):
+        """Validate options, reserve ports and return a DirSrv object.
+
+        Args:
+            inst_name (str): Instance Name
+            inst_suffix (str): Instance suffix
+            root_dn_pwd (str): Directory Manager password
+            ldap_port (str): LDAP port to be used
+            tls_port (str): TLS port to be used
+
+        Returns:
+            obj: DirSrv object of the instance
+
+        Exceptions:
+            DirSrvException: if options are invalid or no ports are free
+        """
+        with self._lock:
+            _, return_code = self._set_options(inst_name,
+                                               inst_suffix,
+                                               root_dn_pwd,
+                                               ldap_port,
+                                               tls_port)
+            if return_code != 0:
+                raise DirSrvException(
+                    'Failed to setup Directory Server instance')
+            dirsrv_obj = DirSrv(name=self.ds_instance_name,
+                                host=self.ds_instance_host,
+                                suffix=self.ds_instance_suffix,
+                                multihost=self.multihost,
+                                root_dn_password=self.ds_rootdn_pwd,
+                                ldap_port=self.ds_ldap_port,
+                                ldap_tls_port=self.ds_tls_port)
+            self.dirsrv_objs[inst_name] = dirsrv_obj
+        return dirsrv_obj
+
+    def _provision(self, dirsrv_obj):
+        """Run dscreate for a DirSrv object and enable TLS if requested.
+
+        Args:
+            dirsrv_obj (obj): DirSrv object returned by _new_dirsrv
+
+        Returns:
+            result (str) and return code (str): Result containing message and
+            return code containing 0 or 1 (1 indicating failure)
+
+        Exceptions:
+            DirSrvException: if DS instance could not be created.
+        """
+        cfg_file = dirsrv_obj.create_config()
+        try:
+            dirsrv_obj.setup_ds(cfg_file)
+        except subprocess.CalledProcessError:
+            raise DirSrvException('Failed to setup Directory server')
+        with self._lock:
+            self.dirsrv_info[dirsrv_obj.instance_name] = dirsrv_obj.__dict__
+        ldap_uri = 'ldap://%s:%r' % (self.ds_instance_host,
+                                     dirsrv_obj.dsldap_port)
+        try:
+            dirsrv_obj.enable_anonymous_search(ldap_uri)
+        except LdapException:
+            raise DirSrvException("Failed to enable anonymous search")
+        if self.ssl:
+            return self._enable_tls(dirsrv_obj)
+        return "Success", 0
+
+    def _enable_tls(self, dirsrv_obj):
+        """Copy certificates to the instance and enable TLS.
+
+        Args:
+            dirsrv_obj (obj): DirSrv object of the instance
+
+        Returns:
+            Tuple: Success, 0 or Error, 1
+        """
+        try:
+            dirsrv_obj.setup_certs(self.ssl_dir, self.client_host,
+                                   self.canick)
+        except DirSrvException as err:
+            return err.msg, err.rval
+        return self.enablessl(dirsrv_obj)
+
     def create_ds_instance(self,
                            inst_name,
                            inst_suffix=None,
@@ -525,51 +757,212 @@ class DirSrvWrap(object):
         Exceptions:
             DirSrvException: if DS instance could not be created.
         """
-        result, return_code = self._set_options(inst_name,
-                                                inst_suffix,
-                                                root_dn_pwd,
-                                                ldap_port,
-                                                tls_port)
-        if return_code == 0:
-            self.dirsrv_obj = DirSrv(name=self.ds_instance_name,
-                                     host=self.ds_instance_host,
-                                     suffix=self.ds_instance_suffix,
-                                     multihost=self.multihost,
-                                     root_dn_password=self.ds_rootdn_pwd,
-                                     ldap_port=self.ds_ldap_port,
-                                     tls_port=self.ds_tls_port)
-            cfg_file = self.dirsrv_obj.create_config()
-            try:
-                self.dirsrv_obj.setup_ds(cfg_file)
-            except subprocess.CalledProcessError:
-                raise DirSrvException('Failed to setup Directory server')
-            self.dirsrv_info[self.ds_instance_name] = self.dirsrv_obj.__dict__
-            ldap_uri = 'ldap://%s:%r' % (self.ds_instance_host,
-                                         self.ds_ldap_port)
-            try:
-                self.dirsrv_obj.enable_anonymous_search(ldap_uri)
-            except LdapException:
-                raise DirSrvException("Failed to enable anonymous search")
-            if self.ssl:
+        self.dirsrv_obj = self._new_dirsrv(inst_name, inst_suffix,
+                                           root_dn_pwd, ldap_port, tls_port)
+        return self._provision(self.dirsrv_obj)
+
+    def _run_batch(self, func, dirsrv_objs, max_workers, release=False):
+        """Run func for every DirSrv object concurrently.
+
+        An exception of one instance is recorded as its result, the
+        other instances are not affected.
+
+        Args:
+            func (callable): Called with every DirSrv object
+            dirsrv_objs (list): DirSrv objects
+            max_workers (int): Maximum number of concurrent calls
+            release (bool): Release the ports of instances which failed
+                            before dscreate created them
+
+        Returns:
+            dict: instance name mapped to the (result, return code) tuple
+        """
+        results = {}
+        if not dirsrv_objs:
+            return results
+        if max_workers is None:
+            max_workers = len(dirsrv_objs)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict((dirsrv_obj.instance_name,
+                            executor.submit(func, dirsrv_obj))
+                           for dirsrv_obj in dirsrv_objs)
+            for name, future in futures.items():
                 try:
-                    self.dirsrv_obj.setup_certs(self.ssl_dir,
-                                                self.client_host, self.canick)
+                    results[name] = future.result()
                 except DirSrvException as err:
-                    return err.msg, err.rval
+                    results[name] = (err.msg, err.rval)
+                except Exception as err:  # pylint: disable=broad-except
+                    results[name] = ('%s: %s' % (type(err).__name__, err), 1)
                 else:
-                    (result, return_code) = self.enablessl()
-            return result, return_code
-        else:
-            raise DirSrvException('Failed to setup Directory Server instance')
+                    continue
+                # a created instance keeps its ports until it is removed
+                with self._lock:
+                    if release and name not in self.dirsrv_info:
+                        self.port_allocator.release(
+                            self.ds_used_ports.pop(name, []))
+                        self.dirsrv_objs.pop(name, None)
+        return results
+
+    def create_ds_instances(self, instances, max_workers=None):
+        """Create several Directory Server Instances concurrently.
+
+        Ports of all instances are reserved up front, then dscreate
+        (and TLS setup if ssl is enabled) runs for all instances in
+        parallel.
+
+        Args:
+            instances (list): dicts with the keyword arguments of
+                              create_ds_instance (inst_name, inst_suffix,
+                              root_dn_pwd, ldap_port, tls_port)
+            max_workers (int): Maximum number of concurrent dscreate runs
+
+        Returns:
+            dict: instance name mapped to the (result, return code) tuple
+            returned by create_ds_instance
+
+        Exceptions:
+            DirSrvException: if options of any instance are invalid,
+            nothing is created in that case.
+        """
+        names = [instance['inst_name'] for instance in instances]
+        if len(set(names)) != len(names):
+            raise DirSrvException('Duplicate instance names in %s' % names)
+        dirsrv_objs = []
+        try:
+            for instance in instances:
+                dirsrv_objs.append(self._new_dirsrv(**instance))
+        except DirSrvException:
+            with self._lock:
+                for dirsrv_obj in dirsrv_objs:
+                    self.port_allocator.release(self.ds_used_ports.pop(
+                        dirsrv_obj.instance_name, []))
+                    self.dirsrv_objs.pop(dirsrv_obj.instance_name, None)
+            raise
+        self.dirsrv_obj = dirsrv_objs[-1] if dirsrv_objs else None
+        return self._run_batch(self._provision, dirsrv_objs, max_workers,
+                               release=True)
+
+    def snapshot_key(self, dirsrv_obj, seed=None):
+        """Return the key of a snapshot of an instance.
+
+        The key is a hash of everything the instance is built from:
+        host, name, suffix, password, ports, TLS setup (including the
+        CA certificate) and seed, a caller defined description of the
+        data added after dscreate (e.g. 'users=10000').
+
+        Args:
+            dirsrv_obj (obj): DirSrv object of the instance
+            seed (str): Description of the seeded data
 
-    def enablessl(self):
+        Returns:
+            str: hex digest identifying the snapshot
+        """
+        config = [self.ds_instance_host, dirsrv_obj.instance_name,
+                  dirsrv_obj.dsinstance_suffix, dirsrv_obj.dsrootdn_pwd,
+                  dirsrv_obj.dsldap_port, dirsrv_obj.dstls_port,
+                  self.ssl, self.canick, seed]
+        if self.ssl:
+            with open(os.path.join(self.ssl_dir, 'cacert.pem'), 'rb') as ca:
+                config.append(hashlib.sha256(ca.read()).hexdigest())
+        return hashlib.sha256(repr(config).encode()).hexdigest()
+
+    def _snapshot_path(self, dirsrv_obj, cache_dir, seed):
+        """ Return local path of the snapshot archive of an instance """
+        if cache_dir is None:
+            cache_dir = DS_SNAPSHOT_DIR
+        return os.path.join(cache_dir, '%s-%s.tar.gz' % (
+            dirsrv_obj.ds_inst_name, self.snapshot_key(dirsrv_obj, seed)))
+
+    def snapshot_ds_instance(self, instance_name, cache_dir=None, seed=None):
+        """Save a fully provisioned (and seeded) instance as golden image.
+
+        Args:
+            instance_name (str): Instance Name
+            cache_dir (str): Local directory of the snapshots, defaults to
+                             $QE_DS_SNAPSHOT_DIR or <tmpdir>/qe-ds-snapshots
+            seed (str): Description of the seeded data, see snapshot_key
+
+        Returns:
+            str: Local path of the snapshot archive
+
+        Exceptions:
+            DirSrvException: if the snapshot could not be created
+        """
+        dirsrv_obj = self.dirsrv_objs[instance_name]
+        archive_path = self._snapshot_path(dirsrv_obj, cache_dir, seed)
+        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+        return dirsrv_obj.create_snapshot(archive_path)
+
+    def restore_ds_instance(self,
+                            inst_name,
+                            inst_suffix=None,
+                            root_dn_pwd=None,
+                            ldap_port=None,
+                            tls_port=None,
+                            cache_dir=None,
+                            seed=None):
+        """Restore an instance from a golden image instead of creating it.
+
+        Ports are reserved as create_ds_instance would do, so the
+        snapshot taken after create_ds_instance with the same arguments
+        and seed is found.
+
+        Args:
+            inst_name (str): Instance Name
+            inst_suffix (str): Instance suffix
+            root_dn_pwd (str): Directory Manager password
+            ldap_port (str): LDAP port to be used
+            tls_port (str): TLS port to be used
+            cache_dir (str): Local directory of the snapshots
+            seed (str): Description of the seeded data, see snapshot_key
+
+        Returns:
+            bool: True if restored, False if there is no snapshot; in that
+            case nothing is reserved and create_ds_instance can be used.
+
+        Exceptions:
+            DirSrvException: if the instance could not be restored
+        """
+        dirsrv_obj = self._new_dirsrv(inst_name, inst_suffix, root_dn_pwd,
+                                      ldap_port, tls_port)
+        archive_path = self._snapshot_path(dirsrv_obj, cache_dir, seed)
+        if not os.path.isfile(archive_path):
+            with self._lock:
+                self.port_allocator.release(
+                    self.ds_used_ports.pop(inst_name, []))
+                self.dirsrv_objs.pop(inst_name, None)
+            return False
+        dirsrv_obj.restore_snapshot(archive_path)
+        with self._lock:
+            self.dirsrv_info[inst_name] = dirsrv_obj.__dict__
+        self.dirsrv_obj = dirsrv_obj
+        self.multihost.log.info('Restored %s from %s' % (inst_name,
+                                                         archive_path))
+        return True
+
+    def enablessl_instances(self, instance_names, max_workers=None):
+        """Copy certificates and enable TLS on several instances
+        concurrently.
+
+        Args:
+            instance_names (list): Names of instances created by this object
+            max_workers (int): Maximum number of concurrent TLS setups
+
+        Returns:
+            dict: instance name mapped to Success, 0 or Error, 1
+        """
+        dirsrv_objs = [self.dirsrv_objs[name] for name in instance_names]
+        return self._run_batch(self._enable_tls, dirsrv_objs, max_workers)
+
+    def enablessl(self, dirsrv_obj=None):
         """Enable SSL/TLS on instance.
 
         Enable by adding TLS port to ldap_port_t SELinux label and restart
         Directory Server.
 
         Args:
-            None
+            dirsrv_obj (obj): DirSrv object of the instance, defaults to
+                              the last created instance
 
         Returns:
             Tuple: Success, 0 or Error, 1
@@ -577,25 +970,28 @@ class DirSrvWrap(object):
         Exceptions:
             None:
         """
+        if dirsrv_obj is None:
+            dirsrv_obj = self.dirsrv_obj
+        instance_name = dirsrv_obj.instance_name
+        tls_port = dirsrv_obj.dstls_port
         # add TLS port to ldap_port_t SELinux label
 
         add_tls_port = ['semanage', 'port', '-a', '-t',
-                        'ldap_port_t', '-p', 'tcp', str(self.ds_tls_port)]
+                        'ldap_port_t', '-p', 'tcp', str(tls_port)]
 
-        restart_ds = ['systemctl', 'restart', 'dirsrv@%s' %
-                      self.ds_instance_name]
-        if self.ds_tls_port != 636:
+        restart_ds = ['systemctl', 'restart', 'dirsrv@%s' % instance_name]
+        if tls_port != 636:
             try:
                 self.multihost.run_command(add_tls_port)
             except subprocess.CalledProcessError:
                 return "Failed to set tls_port as ldap_port_t", 1
             else:
                 self.multihost.log.info('Added %s port to ldap_port_t' %
-                                        self.ds_tls_port)
+                                        tls_port)
         try:
-            self.dirsrv_obj.enable_ssl('ldap://%s:%r' % (self.ds_instance_host,
-                                                         self.ds_ldap_port),
-                                       self.ds_tls_port)
+            dirsrv_obj.enable_ssl('ldap://%s:%r' % (self.ds_instance_host,
+                                                    dirsrv_obj.dsldap_port),
+                                  tls_port)
         except LdapException:
             return "Error", 1
 
@@ -605,11 +1001,10 @@ class DirSrvWrap(object):
             return "Error", 1
         else:
             self.multihost.log.info('DS instance restarted successfully')
-            # sleep for 10 seconds
-            time.sleep(10)
+            self.multihost.wait_for_socket(port=tls_port, timeout=60,
+                                           raiseonerr=False)
             tail_cmd = ['tail', '-n', '100',
-                        '/var/log/dirsrv/slapd-%s/errors' % self.
-                        ds_instance_name]
+                        '/var/log/dirsrv/slapd-%s/errors' % instance_name]
             output = self.multihost.run_command(tail_cmd, raiseonerr=False)
             if output.returncode != 0:
                 return "Error", 1
@@ -637,7 +1032,34 @@ class DirSrvWrap(object):
                 raise DirSrvException('Failed to remove %s instance',
                                       inst_name)
             else:
-                del self.ds_used_ports[instance_name]
+                self.port_allocator.release(
+                    self.ds_used_ports.pop(instance_name))
+                self.dirsrv_objs.pop(instance_name, None)
                 return True
         else:
             raise DirSrvException('%s Instance not found' % instance_name)
+
+
+def create_ds_topology(topology, max_workers=None):
+    """Create Directory Server instances on several hosts concurrently.
+
+    Args:
+        topology (list): (DirSrvWrap, instances) tuples, instances being
+                         the list passed to DirSrvWrap.create_ds_instances
+        max_workers (int): Maximum number of concurrent dscreate runs
+                           per host
+
+    Returns:
+        dict: hostname mapped to the result of create_ds_instances
+    """
+    results = {}
+    if not topology:
+        return results
+    with ThreadPoolExecutor(max_workers=len(topology)) as executor:
+        futures = [(wrap.ds_instance_host,
+                    executor.submit(wrap.create_ds_instances, instances,
+                                    max_workers))
+                   for wrap, instances in topology]
+        for hostname, future in futures:
+            results.setdefault(hostname, {}).update(future.result())
+    return results
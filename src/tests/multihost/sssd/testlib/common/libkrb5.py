@@ -4,10 +4,17 @@ try:
     import ConfigParser
 except ImportError:
     import configparser as ConfigParser
+import hashlib
 import tempfile
 import os
+import shlex
 import subprocess
 
+KADMIN_PROMPT = 'kadmin.local:  '
+KRB5_SNAPSHOT_DIR = os.environ.get('QE_KRB5_SNAPSHOT_DIR',
+                                   os.path.join(tempfile.gettempdir(),
+                                                'qe-krb5-snapshots'))
+
 
 class krb5srv(object):
     """ Base class to setup MIT Kerberos server
@@ -33,6 +40,9 @@ class krb5srv(object):
         self.krb_acl_file = '%s/kadm5.acl' % (self.krb5_kdc_data_dir)
         self.admin_keytab = '%s/kadm5.keytab' % (self.krb5_kdc_data_dir)
         self.kdc_conf = '%s/kdc.conf' % (self.krb5_kdc_data_dir)
+        self.krb_stash_file = '%s/.k5.%s' % (self.krb5_kdc_data_dir,
+                                             self.krb_realm)
+        self.host_keytab = '/etc/krb5.keytab'
 
     def _config_krb5kdc(self):
         """ Configure kdc.conf and kadm5.acl
@@ -92,50 +102,26 @@ class krb5srv(object):
         except subprocess.CalledProcessError:
             raise
 
-        try:
-            self.add_principal(p_type='admin',
-                               password=self.admin_password,
-                               service='admin',
-                               service_name='admin')
-        except subprocess.CalledProcessError:
-            raise
-        else:
-            self.multihost.log.info("created REALM %s" % (self.krb_realm))
-
-        try:
-            self.add_principal(p_type='admin',
-                               password=self.admin_password,
-                               service='root')
-        except subprocess.CalledProcessError:
-            raise
-
-        try:
-            self.add_principal(p_type=None, service='host',
-                               service_name=self.multihost.sys_hostname)
-        except subprocess.CalledProcessError:
-            raise
-        else:
-            self.multihost.log.info("host principal added")
-
-        try:
-            self.multihost.run_command(['kadmin.local', '-r', self.krb_realm,
-                                        '-q', "ktadd host/%s" %
-                                        (self.multihost.sys_hostname)])
-        except subprocess.CalledProcessError:
-            raise
-        try:
-            self.multihost.run_command(['kadmin.local', '-r', self.krb_realm,
-                                        '-q', "ktadd -k %s kadmin/admin" %
-                                        (self.admin_keytab)])
-        except subprocess.CalledProcessError:
-            raise
-
-        try:
-            self.multihost.run_command(['kadmin.local', '-r', self.krb_realm,
-                                        '-q', "ktadd -k %s kadmin/changepw" %
-                                        (self.admin_keytab)])
-        except subprocess.CalledProcessError:
-            raise
+        hostname = self.multihost.sys_hostname
+        queries = [self._add_principal_query(p_type='admin',
+                                             password=self.admin_password,
+                                             service='admin',
+                                             service_name='admin'),
+                   self._add_principal_query(p_type='admin',
+                                             password=self.admin_password,
+                                             service='root'),
+                   self._add_principal_query(p_type=None, service='host',
+                                             service_name=hostname),
+                   "ktadd host/%s" % (hostname),
+                   "ktadd -k %s kadmin/admin" % (self.admin_keytab),
+                   "ktadd -k %s kadmin/changepw" % (self.admin_keytab)]
+        results = self.kadmin_batch(queries)
+        failed = [query for query, (ret, _) in results.items() if not ret]
+        if failed:
+            raise subprocess.CalledProcessError(1, failed, '\n'.join(
+                results[query][1] for query in failed))
+        self.multihost.log.info("created REALM %s" % (self.krb_realm))
+        self.multihost.log.info("host principal added")
 
         try:
             self.multihost.run_command(['systemctl', 'start', 'krb5kdc'])
@@ -150,6 +136,132 @@ class krb5srv(object):
         else:
             self.multihost.log.info("kadmin service started successfully")
 
+    def _add_principal_query(self, principal=None,
+                             p_type='user',
+                             password=None,
+                             service=None,
+                             service_name=None,
+                             etype=None):
+        """ Return the kadmin query adding a principal, see add_principal
+        """
+        if service is None:
+            service = 'host'
+
+        if p_type == 'user':
+            if etype:
+                return "add_principal -clearpolicy"\
+                       " -e %s -pw %s %s@%s" % (etype, password,
+                                                principal,
+                                                self.krb_realm)
+            return "add_principal -clearpolicy"\
+                   " -pw %s %s@%s" % (password, principal,
+                                      self.krb_realm)
+        elif p_type == 'admin':
+            return "add_principal -clearpolicy"\
+                   " -pw %s %s/%s" % (password, service, 'admin')
+        return "add_principal -clearpolicy"\
+               " -randkey %s/%s" % (service, service_name)
+
+    def _keytab_query(self, comp_principal, location=None, operation=None):
+        """ Return the kadmin query adding or removing a keytab entry,
+            see add_remove_keytab. None for an invalid operation.
+        """
+        if operation == 'add':
+            ops = 'ktadd'
+
+        elif operation == 'remove':
+            ops = 'ktremove'
+
+        else:
+            return None
+
+        if location is None:
+            location = '/etc/krb5.keytab'
+
+        return "%s -k "\
+            "%s %s@%s" % (ops, location, comp_principal,
+                          self.krb_realm)
+
+    @staticmethod
+    def _query_failed(query, output):
+        """ Return True if kadmin output of query reports an error.
+
+            kadmin reports errors of a request prefixed with the request
+            name as typed ('add_principal: Principal or policy already
+            exists ...'), unknown requests and usage errors are reported
+            by kadmin.local itself.
+        """
+        request = query.split()[0] if query.split() else ''
+        for line in output.splitlines():
+            line = line.strip()
+            if line.startswith('%s: ' % request) or \
+                    line.startswith('kadmin.local: ') or \
+                    line.lower().startswith('usage: '):
+                return True
+        return False
+
+    def kadmin_batch(self, queries):
+        """ Run many kadmin queries in one kadmin.local process
+            :param list queries: kadmin queries ("add_principal ...")
+            :return dict: query mapped to a tuple of success (bool) and
+             the output of the query. Duplicated queries share one entry.
+            :Exception: None
+
+            Queries are streamed over stdin, so the KDC database is opened
+            once and passwords do not show up in the process list. Output
+            is unbuffered and stderr merged into stdout so that the text
+            between two kadmin prompts belongs to one query. Only when no
+            prompt shows up at all, i.e. kadmin.local did not run a query,
+            the queries are run again one by one; queries without output
+            are reported as failed, they are not idempotent (add_principal,
+            ktadd) and must not be replayed.
+        """
+        results = {}
+        if not queries:
+            return results
+        kadmin_cmd = 'stdbuf -o0 -e0 kadmin.local -r %s 2>&1' % (
+            self.krb_realm)
+        cmd = self.multihost.run_command(kadmin_cmd,
+                                         stdin_text='\n'.join(queries) + '\n',
+                                         raiseonerr=False)
+        # first chunk is the preamble, the last prompt is followed by EOF,
+        # so the output of a query is complete once the next prompt shows
+        outputs = cmd.stdout_text.split(KADMIN_PROMPT)[1:]
+        if not outputs:
+            return self._kadmin_loop(queries)
+        for index, query in enumerate(queries):
+            if index + 1 >= len(outputs):
+                results.setdefault(query, (False, 'no output of kadmin.local'
+                                                  ' for this query'))
+                continue
+            output = outputs[index].strip()
+            results[query] = (not self._query_failed(query, output), output)
+        return results
+
+    def _kadmin_loop(self, queries):
+        """ Run kadmin queries with kadmin.local -q in one remote shell,
+            used when no kadmin prompt is found in the output of
+            kadmin_batch.
+        """
+        results = {}
+        marker = '@@QE_KADMIN_END@@'
+        script = ''.join('kadmin.local -r %s -q %s 2>&1; echo %s$?\n' % (
+            self.krb_realm, shlex.quote(query), marker) for query in queries)
+        cmd = self.multihost.run_command('sh -s', stdin_text=script,
+                                         raiseonerr=False)
+        outputs = cmd.stdout_text.split(marker)
+        for index, query in enumerate(queries):
+            output = outputs[index] if index < len(outputs) else ''
+            if index > 0:
+                # strip the return code printed after the previous marker
+                output = output.split('\n', 1)[-1]
+            ret = outputs[index + 1].split('\n', 1)[0].strip() \
+                if index + 1 < len(outputs) else '1'
+            output = output.strip()
+            results[query] = (ret == '0' and
+                              not self._query_failed(query, output), output)
+        return results
+
     def add_principal(self, principal=None,
                       p_type='user',
                       password=None,
@@ -166,30 +278,11 @@ class krb5srv(object):
             :Exception: Raise subprocess.CalledProcessError
         """
         # Todo: Need to check if a principal already exists before adding.
-        if service is None:
-            service = 'host'
-
-        if p_type is 'user':
-            add_principal = "add_principal -clearpolicy"\
-                            " -pw %s %s@%s" % (password, principal,
-                                               self.krb_realm)
-            if etype:
-                add_principal = "add_principal -clearpolicy"\
-                                " -e %s -pw %s %s@%s" % (etype, password,
-                                                         principal,
-                                                         self.krb_realm)
-            kadmin_local_cmd = ['kadmin.local', '-r',
-                                self.krb_realm, '-q', add_principal]
-        elif p_type is 'admin':
-            add_principal = "add_principal -clearpolicy"\
-                            " -pw %s %s/%s" % (password, service, 'admin')
-            kadmin_local_cmd = ['kadmin.local', '-r', self.krb_realm,
-                                '-q', add_principal]
-        else:
-            add_principal = "add_principal -clearpolicy"\
-                            " -randkey %s/%s" % (service, service_name)
-            kadmin_local_cmd = ['kadmin.local', '-r', self.krb_realm,
-                                '-q', add_principal]
+        add_principal = self._add_principal_query(principal, p_type,
+                                                  password, service,
+                                                  service_name, etype)
+        kadmin_local_cmd = ['kadmin.local', '-r',
+                            self.krb_realm, '-q', add_principal]
         try:
             self.multihost.run_command(kadmin_local_cmd)
         except subprocess.CalledProcessError:
@@ -197,13 +290,28 @@ class krb5srv(object):
         else:
             return True
 
+    def add_principals(self, principals, password=None, etype=None):
+        """ Add many user principals with one kadmin.local process
+            :param list principals: principal names (foobar)
+            :param str password: password ('Secret123')
+            :param str etype: encryption types of the keys
+            :return dict: principal mapped to True if it was added
+            :Exception: None
+        """
+        queries = dict((principal, self._add_principal_query(
+            principal, 'user', password, etype=etype))
+            for principal in principals)
+        results = self.kadmin_batch(list(queries.values()))
+        return dict((principal, results[query][0])
+                    for principal, query in queries.items())
+
     def delete_principal(self, principal):
         """ Delete kerberos principal
         :param str principal: principal name (foobar)
         :return bool: True if principal is deleted
         :Exception: Raise subprocess.CalledProcessError
         """
-        del_principal = "delete_principal -force principal"
+        del_principal = "delete_principal -force %s" % principal
         kadmin_local_cmd = ['kadmin.local', '-r',
                             self.krb_realm, '-q', del_principal]
         try:
@@ -213,6 +321,18 @@ class krb5srv(object):
         else:
             return True
 
+    def delete_principals(self, principals):
+        """ Delete many kerberos principals with one kadmin.local process
+        :param list principals: principal names (foobar)
+        :return dict: principal mapped to True if it was deleted
+        :Exception: None
+        """
+        queries = dict((principal, "delete_principal -force %s" % principal)
+                       for principal in principals)
+        results = self.kadmin_batch(list(queries.values()))
+        return dict((principal, results[query][0])
+                    for principal, query in queries.items())
+
     def add_remove_keytab(self, comp_principal=None,
                           location=None,
                           operation=None):
@@ -225,22 +345,9 @@ class krb5srv(object):
             :return bool: True if keytab is added
             :Exception: Raise subprocess.CalledProcessError
         """
-
-        if operation == 'add':
-            ops = 'ktadd'
-
-        elif operation == 'remove':
-            ops = 'ktremove'
-
-        else:
+        add_keytab = self._keytab_query(comp_principal, location, operation)
+        if add_keytab is None:
             return False
-
-        if location is None:
-            location = '/etc/krb5.keytab'
-
-        add_keytab = "%s -k "\
-            "%s %s@%s" % (ops, location, comp_principal,
-                          self.krb_realm)
         kadmin_local_cmd = ['kadmin.local', '-r',
                             self.krb_realm, '-q', add_keytab]
 
@@ -251,6 +358,26 @@ class krb5srv(object):
         else:
             return True
 
+    def add_remove_keytabs(self, comp_principals,
+                           location=None,
+                           operation=None):
+        """ Add or Remove keytab entries of many principals with one
+            kadmin.local process
+            :param list comp_principals: principals without realm
+            :param str location: location of keytab file
+            :param str operation: Value must add or remove
+            :return dict: principal mapped to True if keytab was updated
+            :Exception: None
+        """
+        queries = dict((principal, self._keytab_query(principal, location,
+                                                      operation))
+                       for principal in comp_principals)
+        if None in queries.values():
+            return dict((principal, False) for principal in comp_principals)
+        results = self.kadmin_batch(list(queries.values()))
+        return dict((principal, results[query][0])
+                    for principal, query in queries.items())
+
     def destroy_krb5server(self):
         """ Destroy Kerberos database
             :param: None
@@ -274,3 +401,96 @@ class krb5srv(object):
             raise
         else:
             self.multihost.log.info("Removed krb realm %s" % self.krb_realm)
+
+    def snapshot_key(self, principals=None):
+        """ Return the key of a KDC snapshot
+            :param list principals: principals added after krb_setup_new
+            :return str: hex digest of host, realm, ports, admin password
+             and the principal set
+        """
+        base = ['admin/admin', 'root/admin',
+                'host/%s' % self.multihost.sys_hostname]
+        config = [self.multihost.sys_hostname, self.krb_realm,
+                  self.kdc_port, self.kadmin_port, self.admin_password,
+                  sorted(set(base + list(principals or [])))]
+        return hashlib.sha256(repr(config).encode()).hexdigest()
+
+    def _snapshot_path(self, principals, cache_dir):
+        """ Return local path of the snapshot archive """
+        if cache_dir is None:
+            cache_dir = KRB5_SNAPSHOT_DIR
+        return os.path.join(cache_dir, 'kdc-%s-%s.tar.gz' % (
+            self.krb_realm, self.snapshot_key(principals)))
+
+    def _snapshot_files(self):
+        """ Return files of the realm besides the database dump """
+        return [self.kdc_conf, self.krb_acl_file, self.admin_keytab,
+                self.krb_stash_file, self.host_keytab]
+
+    def create_kdc_snapshot(self, principals=None, cache_dir=None):
+        """ Dump the realm database with its config files to an archive
+            :param list principals: principals added after krb_setup_new,
+             used as key of the snapshot
+            :param str cache_dir: Local directory of the snapshots, defaults
+             to $QE_KRB5_SNAPSHOT_DIR or <tmpdir>/qe-krb5-snapshots
+            :return str: Local path of the snapshot archive
+            :Exception: Raises subprocess.CalledProcessError
+        """
+        archive_path = self._snapshot_path(principals, cache_dir)
+        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+        dump_file = '%s/qe-snapshot.dump' % (self.krb5_kdc_data_dir)
+        remote_archive = '/tmp/kdc-%s-snapshot.tar.gz' % (self.krb_realm)
+        snapshot_cmd = 'kdb5_util -r %s dump %s && ' \
+                       'tar --selinux -czpf %s -C / %s; ret=$?; ' \
+                       'rm -f %s %s.dump_ok; exit $ret' % (
+                           self.krb_realm, dump_file, remote_archive,
+                           ' '.join(path.lstrip('/') for path in
+                                    [dump_file] + self._snapshot_files()),
+                           dump_file, dump_file)
+        self.multihost.run_command(snapshot_cmd)
+        tmp_path = '%s.tmp' % archive_path
+        self.multihost.transport.get_file(remote_archive, tmp_path)
+        os.rename(tmp_path, archive_path)
+        self.multihost.run_command(['rm', '-f', remote_archive],
+                                   raiseonerr=False)
+        self.multihost.log.info("Saved REALM %s to %s" % (self.krb_realm,
+                                                          archive_path))
+        return archive_path
+
+    def restore_kdc_snapshot(self, principals=None, cache_dir=None):
+        """ Restore the realm from an archive of create_kdc_snapshot
+            :param list principals: principals added after krb_setup_new
+            :param str cache_dir: Local directory of the snapshots
+            :return bool: True if restored, False if there is no snapshot
+            :Exception: Raises subprocess.CalledProcessError
+        """
+        archive_path = self._snapshot_path(principals, cache_dir)
+        if not os.path.isfile(archive_path):
+            return False
+        dump_file = '%s/qe-snapshot.dump' % (self.krb5_kdc_data_dir)
+        remote_archive = '/tmp/kdc-%s-snapshot.tar.gz' % (self.krb_realm)
+        self.multihost.transport.put_file(archive_path, remote_archive)
+        restore_cmd = 'systemctl stop krb5kdc kadmin; ' \
+                      'tar --selinux -xzpf %s -C / && ' \
+                      'kdb5_util -r %s load %s && ' \
+                      'systemctl start krb5kdc kadmin; ret=$?; ' \
+                      'rm -f %s %s; exit $ret' % (remote_archive,
+                                                  self.krb_realm, dump_file,
+                                                  dump_file, remote_archive)
+        self.multihost.run_command(restore_cmd)
+        self.multihost.log.info("Restored REALM %s from %s" % (
+            self.krb_realm, archive_path))
+        return True
+
+    def krb_setup(self, cache_dir=None):
+        """ Setup Kerberos REALM from a snapshot, create it and save a
+            snapshot if there is none yet
+            :param str cache_dir: Local directory of the snapshots
+            :return bool: True if the realm was restored from a snapshot
+            :Exception: Raises subprocess.CalledProcessError
+        """
+        if self.restore_kdc_snapshot(cache_dir=cache_dir):
+            return True
+        self.krb_setup_new()
+        self.create_kdc_snapshot(cache_dir=cache_dir)
+        return False
@@ -0,0 +1,494 @@
+""" This module contains an in-process backend of PkiTools which
+creates keys, CSRs, certificates and PKCS#12 files with python
+cryptography instead of certutil/pk12util """
+
+from __future__ import print_function
+import os
+import tempfile
+import datetime
+import fcntl
+import threading
+import contextlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.x509.oid import ExtendedKeyUsageOID
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from .exceptions import PkiLibException
+
+# certutil -v 720, validity is given in months
+CERT_VALIDITY = datetime.timedelta(days=720 * 30)
+EC_CURVES = {256: ec.SECP256R1, 384: ec.SECP384R1, 521: ec.SECP521R1}
+
+
+def generate_key(key_type='rsa', key_size=2048):
+    """
+    Generate a private key of the given type and size
+
+    :param str key_type: rsa or ec
+    :param int key_size: RSA modulus size or EC curve size
+    :return obj: RSA or EC private key
+    :Exception: raises PkiLibException for unknown key types
+    """
+    if key_type == 'rsa':
+        return rsa.generate_private_key(public_exponent=65537,
+                                        key_size=key_size)
+    if key_type == 'ec':
+        try:
+            curve = EC_CURVES[key_size]
+        except KeyError:
+            raise PkiLibException('Unsupported EC key size %s' % key_size)
+        return ec.generate_private_key(curve())
+    raise PkiLibException('Unsupported key type %s' % key_type)
+
+
+class KeyPool(object):
+    """
+        KeyPool keeps pre-generated private keys of the configured
+        (key_type, key_size) specs, so issuing a certificate only costs
+        a signing operation. A background thread refills the pool while
+        keys are drawn, and the pool can be saved to and loaded from a
+        PEM file so CI warms it up once.
+
+        Attributes:
+            key_specs(list): (key_type, key_size) tuples to keep keys of
+            size(int): Number of keys to keep per spec
+            pool_file(str): Optional PEM file the pool is loaded from
+                            and saved to
+    """
+
+    def __init__(self, key_specs=None, size=8, pool_file=None):
+        if key_specs is None:
+            key_specs = [('rsa', 2048)]
+        self.key_specs = [tuple(spec) for spec in key_specs]
+        self.size = size
+        self.pool_file = pool_file
+        self.keys = collections.defaultdict(collections.deque)
+        self.hits = 0
+        self.misses = 0
+        self._cond = threading.Condition()
+        self._stopped = True
+        self._worker = None
+        if self.pool_file and os.path.isfile(self.pool_file):
+            self.load(self.pool_file)
+
+    @staticmethod
+    def key_spec(key):
+        """ Return (key_type, key_size) of a private key """
+        if isinstance(key, ec.EllipticCurvePrivateKey):
+            return ('ec', key.curve.key_size)
+        return ('rsa', key.key_size)
+
+    def start(self):
+        """ Start the background refill thread """
+        with self._cond:
+            if not self._stopped:
+                return
+            self._stopped = False
+        self._worker = threading.Thread(target=self._refill,
+                                        name='KeyPool-refill')
+        self._worker.daemon = True
+        self._worker.start()
+
+    def stop(self, save=True):
+        """
+        Stop the background refill thread
+
+        :param bool save: Save remaining keys to pool_file
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._worker is not None:
+            self._worker.join()
+            self._worker = None
+        if save and self.pool_file:
+            self.save(self.pool_file)
+
+    def _missing_spec(self):
+        """ Return a spec which is below pool size or None """
+        for spec in self.key_specs:
+            if len(self.keys[spec]) < self.size:
+                return spec
+        return None
+
+    def _refill(self):
+        """ Refill the pool until stopped """
+        while True:
+            with self._cond:
+                spec = self._missing_spec()
+                while spec is None and not self._stopped:
+                    self._cond.wait()
+                    spec = self._missing_spec()
+                if self._stopped:
+                    return
+            # generate outside of the lock, get() must not block on it
+            key = generate_key(*spec)
+            with self._cond:
+                self.keys[spec].append(key)
+                self._cond.notify_all()
+
+    def fill(self):
+        """ Fill the pool synchronously, used to warm up a pool file """
+        while True:
+            with self._cond:
+                spec = self._missing_spec()
+            if spec is None:
+                return
+            key = generate_key(*spec)
+            with self._cond:
+                self.keys[spec].append(key)
+
+    def get(self, key_type='rsa', key_size=2048):
+        """
+        Draw a key from the pool, generating one if the pool is empty
+
+        :param str key_type: rsa or ec
+        :param int key_size: RSA modulus size or EC curve size
+        :return obj: RSA or EC private key
+        """
+        spec = (key_type, key_size)
+        with self._cond:
+            if spec not in self.key_specs:
+                self.key_specs.append(spec)
+            try:
+                key = self.keys[spec].popleft()
+            except IndexError:
+                key = None
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._cond.notify_all()
+        if key is None:
+            key = generate_key(key_type, key_size)
+        return key
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _locked(pool_file):
+        """ Hold an exclusive lock on pool_file, processes sharing it must
+        not draw the same keys """
+        with open('%s.lock' % pool_file, 'w') as lock_fd:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _write(pool_file, data):
+        """ Replace pool_file by data, readable by the owner only """
+        tmp_file = '%s.tmp' % pool_file
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as outfile:
+            os.fchmod(outfile.fileno(), 0o600)
+            outfile.write(data)
+        os.rename(tmp_file, pool_file)
+
+    def save(self, pool_file):
+        """
+        Add all pooled keys as unencrypted PKCS#8 PEM to pool_file, keys
+        saved there by other processes in the meantime are kept
+
+        :param str pool_file: Path of the PEM file
+        """
+        with self._cond:
+            keys = [key for spec in self.key_specs for key in self.keys[spec]]
+        data = b''.join(key.private_bytes(serialization.Encoding.PEM,
+                                          serialization.PrivateFormat.PKCS8,
+                                          serialization.NoEncryption())
+                        for key in keys)
+        with self._locked(pool_file):
+            if os.path.isfile(pool_file):
+                with open(pool_file, 'rb') as infile:
+                    data = infile.read() + data
+            self._write(pool_file, data)
+
+    def load(self, pool_file):
+        """
+        Move keys from a PEM file into the pool, the file is emptied so
+        that no other process draws the same keys
+
+        :param str pool_file: Path of the PEM file
+        :Exception: raises PkiLibException if the file cannot be parsed
+        """
+        end_marker = b'-----END PRIVATE KEY-----'
+        keys = []
+        with self._locked(pool_file):
+            with open(pool_file, 'rb') as infile:
+                blocks = infile.read().split(end_marker)
+            for block in blocks:
+                if not block.strip():
+                    continue
+                try:
+                    keys.append(serialization.load_pem_private_key(
+                        block + end_marker, password=None))
+                except ValueError:
+                    raise PkiLibException('Invalid key in %s' % pool_file)
+            self._write(pool_file, b'')
+        with self._cond:
+            for key in keys:
+                spec = self.key_spec(key)
+                if spec not in self.key_specs:
+                    self.key_specs.append(spec)
+                self.keys[spec].append(key)
+
+
+class CryptoPkiTools(object):
+    """
+        CryptoPkiTools is a drop-in replacement of PkiTools for creating
+        a self signed CA and CA signed Server Certs. Everything is done
+        in process, no NSS tools are required on the controller.
+
+        The NSS DB directory layout of PkiTools is kept, so the directory
+        returned by createselfsignedcerts can be passed to
+        DirSrv.setup_certs: pwfile, pin.txt, cacert.pem, ca.p12,
+        server.pem and <server>-server.p12. Friendly names of the p12 files are the CA
+        nickname and Server-Cert-<server>, which pk12util uses as
+        nicknames on import.
+
+        When a KeyPool is passed as key_pool, keys are drawn from it and
+        issuing a certificate is reduced to a signing operation.
+    """
+
+    def __init__(self, nssdir=None, nssdir_pwd=None,
+                 key_type='rsa', key_size=2048, key_pool=None):
+        if nssdir is None:
+            self.nssdb = tempfile.mkdtemp('nssdir')
+        else:
+            self.nssdb = nssdir
+        if nssdir_pwd is None:
+            self.nssdb_pwd = 'Secret12@38/-\245550'
+        else:
+            self.nssdb_pwd = nssdir_pwd
+        self.pwdfilename = 'pwfile'
+        self.pwdfilepath = os.path.join(self.nssdb, self.pwdfilename)
+        self.key_type = key_type
+        self.key_size = key_size
+        self.key_pool = key_pool
+        self.ca_key = None
+        self.ca_cert = None
+        self._ca_lock = threading.Lock()
+
+    def create_nssdb(self):
+        """
+        Create the directory layout of a NSS Database. Only the
+        password file is written, keys and certs live in p12 files.
+
+            :return:
+            str nssdb: path of the NSS DB Directory
+        """
+        with open(self.pwdfilepath, 'w') as outfile:
+            outfile.write(self.nssdb_pwd)
+        return self.nssdb
+
+    def generate_key(self):
+        """
+        Return a private key of the configured type and size, drawn
+        from the key pool if one is set
+
+        :return obj: RSA or EC private key
+        :Exception: raises PkiLibException for unknown key types
+        """
+        if self.key_pool is not None:
+            return self.key_pool.get(self.key_type, self.key_size)
+        return generate_key(self.key_type, self.key_size)
+
+    def _write_p12(self, path, friendly_name, key, cert):
+        """ Write key and cert as PKCS#12 protected by the DB password
+
+        The legacy 3DES/SHA1 PBE is what pk12util of every NSS version
+        imports, BestAvailableEncryption picks AES/PBKDF2 which older
+        NSS cannot decrypt.
+        """
+        encryption = serialization.PrivateFormat.PKCS12.encryption_builder(
+        ).kdf_rounds(50000).key_cert_algorithm(
+            pkcs12.PBES.PBESv1SHA1And3KeyTripleDESCBC).hmac_hash(
+            hashes.SHA1()).build(self.nssdb_pwd.encode())
+        p12 = pkcs12.serialize_key_and_certificates(
+            friendly_name.encode(), key, cert, None, encryption)
+        with open(path, 'wb') as outfile:
+            outfile.write(p12)
+
+    def _write_pem(self, path, cert):
+        """ Write cert in PEM format """
+        with open(path, 'wb') as outfile:
+            outfile.write(cert.public_bytes(serialization.Encoding.PEM))
+
+    def _load_ca(self):
+        """ Load CA key and cert from ca.p12 of an existing NSS DB """
+        with self._ca_lock:
+            if self.ca_cert is not None:
+                return
+            ca_p12_path = os.path.join(self.nssdb, 'ca.p12')
+            try:
+                with open(ca_p12_path, 'rb') as infile:
+                    key, cert, _ = pkcs12.load_key_and_certificates(
+                        infile.read(), self.nssdb_pwd.encode())
+            except (IOError, ValueError):
+                raise PkiLibException('Could not load CA from %s' %
+                                      ca_p12_path)
+            self.ca_key = key
+            self.ca_cert = cert
+
+    def create_ca(self,
+                  ca_dn=None,
+                  passphrase='Secret12@38/-\245550',
+                  canickname='ExampleCA'):
+        """
+        Creates a self signed Root CA and exports it as cacert.pem
+        and ca.p12
+
+        :param str ca_dn: Distinguished Name for CA Cert
+        :param str passphrase: Passphrase written to pin.txt
+        :param str canickname: Nick name of the CA Cert
+        :return str nss_dir: path of the NSS DB Directory
+        :Exception: raises PkiLibException
+        """
+        if ca_dn is None:
+            ca_dn = 'CN=ExampleCA,O=Example,L=Raleigh,C=US'
+        nss_dir = self.create_nssdb()
+        with open(os.path.join(nss_dir, 'pin.txt'), 'w') as outfile:
+            outfile.write('Internal (Software) Token:%s' % passphrase)
+        try:
+            subject = x509.Name.from_rfc4514_string(ca_dn)
+        except ValueError:
+            raise PkiLibException('Invalid CA DN %s' % ca_dn)
+        key = self.generate_key()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cert = x509.CertificateBuilder().subject_name(
+            subject).issuer_name(subject).public_key(
+            key.public_key()).serial_number(
+            x509.random_serial_number()).not_valid_before(
+            now).not_valid_after(now + CERT_VALIDITY).add_extension(
+            x509.BasicConstraints(ca=True, path_length=None),
+            critical=True).add_extension(
+            x509.KeyUsage(digital_signature=True, content_commitment=False,
+                          key_encipherment=False, data_encipherment=False,
+                          key_agreement=False, key_cert_sign=True,
+                          crl_sign=True, encipher_only=False,
+                          decipher_only=False),
+            critical=True).add_extension(
+            x509.SubjectKeyIdentifier.from_public_key(key.public_key()),
+            critical=False).sign(key, hashes.SHA256())
+        self._write_pem(os.path.join(nss_dir, 'cacert.pem'), cert)
+        self._write_p12(os.path.join(nss_dir, 'ca.p12'), canickname,
+                        key, cert)
+        with self._ca_lock:
+            self.ca_key = key
+            self.ca_cert = cert
+        return nss_dir
+
+    def create_csr(self, server, key):
+        """
+        Create a Certificate Signing Request for a server
+
+        :param str server: Hostname used as CN and DNS SAN
+        :param obj key: Private key of the server
+        :return obj: x509.CertificateSigningRequest
+        """
+        subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME,
+                                                server)])
+        return x509.CertificateSigningRequestBuilder().subject_name(
+            subject).add_extension(
+            x509.SubjectAlternativeName([x509.DNSName(server)]),
+            critical=False).sign(key, hashes.SHA256())
+
+    def sign_csr(self, csr):
+        """
+        Sign a Certificate Signing Request with the CA
+
+        :param obj csr: x509.CertificateSigningRequest
+        :return obj: x509.Certificate
+        :Exception: raises PkiLibException
+        """
+        self._load_ca()
+        if not csr.is_signature_valid:
+            raise PkiLibException('Invalid CSR signature')
+        now = datetime.datetime.now(datetime.timezone.utc)
+        builder = x509.CertificateBuilder().subject_name(
+            csr.subject).issuer_name(self.ca_cert.subject).public_key(
+            csr.public_key()).serial_number(
+            x509.random_serial_number()).not_valid_before(
+            now).not_valid_after(now + CERT_VALIDITY).add_extension(
+            x509.BasicConstraints(ca=False, path_length=None),
+            critical=True).add_extension(
+            x509.ExtendedKeyUsage([ExtendedKeyUsageOID.SERVER_AUTH]),
+            critical=False).add_extension(
+            x509.AuthorityKeyIdentifier.from_issuer_public_key(
+                self.ca_key.public_key()), critical=False)
+        for extension in csr.extensions:
+            builder = builder.add_extension(extension.value,
+                                            extension.critical)
+        return builder.sign(self.ca_key, hashes.SHA256())
+
+    def _issue(self, server):
+        """ Return key and cert of a Server Cert exported as
+        <server>-server.p12 """
+        key = self.generate_key()
+        cert = self.sign_csr(self.create_csr(server, key))
+        server_p12 = os.path.join(self.nssdb, '%s-server.p12' % server)
+        self._write_p12(server_p12, 'Server-Cert-%s' % server, key, cert)
+        return server_p12, cert
+
+    def issue_server_cert(self, server, canickname='ExampleCA'):
+        """
+        Issue a Server Cert signed by the CA and export it as
+        <server>-server.p12, server.pem holds the last issued Server Cert
+
+        :param str server: Hostname used as CN of the Server Cert
+        :param str canickname: Nick name of the CA Cert
+        :return str server_p12: path of the server p12 file
+        :Exception: raises PkiLibException
+        """
+        server_p12, cert = self._issue(server)
+        self._write_pem(os.path.join(self.nssdb, 'server.pem'), cert)
+        return server_p12
+
+    def issue_server_certs(self, serverlist, canickname='ExampleCA',
+                           max_workers=None):
+        """
+        Issue Server Certs for all servers concurrently, server.pem holds
+        the Server Cert of the last server as with PkiTools
+
+        :param list serverlist: Hostnames to issue Server Certs for
+        :param str canickname: Nick name of the CA Cert
+        :param int max_workers: Maximum number of concurrent issuers
+        :return list: paths of the server p12 files
+        :Exception: raises PkiLibException
+        """
+        if not serverlist:
+            return []
+        self._load_ca()
+        if max_workers is None:
+            max_workers = min(len(serverlist), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            issued = list(executor.map(self._issue, serverlist))
+        self._write_pem(os.path.join(self.nssdb, 'server.pem'),
+                        issued[-1][1])
+        return [server_p12 for server_p12, _ in issued]
+
+    def createselfsignedcerts(self,
+                              serverlist,
+                              ca_dn=None,
+                              passphrase='Secret12@38/-\245550',
+                              canickname='ExampleCA',
+                              max_workers=None):
+        """
+        Creates a NSS DB directory in /tmp/nssDirxxxx where self signed
+        Root CA and Server Certs are created
+
+        :param list serverlist: Hostnames to issue Server Certs for
+        :param str CA_DN: Distinguished Name for CA Cert
+        :param str passphrase: Passphrase written to pin.txt
+        :param str canickname: Nick name of the CA Cert
+        :param int max_workers: Maximum number of concurrent issuers
+        """
+        nss_dir = self.create_ca(ca_dn, passphrase, canickname)
+        self.issue_server_certs(serverlist, canickname, max_workers)
+        return nss_dir
@@ -2,12 +2,16 @@
 and record the Memory consumption """
 
 from subprocess import CalledProcessError
-import time
 import shlex
 import csv
 import numpy as np
-from sssd.testlib.common.utils import PkiTools
 from sssd.testlib.common.utils import sssdTools
+from sssd.testlib.common.runner import LocalRunner
+
+# seconds between memory samples of idle sssd processes
+IDLE_INTERVAL = 2
+# identical consecutive samples after which sssd is considered idle
+IDLE_STABLE_SAMPLES = 5
 
 
 class LookupPerf(object):
@@ -76,9 +80,12 @@ class LookupPerf(object):
                     with open(stat_file, 'a+') as mon1:
                         mon1.write(cmd1.stdout_text.lstrip())
             host.run_command(clear_cache)
-        # take memory usage when there is no activity
-        for _ in range(no_activity_count):
-            time.sleep(2)
+        # take memory usage when there is no activity, stop as soon as
+        # rss and vsize of the processes do not change any more
+        idle_samples = []
+
+        def idle_sample():
+            usage = []
             for proc in ps_list:
                 ps_cmd2 = 'ps -eo pid,etime,pmem,pcpu,rss,vsize,args '\
                           '| grep %s | grep -v grep '\
@@ -88,6 +95,17 @@ class LookupPerf(object):
                                                                   runs, count)
                 with open(lookup_stats_file, 'a+') as mon1:
                     mon1.write(cmd2.stdout_text.lstrip())
+                usage.extend(tuple(line.split()[4:6]) for line in
+                             cmd2.stdout_text.splitlines() if line.strip())
+            idle_samples.append(usage)
+            recent = idle_samples[-IDLE_STABLE_SAMPLES:]
+            return len(recent) == IDLE_STABLE_SAMPLES and \
+                all(sample == recent[0] for sample in recent)
+        host.wait_for(idle_sample,
+                      timeout=IDLE_INTERVAL * (no_activity_count - 1),
+                      interval=IDLE_INTERVAL, max_interval=IDLE_INTERVAL,
+                      description='idle memory of %s' % ' '.join(ps_list),
+                      raiseonerr=False)
         # take backup of sssd domain log
         host.run_command(backup_log_cmd)
         # zip the log file
@@ -198,6 +216,5 @@ class LookupPerf(object):
         :param str plot_file: Name of the plotfile
         :Return: None
         """
-        pki_inst = PkiTools()
         gnuplot_cmd = 'gnuplot %s' % plot_file
-        pki_inst.execute(shlex.split(gnuplot_cmd))
+        LocalRunner().run(shlex.split(gnuplot_cmd))
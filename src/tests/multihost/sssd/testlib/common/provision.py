@@ -0,0 +1,208 @@
+""" This module installs the packages needed by a test session on all
+hosts, one package manager transaction per host, hosts in parallel """
+
+from __future__ import print_function
+import hashlib
+import os
+import shlex
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .exceptions import SSSDException
+
+# pytest marker listing packages needed by a test: @pytest.mark.packages()
+PACKAGE_MARKER = 'packages'
+RPM_CACHE_DIR = os.environ.get('QE_RPM_CACHE_DIR')
+REMOTE_RPM_DIR = '/var/cache/qe-rpms'
+REMOTE_SCRIPT = '/tmp/qe-provision.shell'
+REMOTE_STAMP = '/tmp/qe-provision.stamp'
+REMOTE_ARCHIVE = '/tmp/qe-rpms.tar'
+
+
+def required_packages(items, base=None):
+    """ Return packages needed by the collected tests
+
+        :param list items: pytest items (request.session.items)
+        :param list base: Packages needed by every session
+        :return list: Package specs in order of first appearance
+    """
+    packages = list(base or [])
+    for item in items:
+        for marker in item.iter_markers(name=PACKAGE_MARKER):
+            packages.extend(marker.args)
+    return list(dict.fromkeys(packages))
+
+
+class PackageProvisioner(object):
+    """ Install and update packages on hosts
+
+        Every host gets a single 'dnf shell' (or 'yum shell') transaction
+        with all updates and installs, hosts are provisioned in parallel.
+        Packages provisioned once on a host are skipped afterwards, so
+        fixtures can ask for their packages without extra transactions.
+
+        When cache_dir (or $QE_RPM_CACHE_DIR) is set, the rpms downloaded
+        by the first host of a distro are kept on the controller and
+        uploaded to the next hosts of the same distro, which install them
+        from the local copy instead of downloading them again.
+    """
+    _lock = threading.Lock()
+    # hostname -> package specs provisioned in this session
+    _provisioned = {}
+
+    def __init__(self, hosts, cache_dir=RPM_CACHE_DIR, max_workers=None):
+        """ Initialize hosts
+            :param list hosts: multihost objects
+            :param str cache_dir: Controller directory of the rpm cache
+            :param int max_workers: Hosts provisioned at the same time
+        """
+        self.hosts = list(hosts)
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers or max(len(self.hosts), 1)
+
+    @staticmethod
+    def transaction(install=(), update=(), local_rpms=()):
+        """ Return the package manager shell script of a transaction
+            :param list install: Package specs to install
+            :param list update: Package specs to update
+            :param list local_rpms: Paths of rpm files to install, the
+             shell does not expand globs
+            :return str: shell script
+        """
+        lines = []
+        if local_rpms:
+            lines.append('install %s' % ' '.join(local_rpms))
+        if update:
+            lines.append('update %s' % ' '.join(update))
+        if install:
+            lines.append('install %s' % ' '.join(install))
+        lines.append('run')
+        return '\n'.join(lines) + '\n'
+
+    def _archive_path(self, host, packages):
+        """ Return controller path of the cached rpms of host's distro """
+        key = hashlib.sha256(repr([host.distro, sorted(packages)]).encode())
+        return os.path.join(self.cache_dir, '%s.tar' % key.hexdigest()[:16])
+
+    @staticmethod
+    def _verify_script(install, update):
+        """ Return shell code succeeding if install specs are installed
+            and update specs have no pending update. $before holds the
+            NEVRAs of the update specs taken before the transaction, $pm
+            the package manager, $rq its repoquery command and $opts its
+            repository options.
+        """
+        checks = []
+        for pkg in install:
+            if '*' in pkg or '?' in pkg:
+                # every package the glob resolves to has to be installed,
+                # one installed match (e.g. the base package) is not enough
+                checks.append('names=$($rq $opts --qf \'%%{name}\\n\' %s '
+                              '| sort -u) && [ -n "$names" ] && '
+                              'rpm -q $names >/dev/null' % shlex.quote(pkg))
+            else:
+                checks.append('rpm -q --whatprovides %s >/dev/null'
+                              % shlex.quote(pkg))
+        if update:
+            names = ' '.join(shlex.quote(pkg) for pkg in update)
+            # unchanged NEVRAs are fine if nothing newer is available
+            checks.append('{ [ "$(rpm -qa --qf \'%%{NEVRA}\\n\' %s | sort)" '
+                          '!= "$before" ] || $pm -q $opts check-update %s '
+                          '>/dev/null; }' % (names, names))
+        return ' && '.join(checks) or 'true'
+
+    def provision_host(self, host, install=(), update=(), enablerepo=()):
+        """ Run one transaction on a host
+            :param obj host: multihost object
+            :param list install: Package specs to install
+            :param list update: Package specs to update
+            :param list enablerepo: Repositories to enable (globs allowed)
+            :return bool: True if all packages are installed
+        """
+        with self._lock:
+            done = self._provisioned.setdefault(host.sys_hostname, set())
+            install = [pkg for pkg in install if pkg not in done]
+            update = [pkg for pkg in update if pkg not in done]
+        if not install and not update:
+            return True
+        archive = None
+        local_rpms = []
+        if self.cache_dir:
+            archive = self._archive_path(host, list(install) + list(update))
+            if os.path.isfile(archive):
+                with tarfile.open(archive) as rpms:
+                    local_rpms = ['%s/%s' % (REMOTE_RPM_DIR,
+                                             os.path.basename(name))
+                                  for name in rpms.getnames()
+                                  if name.endswith('.rpm')]
+                host.transport.put_file(archive, REMOTE_ARCHIVE)
+                host.run_command("mkdir -p %s && tar xf %s -C %s "
+                                 "--transform 's,.*/,,' && rm -f %s" % (
+                                     REMOTE_RPM_DIR, REMOTE_ARCHIVE,
+                                     REMOTE_RPM_DIR, REMOTE_ARCHIVE))
+        host.put_file_contents(REMOTE_SCRIPT, self.transaction(
+            install, update, local_rpms))
+        options = ''.join('--enablerepo=%s ' % repo for repo in enablerepo)
+        # 'shell' does not fail on missing packages, rpm checks them
+        before = 'before=$(rpm -qa --qf \'%%{NEVRA}\\n\' %s | sort); ' % \
+            ' '.join(shlex.quote(pkg) for pkg in update) if update else ''
+        # set -f: repository options are globs for the package manager
+        cmd = host.run_command('set -f; pm=$(command -v dnf || echo yum); '
+                               'case $pm in *dnf) rq="$pm -q repoquery";; '
+                               '*) rq="repoquery -q";; esac; opts=%s; '
+                               '%stouch %s && $pm -y --setopt=keepcache=1 '
+                               '$opts shell %s && %s' % (
+                                   shlex.quote(options), before,
+                                   REMOTE_STAMP, REMOTE_SCRIPT,
+                                   self._verify_script(install, update)),
+                               raiseonerr=False)
+        if cmd.returncode != 0:
+            host.log.info('Failed to provision %s' % ' '.join(
+                list(update) + list(install)))
+            return False
+        with self._lock:
+            done.update(install)
+            done.update(update)
+        if archive and not local_rpms:
+            self._save_rpms(host, archive)
+        return True
+
+    def _save_rpms(self, host, archive):
+        """ Copy rpms downloaded by the last transaction to the cache """
+        cmd = host.run_command("find /var/cache/dnf /var/cache/yum "
+                               "-name '*.rpm' -newer %s -print0 2>/dev/null "
+                               "| tar --null -T - -cf %s && test -s %s" % (
+                                   REMOTE_STAMP, REMOTE_ARCHIVE,
+                                   REMOTE_ARCHIVE), raiseonerr=False)
+        if cmd.returncode == 0:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+            os.close(tmp_fd)
+            host.transport.get_file(REMOTE_ARCHIVE, tmp_path)
+            os.rename(tmp_path, archive)
+        host.run_command('rm -f %s' % REMOTE_ARCHIVE, raiseonerr=False)
+
+    def provision(self, install=(), update=(), enablerepo=None,
+                  raiseonerr=True):
+        """ Provision all hosts in parallel
+            :param list install: Package specs to install
+            :param list update: Package specs to update
+            :param enablerepo: List of repositories or a function returning
+             the list for a host
+            :param bool raiseonerr: Raise SSSDException if a host failed
+            :return dict: hostname mapped to True if provisioned
+            :Exception: Raises SSSDException
+        """
+        def run(host):
+            repos = enablerepo(host) if callable(enablerepo) \
+                else enablerepo or ()
+            return self.provision_host(host, install, update, repos)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = dict(zip([host.sys_hostname for host in self.hosts],
+                               executor.map(run, self.hosts)))
+        failed = [name for name, ret in results.items() if not ret]
+        if failed and raiseonerr:
+            raise SSSDException('Failed to provision %s' % ', '.join(failed))
+        return results
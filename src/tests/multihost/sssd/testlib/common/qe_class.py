@@ -1,10 +1,177 @@
 from pytest_multihost import make_multihost_fixture
 import pytest_multihost.config
 import pytest_multihost.host
+import binascii
+import copy
 import logging
+import os
 import pytest
+import re
+import shlex
+import threading
 import time
+from datetime import datetime
 from .exceptions import SSSDException
+from .scheduler import select_host
+from .service import ServiceManager
+
+# seconds before expiry at which a cached ticket is renewed
+KRB5_RENEW_MARGIN = 300
+# date formats of 'Valid starting' and 'Expires' columns of klist
+KLIST_DATE_FORMATS = ('%m/%d/%y %H:%M:%S', '%m/%d/%Y %H:%M:%S',
+                      '%d/%m/%y %H:%M:%S', '%Y-%m-%d %H:%M:%S')
+# host facts are gathered with one command, sections split by separator
+FACTS_SEPARATOR = '@@QE_FACT@@'
+FACTS_CMD = 'hostname; echo %s; ' \
+            'fips-mode-setup --is-enabled >/dev/null 2>&1; echo $?; ' \
+            'echo %s; cat /etc/redhat-release 2>/dev/null' % (FACTS_SEPARATOR,
+                                                           FACTS_SEPARATOR)
+WIN_FACTS_CMD = "domainname; echo %s; hostname -f; echo %s; " \
+                "powershell.exe -inputformat none -noprofile " \
+                "'(Get-ADDomain -Current LocalComputer)'.NetBIOSName" % (
+                    FACTS_SEPARATOR, FACTS_SEPARATOR)
+# sssd is up once the monitor runs and the nss responder socket exists
+SSSD_READY_CMD = 'pgrep -x sssd >/dev/null && test -S /var/lib/sss/pipes/nss'
+# file snapshots: one archive per snapshot and a fingerprint (content
+# hash, mode, owner, SELinux label) of every file to skip unchanged files
+FILE_SNAPSHOT_DIR = '/var/tmp/qe-snapshots'
+FINGERPRINT = '"$(sha256sum < "$f" 2>/dev/null | cut -d" " -f1) ' \
+              '$(stat -c %a:%u:%g:%C "$f" 2>/dev/null)"'
+SNAPSHOT_SCRIPT = """set -e
+dir=%(dir)s
+rm -rf "$dir"; mkdir -p "$dir"; chmod 700 "$dir"
+cd /
+: > "$dir/absent"; : > "$dir/fingerprints"
+present=""
+for f in %(paths)s; do
+    if [ -e "$f" ]; then present="$present $f"; else echo "$f" >> "$dir/absent"; fi
+done
+if [ -n "$present" ]; then
+    tar --selinux --xattrs --acls -cpf "$dir/files.tar" $present
+    for f in $present; do echo "%(fingerprint)s $f" >> "$dir/fingerprints"; done
+fi
+"""
+# sandbox: a process in a private mount namespace keeps overlayfs mounts
+# over the sandboxed directories; commands join it with nsenter
+SANDBOX_DIR = '/var/tmp/qe-sandbox'
+SANDBOX_SCRIPT = """base=%(base)s
+rm -rf "$base"; mkdir -p "$base"; chmod 700 "$base"
+nohup unshare --mount --propagation private sh -c '
+for d in "$@"; do
+    layer="$0/$(echo "$d" | tr / _)"
+    mkdir -p "$layer/upper" "$layer/work" || exit 1
+    mount -t overlay overlay -o "lowerdir=$d,upperdir=$layer/upper,workdir=$layer/work" "$d" || exit 1
+done
+touch "$0/ready"
+exec sleep infinity' "$base" %(paths)s > "$base/log" 2>&1 &
+echo $!
+"""
+RESTORE_SCRIPT = """dir=%(dir)s
+[ -d "$dir" ] || exit 2
+cd /
+rm -rf "$dir/root"; mkdir "$dir/root"
+if [ -s "$dir/files.tar" ]; then
+    tar --selinux --xattrs --acls -xpf "$dir/files.tar" -C "$dir/root" || exit 1
+fi
+while read -r sum meta f; do
+    [ %(fingerprint)s = "$sum $meta" ] && continue
+    cp -a "$dir/root/$f" "$f.qe-restore" && mv -f "$f.qe-restore" "$f" || exit 1
+    echo "$f"
+done < "$dir/fingerprints"
+while read -r f; do
+    if [ -e "$f" ]; then rm -f "$f" || exit 1; echo "$f"; fi
+done < "$dir/absent"
+rm -rf "$dir/root"
+"""
+
+
+class SandboxTransport(object):
+    """ Transport of a sandboxed host, see QeHost.sandbox_start
+
+        Commands are started through the transport of the host. Files
+        are transferred through a staging file next to the upper layers,
+        which is outside the overlays, and moved from or to their path
+        inside the mount namespace of the sandbox.
+    """
+
+    def __init__(self, host, transport):
+        """ Initialize sandboxed host and the transport it wraps """
+        self.host = host
+        self.transport = transport
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+    def _staging(self):
+        """ Return a new staging path of the sandbox """
+        return '%s/xfer-%s' % (self.host._sandbox['base'],
+                               binascii.hexlify(os.urandom(8)).decode())
+
+    def _move_in(self, staging, remotepath):
+        """ Move a staged file to remotepath inside the sandbox """
+        self.host.run_command(['mv', '-f', staging, remotepath])
+
+    def _copy_out(self, remotepath):
+        """ Copy remotepath of the sandbox to a new staging file """
+        staging = self._staging()
+        self.host.run_command(['cp', remotepath, staging])
+        return staging
+
+    def put_file(self, localpath, remotepath):
+        """ Copy a local file to remotepath inside the sandbox """
+        staging = self._staging()
+        self.transport.put_file(localpath, staging)
+        self._move_in(staging, remotepath)
+
+    def get_file(self, remotepath, localpath):
+        """ Copy remotepath of the sandbox to a local file """
+        staging = self._copy_out(remotepath)
+        try:
+            self.transport.get_file(staging, localpath)
+        finally:
+            self.transport.remove_file(staging)
+
+    def put_file_contents(self, filename, contents, encoding='utf-8'):
+        """ Write contents to filename inside the sandbox """
+        staging = self._staging()
+        self.transport.put_file_contents(staging, contents,
+                                         encoding=encoding)
+        self._move_in(staging, filename)
+
+    def get_file_contents(self, filename, encoding=None):
+        """ Read filename inside the sandbox """
+        staging = self._copy_out(filename)
+        try:
+            return self.transport.get_file_contents(staging,
+                                                    encoding=encoding)
+        finally:
+            self.transport.remove_file(staging)
+
+    def file_exists(self, filename):
+        """ Return True if filename exists inside the sandbox """
+        cmd = self.host.run_command(['test', '-e', filename],
+                                    raiseonerr=False)
+        return cmd.returncode == 0
+
+    def mkdir(self, path):
+        """ Create a directory inside the sandbox """
+        self.host.run_command(['mkdir', path])
+
+    def mkdir_recursive(self, path):
+        """ Create a directory and its parents inside the sandbox """
+        self.host.run_command(['mkdir', '-p', path])
+
+    def rmdir(self, path):
+        """ Remove an empty directory inside the sandbox """
+        self.host.run_command(['rmdir', path])
+
+    def remove_file(self, filename):
+        """ Remove a file inside the sandbox """
+        self.host.run_command(['rm', filename])
+
+    def rename_file(self, oldpath, newpath):
+        """ Rename a file inside the sandbox """
+        self.host.run_command(['mv', oldpath, newpath])
 
 
 class QeConfig(pytest_multihost.config.Config):
@@ -68,6 +235,44 @@ class QeHost(QeBaseHost):
     tests and must be run on any or all hosts in the environment.
     """
 
+    def _gather_facts(self):
+        """ Gather host facts with one remote command
+
+            Returns:
+                dict: hostname, fips and distro of the host
+        """
+        cmd = self.run_command(FACTS_CMD, raiseonerr=False)
+        parts = cmd.stdout_text.split(FACTS_SEPARATOR)
+        parts += [''] * (3 - len(parts))
+        hostname = parts[0].strip()
+        if '\n' in hostname:
+            hostname = hostname.split('\n')[-1]
+        distro = parts[2].strip()
+        return {'hostname': hostname,
+                'fips': parts[1].strip() == '0',
+                'distro': distro if distro else 'Unknown Distro'}
+
+    @property
+    def facts(self):
+        """Facts of the host, gathered once and cached for the session
+
+        Call refresh_facts() after changing them (hostname, FIPS mode).
+
+        Returns:
+            dict: hostname, fips, distro
+        """
+        if getattr(self, '_facts', None) is None:
+            self._facts = self._gather_facts()
+        return self._facts
+
+    def refresh_facts(self):
+        """Drop cached facts, they are gathered again on next access
+
+        Returns:
+            None
+        """
+        self._facts = None
+
     @property
     def sys_hostname(self):
         """Get system hostname
@@ -78,24 +283,12 @@ class QeHost(QeBaseHost):
         Returns:
             str: System hostname
         """
-        cmd = self.run_command(['hostname'], raiseonerr=False)
-        output = cmd.stdout_text.strip()
-        if '\n' in output:
-            ret = output.split('\n')
-            name = (ret[len(ret) - 1])
-            return name
-        else:
-            return cmd.stdout_text.strip()
+        return self.facts['hostname']
 
     @property
     def fips(self):
         """ Check if system is fips enabled """
-        fips_check_cmd = "fips-mode-setup --is-enabled"
-        cmd = self.run_command(fips_check_cmd, raiseonerr=False)
-        if cmd.returncode == 0:
-            return True
-        else:
-            return False
+        return self.facts['fips']
 
     @property
     def distro(self):
@@ -104,13 +297,357 @@ class QeHost(QeBaseHost):
             :param None:
             :return str: contents of /etc/redhat-release
         """
-        cmd = self.run_command(['cat', '/etc/redhat-release'],
+        return self.facts['distro']
+
+    @staticmethod
+    def _ticket_lifetime(klist_output):
+        """ Return lifetime in seconds of the TGT listed by klist or None
+
+            Start and end time come from the same remote clock, so the
+            lifetime does not depend on clock skew with the controller.
+        """
+        date = r'(\S+ \d{1,2}:\d{2}:\d{2})'
+        for line in klist_output.splitlines():
+            match = re.match(r'^\s*%s\s+%s\s+krbtgt/' % (date, date), line)
+            if not match:
+                continue
+            for fmt in KLIST_DATE_FORMATS:
+                try:
+                    start = datetime.strptime(match.group(1), fmt)
+                    end = datetime.strptime(match.group(2), fmt)
+                except ValueError:
+                    continue
+                return (end - start).total_seconds()
+        return None
+
+    def _krb5_ccaches(self):
+        """ Return the credential cache table and its lock """
+        if not hasattr(self, '_krb5_cc_table'):
+            self._krb5_cc_lock = threading.Lock()
+            self._krb5_cc_table = {}
+        return self._krb5_cc_table, self._krb5_cc_lock
+
+    def krb5_ccache(self, principal):
+        """ Return the dedicated credential cache of a principal
+
+            :param str principal: Kerberos principal (user@REALM)
+            :return str: ccache name usable as KRB5CCNAME
+        """
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', principal)
+        return 'FILE:/tmp/krb5cc_qe_%s' % name
+
+    def kinit(self, principal, password=None, keytab=None,
+              lifetime=None, renewable='7d', force=False):
+        """ Get a TGT of principal into a dedicated credential cache
+
+            The ticket is acquired once and reused until it comes close to
+            expiry, then it is renewed with kinit -R and acquired again only
+            if renewal fails. This avoids AS-REQ round trips to the KDC.
+
+            :param str principal: Kerberos principal (user@REALM)
+            :param str password: Password of the principal
+            :param str keytab: Keytab used instead of password
+            :param str lifetime: Requested ticket lifetime (kinit -l)
+            :param str renewable: Requested renewable life (kinit -r)
+            :param bool force: Acquire a new ticket even if cached
+            :return str: ccache name to be used as KRB5CCNAME
+            :Exception: Raises SSSDException
+        """
+        table, lock = self._krb5_ccaches()
+        ccache = self.krb5_ccache(principal)
+        with lock:
+            expires = table.get(principal)
+            now = time.monotonic()
+            if not force and expires is not None:
+                if now < expires - KRB5_RENEW_MARGIN:
+                    return ccache
+                renew = 'kinit -R -c %s %s' % (ccache,
+                                               shlex.quote(principal))
+                if self.run_command(renew, raiseonerr=False).returncode == 0:
+                    self._krb5_track(principal, ccache, now)
+                    return ccache
+            kinit_cmd = ['kinit', '-c', ccache]
+            if lifetime:
+                kinit_cmd.extend(['-l', lifetime])
+            if renewable:
+                kinit_cmd.extend(['-r', renewable])
+            if keytab:
+                kinit_cmd.extend(['-k', '-t', keytab])
+            kinit_cmd.append(principal)
+            cmd = self.run_command(kinit_cmd, stdin_text=password,
+                                   raiseonerr=False)
+            if cmd.returncode != 0:
+                table.pop(principal, None)
+                raise SSSDException('kinit of %s failed: %s' % (
+                    principal, cmd.stderr_text), 1)
+            self._krb5_track(principal, ccache, now)
+        return ccache
+
+    def _krb5_track(self, principal, ccache, acquired):
+        """ Record when the cached ticket of principal expires """
+        table = self._krb5_ccaches()[0]
+        cmd = self.run_command('LC_ALL=C klist -c %s' % ccache,
                                raiseonerr=False)
-        if cmd.returncode != 0:
-            distro = 'Unknown Distro'
+        lifetime = self._ticket_lifetime(cmd.stdout_text)
+        if lifetime is None:
+            # unknown lifetime, check the ticket again on the next call
+            lifetime = KRB5_RENEW_MARGIN
+        table[principal] = acquired + lifetime
+
+    def kdestroy(self, principal=None):
+        """ Destroy cached tickets
+
+            :param str principal: Principal, all cached tickets if None
+            :return None:
+        """
+        table, lock = self._krb5_ccaches()
+        with lock:
+            principals = [principal] if principal else list(table)
+            for name in principals:
+                table.pop(name, None)
+                self.run_command('kdestroy -c %s' % self.krb5_ccache(name),
+                                 raiseonerr=False)
+
+    def wait_for(self, probe, timeout=60, interval=0.1, max_interval=5,
+                 description=None, raiseonerr=True):
+        """ Poll probe until it returns a true value
+
+            The delay between probes starts at interval and doubles after
+            every failed probe up to max_interval, so short waits return
+            quickly and long waits do not flood the host. Duration and
+            number of probes of every wait are kept in wait_stats.
+
+            :param callable probe: Function called without arguments
+            :param float timeout: Overall timeout in seconds
+            :param float interval: First delay between probes
+            :param float max_interval: Maximum delay between probes
+            :param str description: Name of the wait for logs/telemetry
+            :param bool raiseonerr: Raise SSSDException on timeout
+            :return: Value returned by probe, None on timeout
+            :Exception: Raises SSSDException
+        """
+        if description is None:
+            description = getattr(probe, '__name__', repr(probe))
+        start = time.monotonic()
+        deadline = start + timeout
+        attempts = 0
+        while True:
+            attempts += 1
+            result = probe()
+            now = time.monotonic()
+            if result or now >= deadline:
+                break
+            time.sleep(min(interval, deadline - now))
+            interval = min(interval * 2, max_interval)
+        duration = time.monotonic() - start
+        if not hasattr(self, 'wait_stats'):
+            self.wait_stats = []
+        self.wait_stats.append({'description': description,
+                                'duration': duration,
+                                'attempts': attempts,
+                                'ready': bool(result)})
+        self.log.debug('wait for %s: %s after %.2fs, %d probes' % (
+            description, 'ready' if result else 'timeout', duration,
+            attempts))
+        if result:
+            return result
+        if raiseonerr:
+            raise SSSDException('Timeout waiting for %s after %ss' % (
+                description, timeout), 1)
+        return None
+
+    def wait_for_command(self, command, returncode=0, pattern=None,
+                         **kwargs):
+        """ Wait until a command returns returncode and its output
+            matches pattern
+            :param command: Command run with run_command
+            :param int returncode: Expected return code, None for any
+            :param str pattern: Regular expression searched in stdout
+            :param kwargs: Keyword arguments of wait_for
+            :return obj: Result of the successful command
+            :Exception: Raises SSSDException
+        """
+        def probe():
+            cmd = self.run_command(command, raiseonerr=False)
+            if returncode is not None and cmd.returncode != returncode:
+                return None
+            if pattern and not re.search(pattern, cmd.stdout_text):
+                return None
+            return cmd
+        kwargs.setdefault('description', str(command))
+        return self.wait_for(probe, **kwargs)
+
+    def wait_for_service(self, service, state='active', **kwargs):
+        """ Wait until systemd reports service in state
+            :param str service: systemd unit
+            :param str state: active/inactive/failed
+            :param kwargs: Keyword arguments of wait_for
+            :Exception: Raises SSSDException
+        """
+        kwargs.setdefault('description', '%s %s' % (service, state))
+        return self.wait_for_command(['systemctl', 'is-active', service],
+                                     returncode=None,
+                                     pattern=r'(?m)^%s$' % state, **kwargs)
+
+    def wait_for_socket(self, path=None, port=None, address='127.0.0.1',
+                        **kwargs):
+        """ Wait for a unix socket to exist or a TCP port to accept
+            connections
+            :param str path: Path of a unix socket
+            :param int port: TCP port
+            :param str address: Address of the TCP port
+            :param kwargs: Keyword arguments of wait_for
+            :Exception: Raises SSSDException
+        """
+        if path:
+            command = 'test -S %s' % shlex.quote(path)
+        else:
+            command = "timeout 2 bash -c '</dev/tcp/%s/%s'" % (address, port)
+        kwargs.setdefault('description', path or '%s:%s' % (address, port))
+        return self.wait_for_command(command, **kwargs)
+
+    def wait_for_file(self, path, pattern=None, **kwargs):
+        """ Wait for a file to exist and optionally contain pattern
+            :param str path: Path of the file
+            :param str pattern: Extended regular expression for grep
+            :param kwargs: Keyword arguments of wait_for
+            :Exception: Raises SSSDException
+        """
+        if pattern:
+            command = 'grep -qE %s %s' % (shlex.quote(pattern),
+                                          shlex.quote(path))
         else:
-            distro = cmd.stdout_text.strip()
-        return distro
+            command = 'test -e %s' % shlex.quote(path)
+        kwargs.setdefault('description', path)
+        return self.wait_for_command(command, **kwargs)
+
+    def wait_for_sssd(self, timeout=30, raiseonerr=False):
+        """ Wait for sssd to serve requests after start/restart
+            :param float timeout: Timeout in seconds
+            :param bool raiseonerr: Raise SSSDException on timeout
+            :return obj: Result of the probe, None on timeout
+        """
+        return self.wait_for_command(SSSD_READY_CMD, timeout=timeout,
+                                     description='sssd',
+                                     raiseonerr=raiseonerr)
+
+    def snapshot_files(self, paths, name=None):
+        """ Save files with content, mode, owner, SELinux label and
+            xattrs in one remote operation
+
+            :param list paths: Absolute paths of files, files which do not
+             exist are recorded and removed again by restore_files
+            :param str name: Name of the snapshot, random if None
+            :return str: Name of the snapshot
+            :Exception: Raises SSSDException
+        """
+        if name is None:
+            name = binascii.hexlify(os.urandom(8)).decode()
+        script = SNAPSHOT_SCRIPT % {
+            'dir': shlex.quote('%s/%s' % (FILE_SNAPSHOT_DIR, name)),
+            'paths': ' '.join(shlex.quote(path.lstrip('/'))
+                              for path in paths),
+            'fingerprint': FINGERPRINT}
+        cmd = self.run_command(script, raiseonerr=False)
+        if cmd.returncode != 0:
+            raise SSSDException('Unable to snapshot %s: %s' % (
+                ' '.join(paths), cmd.stderr_text), 1)
+        return name
+
+    def restore_files(self, name, discard=True):
+        """ Restore files of a snapshot in one remote operation
+
+            Every changed file is copied next to its target and renamed
+            over it, so readers see either the old or the restored file.
+            Files whose content, mode, owner and label did not change are
+            left alone; files created since the snapshot are removed.
+
+            :param str name: Name of the snapshot
+            :param bool discard: Remove the snapshot after restoring
+            :return list: Paths which were restored or removed
+            :Exception: Raises SSSDException
+        """
+        snapshot_dir = shlex.quote('%s/%s' % (FILE_SNAPSHOT_DIR, name))
+        script = RESTORE_SCRIPT % {'dir': snapshot_dir,
+                                   'fingerprint': FINGERPRINT}
+        if discard:
+            script += 'rm -rf %s\n' % snapshot_dir
+        cmd = self.run_command(script, raiseonerr=False)
+        if cmd.returncode != 0:
+            raise SSSDException('Unable to restore snapshot %s: %s' % (
+                name, cmd.stderr_text), 1)
+        return ['/%s' % path for path in cmd.stdout_text.split()]
+
+    def run_command(self, argv, *args, **kwargs):
+        """ Run a command, inside the sandbox of a sandboxed host
+
+            See pytest_multihost.host.BaseHost.run_command
+        """
+        sandbox = getattr(self, '_sandbox', None)
+        if sandbox is not None:
+            if not isinstance(argv, str):
+                argv = ' '.join(shlex.quote(str(arg)) for arg in argv)
+            argv = 'nsenter --target %s --mount -- bash -c %s' % (
+                sandbox['pid'], shlex.quote(argv))
+        return super(QeHost, self).run_command(argv, *args, **kwargs)
+
+    def sandbox_start(self, paths=('/etc', '/home'), timeout=30):
+        """ Return a sandboxed copy of the host: a host object whose
+            commands run in a private mount namespace where paths are
+            overlayfs mounts with a throw-away upper layer
+
+            Every call starts a sandbox of its own and the host itself is
+            not changed, so tests sharing a host can each run in their
+            own sandbox at the same time. run_command, put_file_contents,
+            get_file_contents and the file operations of transport go
+            through the overlays; changes stay in the sandbox and are
+            dropped by sandbox_stop of the sandboxed host. Services
+            started by systemd and logins through sshd do not enter it.
+
+            :param list paths: Absolute paths of directories to sandbox
+            :param float timeout: Seconds to wait for the mounts
+            :return obj: Sandboxed QeHost
+            :Exception: Raises SSSDException
+        """
+        if getattr(self, '_sandbox', None) is not None:
+            raise SSSDException('Sandboxes cannot be nested', 1)
+        base = '%s/%s' % (SANDBOX_DIR,
+                          binascii.hexlify(os.urandom(8)).decode())
+        cmd = self.run_command(SANDBOX_SCRIPT % {
+            'base': shlex.quote(base),
+            'paths': ' '.join(shlex.quote(path) for path in paths)},
+            raiseonerr=False)
+        pid = cmd.stdout_text.strip()
+        if cmd.returncode != 0 or not pid.isdigit():
+            raise SSSDException('Unable to start sandbox: %s' %
+                                cmd.stderr_text, 1)
+        # ready once the mounts are done, dead if a mount failed
+        state = self.wait_for_command('test -e %s/ready && echo ready || '
+                                      'kill -0 %s || echo dead' % (base, pid),
+                                      pattern='ready|dead', timeout=timeout,
+                                      description='sandbox', raiseonerr=False)
+        if state is None or 'ready' not in state.stdout_text:
+            log = self.run_command('cat %s/log; kill %s; rm -rf %s' % (
+                base, pid, base), raiseonerr=False)
+            raise SSSDException('Unable to start sandbox: %s' %
+                                log.stdout_text, 1)
+        sandboxed = copy.copy(self)
+        sandboxed._sandbox = {'pid': pid, 'base': base}
+        sandboxed._transport = SandboxTransport(sandboxed, self.transport)
+        return sandboxed
+
+    def sandbox_stop(self):
+        """ Stop the sandbox of a sandboxed host and drop its changes """
+        sandbox = getattr(self, '_sandbox', None)
+        if sandbox is None:
+            return
+        self._sandbox = None
+        self._transport = self._transport.transport
+        # the mounts go away with the last process of the namespace
+        self.run_command('kill %s; while kill -0 %s 2>/dev/null; do '
+                         'sleep 0.1; done; rm -rf %s' % (
+                             sandbox['pid'], sandbox['pid'],
+                             sandbox['base']), raiseonerr=False)
 
     def package_mgmt(self, package, action='install'):
         """ Install packages
@@ -126,44 +663,23 @@ class QeHost(QeBaseHost):
         cmd = self.run_command(pkg_install_cmd, raiseonerr=False)
         return bool(cmd.returncode == 0)
 
+    @property
+    def services(self):
+        """ Return the ServiceManager of the host """
+        if not hasattr(self, '_service_manager'):
+            self._service_manager = ServiceManager(self)
+        return self._service_manager
+
     def service_sssd(self, action):
-        """ Start/stop/restart sssd service based on RHEL Version
+        """ Start/stop/restart sssd service
             :param str action: Action to be performed (start/stop/restart)
             :return: str Return code of the systemctl/service command
             :Exception Raises exception
         """
-        if 'Fedora' in self.distro:
-            cmd = self.run_command(['systemctl', action, 'sssd'],
-                                   raiseonerr=False)
-            if cmd.returncode == 0:
-                time.sleep(10)
-                return cmd.returncode
-            else:
-                raise SSSDException('Unable to %s sssd' % action, 1)
-        elif '7.' or '8.' in self.distro.split()[6]:
-            cmd = self.run_command(['systemctl', action, 'sssd'],
-                                   raiseonerr=False)
-            if cmd.returncode == 0:
-                time.sleep(10)
-                return cmd.returncode
-            else:
-                raise SSSDException('Unable to %s sssd' % action, 1)
-        elif '6.' in self.distro.split()[6]:
-            cmd = self.run_command(['service', 'sssd', action],
-                                   raiseonerr=False)
-            if cmd.returncode == 0:
-                time.sleep(10)
-                return cmd.returncode
-            else:
-                raise SSSDException('Unable to %s sssd' % action, 1)
-        elif 'Atomic' in self.distro.split():
-            cmd = self.run_command(['systemctl', action, 'sssd'],
-                                   raiseonerr=False)
-            if cmd.returncode == 0:
-                time.sleep(10)
-                return cmd.returncode
-            else:
-                raise SSSDException('Unable to %s sssd' % action, 1)
+        self.services.apply(action, ['sssd'])
+        if action in ('start', 'restart', 'reload'):
+            self.wait_for_sssd()
+        return 0
 
     def yum_install(self, package):
         """ Install packages through yum
@@ -221,31 +737,45 @@ class QeWinHost(QeBaseHost, pytest_multihost.host.WinHost):
         realm (str):  Return AD realm in upper case
      """
 
+    @property
+    def facts(self):
+        """ Return facts of the AD host, gathered with one remote command
+            and cached for the session, see refresh_facts()
+        """
+        if getattr(self, '_facts', None) is None:
+            cmd = self.run_command(WIN_FACTS_CMD, set_env=False,
+                                   raiseonerr=False)
+            parts = cmd.stdout_text.split(FACTS_SEPARATOR)
+            parts += [''] * (3 - len(parts))
+            self._facts = {'domainname': parts[0].strip(),
+                           'hostname': parts[1].strip().lower(),
+                           'netbiosname': parts[2].strip()}
+        return self._facts
+
+    def refresh_facts(self):
+        """ Drop cached facts, they are gathered again on next access """
+        self._facts = None
+
     @property
     def domainname(self):
         """ Return Domain name """
-        cmd = self.run_command(['domainname'], set_env=False, raiseonerr=False)
-        return cmd.stdout_text.strip()
+        return self.facts['domainname']
 
     @property
     def sys_hostname(self):
         """ Return FQDN """
-        hostname = 'hostname -f'
-        cmd = self.run_command(hostname, set_env=False, raiseonerr=False)
-        return cmd.stdout_text.strip().lower()
+        return self.facts['hostname']
 
     @property
     def realm(self):
         """ Return AD Realm """
-        cmd = self.run_command(['domainname'], set_env=False, raiseonerr=False)
-        return cmd.stdout_text.strip().upper()
+        return self.facts['domainname'].upper()
 
     @property
     def domain_basedn_entry(self):
         """ Return base DN Entry of the """
-        cmd = self.run_command(['domainname'], set_env=False, raiseonerr=False)
-        domain_list = ['DC=' + string for string in cmd.stdout_text.strip().
-                       split('.')]
+        domain_list = ['DC=' + string for string in
+                       self.facts['domainname'].split('.')]
         list1 = map(str, domain_list)
         domain_base_dn = ','.join(list1)
         return domain_base_dn
@@ -253,9 +783,7 @@ class QeWinHost(QeBaseHost, pytest_multihost.host.WinHost):
     @property
     def netbiosname(self):
         """ Return netbios name """
-        cmd = "powershell.exe -inputformat none -noprofile "\
-              "'(Get-ADDomain -Current LocalComputer)'.NetBIOSName"
-        return self.run_command(cmd).stdout_text
+        return self.facts['netbiosname']
 
     def _get_client_dn_entry(self, client):
         """ Return DN entry of client computer in AD """
@@ -334,7 +862,8 @@ def session_multihost(request):
     mh.master = mh.domain.hosts_by_role('master')
     mh.atomic = mh.domain.hosts_by_role('atomic')
     mh.replica = mh.domain.hosts_by_role('replica')
-    mh.client = mh.domain.hosts_by_role('client')
+    # each xdist worker gets a client of the pool for itself
+    mh.client = select_host(mh.domain.hosts_by_role('client'))
     mh.others = mh.domain.hosts_by_role('other')
 
     if pytest.num_ad > 0:
@@ -0,0 +1,222 @@
+""" This module contains a runner for commands executed on the
+controller (certutil, pk12util, gnuplot, ...) """
+
+from __future__ import print_function
+import os
+import signal
+import subprocess
+import threading
+import time
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LocalCommandResult(object):
+    """ Result of a command run by LocalRunner
+
+        Attributes:
+            args(list): Command arguments
+            stdout(bytes): Captured standard output, None if not captured
+            stderr(bytes): Captured standard error, None if not captured
+            returncode(int): Return code, negative if killed by a signal
+            duration(float): Wall clock run time in seconds
+            timed_out(bool): True if the command was killed on timeout
+    """
+
+    def __init__(self, args, stdout, stderr, returncode, duration,
+                 timed_out=False):
+        self.args = args
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = returncode
+        self.duration = duration
+        self.timed_out = timed_out
+
+    @property
+    def stdout_text(self):
+        """ Return stdout decoded as utf-8, None if not captured """
+        if self.stdout is None:
+            return None
+        return self.stdout.decode('utf-8', 'replace')
+
+    @property
+    def stderr_text(self):
+        """ Return stderr decoded as utf-8, None if not captured """
+        if self.stderr is None:
+            return None
+        return self.stderr.decode('utf-8', 'replace')
+
+    def __repr__(self):
+        return '%s(%r, returncode=%r, duration=%.3f, timed_out=%r)' % (
+            self.__class__.__name__, self.args, self.returncode,
+            self.duration, self.timed_out)
+
+
+class LocalRunner(object):
+    """
+        LocalRunner runs commands on the controller. Commands can be run
+        in a thread pool so that local tooling overlaps with remote
+        work, output can be streamed line by line to callbacks, every
+        command gets a timeout and the results of the latest commands
+        are kept in history.
+
+        Attributes:
+            max_workers(int): Size of the thread pool used by submit()
+            timeout(float): Default per-command timeout in seconds
+            history(deque): LocalCommandResult of the last history_size
+                            finished commands
+    """
+
+    def __init__(self, max_workers=None, timeout=600, history_size=1000):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.history = collections.deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @staticmethod
+    def _reader(pipe, chunks, callback):
+        """ Read a pipe line by line, keep the data and stream it """
+        for line in iter(pipe.readline, b''):
+            chunks.append(line)
+            if callback is not None:
+                callback(line.decode('utf-8', 'replace'))
+        pipe.close()
+
+    @staticmethod
+    def _kill(proc):
+        """ Kill the process group of proc """
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        proc.wait()
+
+    def run(self,
+            args,
+            stdin=None,
+            capture_output=True,
+            raiseonerr=False,
+            env=None,
+            cwd=None,
+            timeout=None,
+            on_stdout=None,
+            on_stderr=None):
+        """
+        Run a command and wait for it to finish
+
+        :param list args: List of arguments for the command
+        :param bytes stdin: Optional input
+        :param bool capture_output: Capture output of the command
+                                    (default True)
+        :param bool raiseonerr: Raise exception if command fails
+        :param dict env: Environment of the command, inherited if None
+        :param str cwd: Current working Directory
+        :param float timeout: Timeout in seconds, default self.timeout
+        :param callable on_stdout: Called with every line of stdout
+        :param callable on_stderr: Called with every line of stderr
+        :return LocalCommandResult: result of the command
+        :Exception: subprocess.CalledProcessError if raiseonerr is True,
+                    subprocess.TimeoutExpired if the command timed out and
+                    raiseonerr is True
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if isinstance(stdin, str):
+            stdin = stdin.encode('utf-8')
+        p_in = subprocess.PIPE if stdin is not None else None
+        p_out = subprocess.PIPE if capture_output else None
+        p_err = subprocess.PIPE if capture_output else None
+        out_chunks = []
+        err_chunks = []
+        readers = []
+        timed_out = False
+        start = time.monotonic()
+        # own session, so a timeout kills the whole process tree
+        proc = subprocess.Popen(args, stdin=p_in, stdout=p_out,
+                                stderr=p_err, close_fds=True, env=env,
+                                cwd=cwd, start_new_session=True)
+        try:
+            if capture_output:
+                for pipe, chunks, callback in ((proc.stdout, out_chunks,
+                                                on_stdout),
+                                               (proc.stderr, err_chunks,
+                                                on_stderr)):
+                    reader = threading.Thread(target=self._reader,
+                                              args=(pipe, chunks, callback))
+                    reader.daemon = True
+                    reader.start()
+                    readers.append(reader)
+            if stdin is not None:
+                try:
+                    proc.stdin.write(stdin)
+                except BrokenPipeError:
+                    pass
+                proc.stdin.close()
+            try:
+                proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                timed_out = True
+                self._kill(proc)
+        except BaseException:
+            self._kill(proc)
+            raise
+        finally:
+            for reader in readers:
+                reader.join()
+        if capture_output:
+            stdout, stderr = b''.join(out_chunks), b''.join(err_chunks)
+        else:
+            stdout, stderr = None, None
+        result = LocalCommandResult(args, stdout, stderr, proc.returncode,
+                                    time.monotonic() - start, timed_out)
+        with self._lock:
+            self.history.append(result)
+        if raiseonerr:
+            if timed_out:
+                raise subprocess.TimeoutExpired(args, timeout, result.stdout,
+                                                result.stderr)
+            if result.returncode != 0:
+                raise subprocess.CalledProcessError(result.returncode, args,
+                                                    result.stdout,
+                                                    result.stderr)
+        return result
+
+    def submit(self, args, **kwargs):
+        """
+        Run a command in the thread pool
+
+        :param list args: List of arguments for the command
+        :param kwargs: Keyword arguments of run()
+        :return concurrent.futures.Future: Future of LocalCommandResult
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers)
+            executor = self._executor
+        return executor.submit(self.run, args, **kwargs)
+
+    def run_many(self, commands, **kwargs):
+        """
+        Run many commands concurrently and wait for all of them
+
+        :param list commands: List of argument lists
+        :param kwargs: Keyword arguments of run() used for all commands
+        :return list: LocalCommandResult in the order of commands
+        """
+        futures = [self.submit(args, **kwargs) for args in commands]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        """ Wait for submitted commands and stop the thread pool """
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def total_duration(self):
+        """ Return the summed duration of the commands in history """
+        with self._lock:
+            return sum(result.duration for result in self.history)
@@ -2,8 +2,6 @@
 functions/methods related to samba/winbind """
 
 import os
-import time
-import subprocess
 import pytest
 import configparser as ConfigParser
 import tempfile
@@ -13,6 +11,56 @@ from .paths import SMB_DEFAULT_CONF
 from .exceptions import SSSDException
 
 
+class SmbConfBuilder(object):
+    """ Collect smb.conf sections and write the file once
+
+        Settings of all sections (global, idmap, shares) are gathered
+        locally and smb.conf is uploaded with a single put_file.
+    """
+    def __init__(self, host, fetch=False, conffile=SMB_DEFAULT_CONF):
+        """ Initialize builder
+            :param obj host: multihost object
+            :param bool fetch: Start from the current smb.conf of the host
+            :param str conffile: Path of smb.conf on the host
+        """
+        self.host = host
+        self.fetch = fetch
+        self.conffile = conffile
+        self.sections = []
+
+    def update(self, section, parameters):
+        """ Add or update parameters of a section
+            :param str section: Section name (global, share1 ...)
+            :param dict parameters: smb.conf parameters
+        """
+        self.sections.append((section, dict(parameters)))
+        return self
+
+    def write(self):
+        """ Render collected sections and upload smb.conf """
+        tmpconf = tempfile.NamedTemporaryFile(suffix='smb.conf', delete=False)
+        tmpconf.close()
+        if self.fetch:
+            self.host.transport.get_file(self.conffile, tmpconf.name)
+        config = ConfigParser.RawConfigParser(delimiters=('='))
+        config.optionxform = str
+        try:
+            config.read(tmpconf.name)
+        except ConfigParser.Error:
+            os.unlink(tmpconf.name)
+            raise SSSDException("Unable to parse %s" % self.conffile)
+        for section, parameters in self.sections:
+            if section not in config.sections():
+                config.add_section(section)
+            for key, value in parameters.items():
+                config.set(section, key, value)
+        with open(tmpconf.name, 'w') as conf:
+            config.write(conf)
+        self.host.transport.put_file(tmpconf.name, self.conffile)
+        os.unlink(tmpconf.name)
+        self.sections = []
+
+
 class sambaTools(object):
     """ Functions related to samba/winbind setup """
     def __init__(self, host, adhost):
@@ -29,13 +77,15 @@ class sambaTools(object):
         self.adhost_adminuser = 'Administrator'
         self.host_tools = sssdTools(self.host, self.adhost)
 
-    def smbadsconf(self):
-        """ Setup smbconf with security = ads """
+    def smbadsconf(self, smbconf=None):
+        """ Setup smbconf with security = ads
+            :param obj smbconf: SmbConfBuilder collecting the settings,
+             smb.conf is written right away if None
+        """
         bkup = 'cp -a /etc/samba/smb.conf /etc/samba/smb.conf.orig'
         self.host.run_command(bkup, raiseonerr=False)
         client_hostname = self.host.sys_hostname
         client_short_name = client_hostname.strip().split('.')[0]
-        tmpconf = tempfile.NamedTemporaryFile(suffix='smb.conf', delete=False)
         workgroup = self.adhost_realm.split('.')[0]
         global_parameters = {'workgroup': workgroup,
                              'security': 'ads',
@@ -49,20 +99,18 @@ class sambaTools(object):
         global_parameters['log file'] = "/var/log/samba/log.%m"
         global_parameters['max log size'] = "50"
         global_parameters['log level'] = "9"
-        try:
-            self.host_tools.update_conf(tmpconf.name,
-                                        'global',
-                                        global_parameters)
-        except SSSDException:
-            raise
+        if smbconf is None:
+            SmbConfBuilder(self.host).update('global',
+                                             global_parameters).write()
         else:
-            self.host.transport.put_file(tmpconf.name, '/etc/samba/smb.conf')
-            os.unlink(tmpconf.name)
+            smbconf.update('global', global_parameters)
 
-    def enable_idmapsss(self, idmap_range=None, tdb_range=None):
-        """ Enable sssd backend for idmap """
-        tmpconf = tempfile.NamedTemporaryFile(suffix='smb.conf', delete=False)
-        self.host.transport.get_file(SMB_DEFAULT_CONF, tmpconf.name)
+    def enable_idmapsss(self, idmap_range=None, tdb_range=None,
+                        smbconf=None):
+        """ Enable sssd backend for idmap
+            :param obj smbconf: SmbConfBuilder collecting the settings,
+             smb.conf is updated right away if None
+        """
         netbiosname = self.adhost.netbiosname.strip()
         idmap_backend = "idmap config %s : backend" % netbiosname
         idmap_sss_range = "idmap config %s : range" % netbiosname
@@ -77,36 +125,45 @@ class sambaTools(object):
                         idmap_tdb_range: tdb_range,
                         idmap_backend: 'sss',
                         idmap_sss_range: idmap_range}
-        try:
-            self.host_tools.update_conf(tmpconf.name, 'global',
-                                        idmap_params, action='update')
-        except SSSDException:
-            raise
+        if smbconf is None:
+            SmbConfBuilder(self.host, fetch=True).update('global',
+                                                         idmap_params).write()
         else:
-            self.host.transport.put_file(tmpconf.name, SMB_DEFAULT_CONF)
-            os.unlink(tmpconf.name)
+            smbconf.update('global', idmap_params)
 
-    def add_share_definition(self, share_name, share_path):
-        """ Add samba share in smb.conf """
-        tmpconf = tempfile.NamedTemporaryFile(suffix='smb.conf', delete=False)
-        self.host.transport.get_file(SMB_DEFAULT_CONF, tmpconf.name)
+    def add_share_definition(self, share_name, share_path, smbconf=None):
+        """ Add samba share in smb.conf
+            :param obj smbconf: SmbConfBuilder collecting the settings,
+             smb.conf is updated right away if None
+        """
         share_params = {'path': share_path,
                         'comment': 'test share %s' % share_name,
                         'writable': 'yes',
                         'printable': 'no'}
-        try:
-            self.host_tools.update_conf(tmpconf.name, 'share1',
-                                        share_params, action='update')
-        except SSSDException:
-            raise
+        if smbconf is None:
+            SmbConfBuilder(self.host, fetch=True).update('share1',
+                                                         share_params).write()
         else:
-            self.host.transport.put_file(tmpconf.name, SMB_DEFAULT_CONF)
-            os.unlink(tmpconf.name)
+            smbconf.update('share1', share_params)
+
+    def wait_for_winbind(self, timeout=60, delay=0.5, max_delay=8):
+        """ Wait until winbind answers and the trust secret is valid
+            :param int timeout: Seconds to wait
+            :param float delay: First delay between probes, doubled after
+             every failed probe up to max_delay
+            :param float max_delay: Maximum delay between probes
+            :return bool: True if wbinfo -p and wbinfo -t succeed
+        """
+        return bool(self.host.wait_for_command('wbinfo -p && wbinfo -t',
+                                               timeout=timeout,
+                                               interval=delay,
+                                               max_interval=max_delay,
+                                               description='winbind',
+                                               raiseonerr=False))
 
     def service_smb(self, action='start'):
         """ Start smb servicer """
-        cmd = 'systemctl %s smb' % action
-        self.host.run_command(cmd)
+        self.host.services.apply(action, ['smb'])
 
     def create_samba_share(self, share_path):
         """ Create samba share directory """
@@ -132,27 +189,26 @@ class sambaTools(object):
         self.host_tools.create_kdcinfo(self.adhost_realm, self.adhost_ip)
         self.host_tools.systemsssdauth(self.adhost_realm, self.adhost_hostname)
         self.host_tools.disjoin_ad()
-        kinit = "kinit Administrator"
+        admin = '%s@%s' % (self.adhost_adminuser, self.adhost_realm)
         try:
-            self.host.run_command(kinit, stdin_text=self.adhost_password)
-        except subprocess.CalledProcessError:
+            ccache = self.host.kinit(admin, password=self.adhost_password)
+        except SSSDException:
             pytest.fail("kinit failed")
         self.host_tools.join_ad(self.adhost_realm, self.adhost_password,
-                                mem_sw='samba')
-        self.smbadsconf()
-        self.enable_idmapsss()
-        restart_winbind = 'systemctl restart winbind'
-        cmd = self.host.run_command(restart_winbind, raiseonerr=False)
-        assert cmd.returncode == 0
-        time.sleep(20)
+                                mem_sw='samba', ccache=ccache)
+        smbconf = SmbConfBuilder(self.host)
+        self.smbadsconf(smbconf=smbconf)
+        self.enable_idmapsss(smbconf=smbconf)
+        smbconf.write()
+        self.host.services.apply('restart', ['winbind'])
+        assert self.wait_for_winbind(), "winbind is not ready"
 
     def disable_winbind(self):
         """ Disable winbind """
         # disjoin system
         self.host_tools.disjoin_ad()
         # stop winbind
-        stop_winbind = 'systemctl stop winbind'
-        self.host.run_command(stop_winbind)
+        self.host.services.apply('stop', ['winbind'])
 
     def remove_smbconf(self):
         """ Remove smb.conf """
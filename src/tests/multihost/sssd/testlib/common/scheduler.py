@@ -0,0 +1,234 @@
+""" This module spreads a test session over a pool of client hosts:
+every pytest-xdist worker gets one client for itself and the tests are
+grouped per worker, or split into shards, by their historical duration
+recorded in a timing database """
+
+from __future__ import print_function
+import json
+import os
+import re
+import tempfile
+import pytest
+
+DURATIONS_FILE = os.environ.get('QE_TEST_DURATIONS', '.test_durations.json')
+# duration assumed for a test without history
+DEFAULT_DURATION = 1.0
+# xdist_group names given by assign_groups; xdist appends "@<group>" to
+# the node ids of grouped tests
+GROUP_PREFIX = 'worker'
+GROUP_SUFFIX = re.compile(r'@%s\d+$' % GROUP_PREFIX)
+
+
+def xdist_worker():
+    """ Return index and count of the pytest-xdist worker
+
+        :return tuple: (index, count), (None, None) without xdist
+    """
+    worker = os.environ.get('PYTEST_XDIST_WORKER')
+    if not worker:
+        return None, None
+    count = int(os.environ.get('PYTEST_XDIST_WORKER_COUNT', '1'))
+    return int(worker.lstrip('gw')), count
+
+
+def pool_size(config, role='client', domain_type='sssd'):
+    """ Return number of hosts with role in the multihost configuration
+
+        :param obj config: pytest config
+        :param str role: Host role
+        :param str domain_type: Domain type
+        :return int: Number of hosts, 0 without multihost configuration
+    """
+    plugin = config.pluginmanager.getplugin('MultihostPlugin')
+    if not plugin:
+        return 0
+    count = 0
+    for domain in plugin.confdict.get('domains', []):
+        if domain.get('type', 'default') != domain_type:
+            continue
+        count += len([host for host in domain.get('hosts', [])
+                      if host.get('role') == role])
+    return count
+
+
+def configure_pool(config, role='client'):
+    """ Return number of hosts the session has to request
+
+        Without xdist one host is used as before. With xdist every worker
+        needs a host of its own, so all hosts of the pool are requested.
+        The groups of assign_groups are only honoured with --dist
+        loadgroup, which xdist reads before pytest_configure, so it has
+        to be given on the command line.
+
+        :param obj config: pytest config
+        :param str role: Host role
+        :return int: Number of hosts to request
+        :Exception: Raises pytest.UsageError if workers exceed hosts or
+         --dist loadgroup is missing
+    """
+    workers = getattr(config.option, 'numprocesses', None)
+    _, count = xdist_worker()
+    if count is not None:
+        workers = count
+    if not isinstance(workers, int) or workers < 1:
+        return 1
+    available = pool_size(config, role)
+    if workers > available:
+        raise pytest.UsageError('%d workers need %d %s hosts, %d configured'
+                                % (workers, workers, role, available))
+    # workers run with dist 'no', the controller distributes the tests
+    if count is None and getattr(config.option, 'dist', None) != 'loadgroup':
+        raise pytest.UsageError('%d workers need --dist loadgroup to keep '
+                                'classes on one host' % workers)
+    return available
+
+
+def select_host(hosts):
+    """ Return the hosts the worker may use: its own host of the pool
+
+        :param list hosts: Hosts of a role, in configuration order
+        :return list: One host per worker, hosts unchanged without xdist
+    """
+    index, _ = xdist_worker()
+    if index is None or not hosts:
+        return hosts
+    return [hosts[index % len(hosts)]]
+
+
+def load_timings(path=DURATIONS_FILE):
+    """ Return the timing database
+
+        :param str path: JSON file mapping node ids to seconds, or to
+         a dict of seconds per phase (setup, call, teardown)
+        :return dict: content of the file, empty if there is none
+    """
+    try:
+        with open(path) as durations_file:
+            return json.load(durations_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def plain_nodeid(nodeid):
+    """ Return node id without the xdist group suffix """
+    return GROUP_SUFFIX.sub('', nodeid)
+
+
+def record_report(timings, report):
+    """ Add the duration of a test phase to timings
+
+        :param dict timings: node id -> {phase: seconds}
+        :param obj report: pytest TestReport
+    """
+    timings.setdefault(plain_nodeid(report.nodeid),
+                       {})[report.when] = report.duration
+
+
+def save_timings(timings, path=DURATIONS_FILE):
+    """ Merge timings of this run into the timing database
+
+        Tests of this run replace their old entry, others are kept.
+
+        :param dict timings: node id -> {phase: seconds}
+        :param str path: JSON file of the database
+    """
+    if not timings:
+        return
+    data = load_timings(path)
+    data.update(timings)
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(tmp_fd, 'w') as durations_file:
+        json.dump(data, durations_file, indent=1, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+def load_durations(path=DURATIONS_FILE):
+    """ Return historical durations of tests
+
+        :param str path: JSON file of the timing database
+        :return dict: node id mapped to total seconds
+    """
+    durations = {}
+    for nodeid, value in load_timings(path).items():
+        if isinstance(value, dict):
+            value = sum(value.values())
+        durations[nodeid] = float(value)
+    return durations
+
+
+def scope_of(item):
+    """ Return the scheduling unit of a test: its class or module, so
+        that class scoped fixtures are set up once """
+    return plain_nodeid(item.nodeid).split('[', 1)[0].rsplit('::', 1)[0]
+
+
+def lpt_bins(weights, bins):
+    """ Pack units into bins longest processing time first
+
+        :param dict weights: unit mapped to its weight
+        :param int bins: Number of bins
+        :return dict: unit mapped to the index of its bin
+    """
+    loads = [0.0] * bins
+    assignment = {}
+    for unit in sorted(weights, key=lambda key: (-weights[key], key)):
+        target = loads.index(min(loads))
+        assignment[unit] = target
+        loads[target] += weights[unit]
+    return assignment
+
+
+def _unit_weights(items, durations):
+    """ Return expected seconds of every scheduling unit of items """
+    if durations is None:
+        durations = load_durations()
+    known = sorted(durations.values())
+    default = known[len(known) // 2] if known else DEFAULT_DURATION
+    weights = {}
+    for item in items:
+        unit = scope_of(item)
+        weights[unit] = weights.get(unit, 0.0) + durations.get(
+            plain_nodeid(item.nodeid), default)
+    return weights
+
+
+def shard_items(items, shard_id, num_shards, durations=None):
+    """ Split tests into balanced shards
+
+        Scheduling units are packed longest processing time first, the
+        order of tests inside a shard is kept.
+
+        :param list items: Collected pytest items
+        :param int shard_id: Shard to keep, 0 based
+        :param int num_shards: Number of shards
+        :param dict durations: node id -> seconds, see load_durations
+        :return tuple: (selected, deselected) items
+    """
+    assignment = lpt_bins(_unit_weights(items, durations), num_shards)
+    selected = [item for item in items
+                if assignment[scope_of(item)] == shard_id]
+    deselected = [item for item in items
+                  if assignment[scope_of(item)] != shard_id]
+    return selected, deselected
+
+
+def assign_groups(items, workers, durations=None):
+    """ Mark tests with xdist_group so that each worker gets a balanced
+        share of the historical run time
+
+        :param list items: Collected pytest items
+        :param int workers: Number of workers
+        :param dict durations: node id -> seconds, see load_durations
+        :return list: Expected seconds per worker
+    """
+    weights = _unit_weights(items, durations)
+    assignment = lpt_bins(weights, workers)
+    loads = [0.0] * workers
+    for item in items:
+        unit = scope_of(item)
+        item.add_marker(pytest.mark.xdist_group(
+            name='%s%d' % (GROUP_PREFIX, assignment[unit])))
+    for unit, target in assignment.items():
+        loads[target] += weights[unit]
+    return loads
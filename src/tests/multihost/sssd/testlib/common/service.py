@@ -0,0 +1,92 @@
+""" This module contains a service manager batching service actions
+on a host (systemctl on systemd hosts, service on sysvinit hosts) """
+
+from __future__ import print_function
+import shlex
+from .exceptions import SSSDException
+
+# actions which do nothing when the service is already in target state
+SKIP_IF_ACTIVE = ('start',)
+SKIP_IF_INACTIVE = ('stop',)
+
+
+class ServiceManager(object):
+    """ Start/stop/restart several services of a host in one remote call
+
+        The init system of the host is detected once. start of active
+        services and stop of inactive services are skipped; the current
+        state is checked by the same remote command which runs the action,
+        so changes done behind the back of the manager are honoured.
+    """
+
+    def __init__(self, host):
+        """ Initialize host
+            :param obj host: multihost object
+        """
+        self.host = host
+        self._systemd = None
+
+    @property
+    def systemd(self):
+        """ Return True if the host runs systemd """
+        if self._systemd is None:
+            cmd = self.host.run_command('test -d /run/systemd/system',
+                                        raiseonerr=False)
+            self._systemd = cmd.returncode == 0
+        return self._systemd
+
+    def _status_cmd(self, unit):
+        """ Return a command succeeding if unit is running """
+        if self.systemd:
+            return 'systemctl is-active -q %s' % unit
+        return 'service %s status >/dev/null 2>&1' % unit
+
+    def _action_cmd(self, action, units):
+        """ Return a command running action on units (shell words) """
+        if self.systemd:
+            return 'systemctl %s %s' % (action, units)
+        return 'for unit in %s; do service $unit %s || exit 1; done' % (
+            units, action)
+
+    def state(self, services):
+        """ Return state of services
+            :param list services: Service names
+            :return dict: service mapped to True if it is running
+        """
+        script = ''.join('%s && echo 1 || echo 0; ' % self._status_cmd(
+            shlex.quote(service)) for service in services)
+        cmd = self.host.run_command(script, raiseonerr=False)
+        states = cmd.stdout_text.split()
+        return dict((service, states[index] == '1' if index < len(states)
+                     else False) for index, service in enumerate(services))
+
+    def apply(self, action, services):
+        """ Run action on services with a single remote command
+            :param str action: start/stop/restart/reload/enable/disable ...
+            :param list services: Service names, a str for one service
+            :return list: Services the action was run on
+            :Exception: Raises SSSDException
+        """
+        if isinstance(services, str):
+            services = [services]
+        quoted = ' '.join(shlex.quote(service) for service in services)
+        if action in SKIP_IF_ACTIVE + SKIP_IF_INACTIVE:
+            test = '||' if action in SKIP_IF_ACTIVE else '&&'
+            select = 'for unit in %s; do %s %s echo $unit; done' % (
+                quoted, self._status_cmd('$unit'), test)
+        else:
+            select = 'for unit in %s; do echo $unit; done' % quoted
+        script = 'units=$(%s); echo $units; ' \
+                 '[ -z "$units" ] || %s' % (select,
+                                           self._action_cmd(action,
+                                                            '$units'))
+        cmd = self.host.run_command(script, raiseonerr=False)
+        if cmd.returncode != 0:
+            raise SSSDException('Unable to %s %s' % (action,
+                                                     ' '.join(services)), 1)
+        lines = cmd.stdout_text.strip().splitlines()
+        changed = lines[0].split() if lines else []
+        if not changed:
+            self.host.log.debug('%s %s: nothing to do' % (
+                action, ' '.join(services)))
+        return changed
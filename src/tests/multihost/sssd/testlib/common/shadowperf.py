@@ -0,0 +1,468 @@
+""" This module contains helpers to benchmark shadow-utils commands
+against large local user and group databases """
+
+from __future__ import print_function
+import json
+import math
+import os
+import shlex
+from .exceptions import SSSDException
+
+PERF_RESULTS_DIR = os.environ.get('QE_PERF_DIR', '.')
+# operations measured of every kind at every size
+OPS = int(os.environ.get('QE_PERF_OPS', '100'))
+# uids/gids of populated entries, above UID_MAX/GID_MAX of login.defs
+FIRST_ID = 200000
+# statistics the growth over the sizes is fitted to, the first one a
+# result has: timed commands, libsubid_bench and bulk
+GROWTH_METRICS = ('mean', 'mean_ns', 'seconds')
+# local databases changed by the benchmarks, snapshotted around each test
+SHADOW_FILES = ['/etc/passwd', '/etc/shadow', '/etc/group', '/etc/gshadow',
+                '/etc/subuid', '/etc/subgid', '/etc/login.defs',
+                '/etc/nsswitch.conf']
+REMOTE_OPS = '/tmp/qe-perf.ops'
+REMOTE_INPUT = '/tmp/qe-perf.input'
+REMOTE_TRACE = '/tmp/qe-perf.strace'
+REMOTE_TIME = '/tmp/qe-perf.time'
+# data/list_subid_ranges.c as compiled by the compile_list_subid_ranges
+# fixture, -b times libsubid lookups in one process
+LIST_SUBID_RANGES = '/tmp/list_subid_ranges'
+# syscalls by which commonio locks (link to <db>.lock) and replaces
+# (rename of <db>+ over <db>) a database
+LOCK_SYSCALLS = 'link,linkat,open,openat,rename,renameat,renameat2'
+# input lines lock_cycles traces, newusers and chpasswd lock and replace
+# the database once per run whatever the input size
+LOCK_SAMPLE = 100
+# runs every line of REMOTE_OPS and prints "<rc> <microseconds>" per line,
+# $EPOCHREALTIME (bash >= 5) avoids forking date around every command
+TIMED_LOOP = """while IFS= read -r op; do
+    if [ -n "${EPOCHREALTIME:-}" ]; then s=${EPOCHREALTIME/[.,]/}
+    else s=$(date +%%s%%6N); fi
+    eval "$op" >/dev/null 2>&1; rc=$?
+    if [ -n "${EPOCHREALTIME:-}" ]; then e=${EPOCHREALTIME/[.,]/}
+    else e=$(date +%%s%%6N); fi
+    echo "$rc $((e - s))"
+done < %(ops)s
+"""
+# K writers run the operations in turn until the deadline, each output
+# line is "<writer> <operation> <rc> <microseconds> <failure reason>"
+STRESS_SCRIPT = """dir=$(mktemp -d /tmp/qe-perf-stress.XXXXXX)
+now() { if [ -n "${EPOCHREALTIME:-}" ]; then t=${EPOCHREALTIME/[.,]/}
+        else t=$(date +%%s%%6N); fi; }
+names=(%(names)s)
+cmds=(%(cmds)s)
+for w in $(seq 0 $((%(writers)d - 1))); do groupadd %(group)s$w; done
+now; end=$((t + %(duration)d * 1000000))
+for w in $(seq 0 $((%(writers)d - 1))); do
+    (n=0; now
+     while [ "$t" -lt "$end" ]; do
+        for i in "${!cmds[@]}"; do
+            now; s=$t
+            err=$(eval "${cmds[$i]}" 2>&1 >/dev/null); rc=$?
+            now
+            reason=ok
+            if [ $rc -ne 0 ]; then
+                case "$err" in
+                    *lock*) reason=lock ;;
+                    *busy*|*Busy*) reason=ebusy ;;
+                    *) reason=other ;;
+                esac
+            fi
+            echo "$w ${names[$i]} $rc $((t - s)) $reason"
+        done
+        n=$((n + 1))
+     done > "$dir/$w") &
+done
+wait
+cat "$dir"/*; rm -rf "$dir"
+"""
+# appends users with a private group each, or groups only, to the local
+# databases in one pass instead of one useradd/groupadd per entry
+POPULATE_SCRIPT = """set -e
+awk -v n=%(count)d -v id=%(start)d -v p=%(prefix)s -v users=%(users)d '
+BEGIN {
+    for (i = 0; i < n; i++) {
+        name = p i
+        if (users) {
+            print name ":x:" id + i ":" id + i "::/home/" name \\
+                ":/bin/bash" >> "/etc/passwd"
+            print name ":!!:19000:0:99999:7:::" >> "/etc/shadow"
+        }
+        print name ":x:" id + i ":" >> "/etc/group"
+        print name ":!::" >> "/etc/gshadow"
+    }
+}'
+"""
+# appends consecutive subordinate id ranges to /etc/subuid and /etc/subgid
+SUBID_SCRIPT = """set -e
+for db in /etc/subuid /etc/subgid; do
+    awk -v n=%(count)d -v first=%(first)d -v start=%(start)d \\
+        -v size=%(size)d -v p=%(prefix)s '
+    BEGIN {
+        for (i = 0; i < n; i++)
+            printf "%%s%%d:%%.0f:%%d\\n", p, first + i, start + i * size,
+                size
+    }' >> "$db"
+done
+"""
+# replaces the member list of a group in /etc/group and /etc/gshadow with
+# the names in REMOTE_INPUT, files are rewritten in place to keep labels
+MEMBERS_SCRIPT = """set -e
+for db in /etc/group /etc/gshadow; do
+    awk -F: -v OFS=: -v g=%(group)s '
+        FILENAME == ARGV[1] { m = m (m == "" ? "" : ",") $0; next }
+        $1 == g { $NF = m } { print }' %(input)s "$db" > "$db+"
+    cat "$db+" > "$db"; rm -f "$db+"
+done
+"""
+
+
+def perf_sizes(variable, default):
+    """ Return the sizes a benchmark runs at
+
+        :param str variable: Environment variable of comma separated sizes
+        :param str default: Sizes if the variable is not set
+        :return list: Sizes as int
+    """
+    return [int(size) for size in os.environ.get(variable, default).split(',')]
+
+
+def summarize(latencies, failures=0):
+    """ Return statistics of latencies
+
+        :param list latencies: Seconds per operation
+        :param int failures: Number of failed operations
+        :return dict: count, failures, total, mean, p50, p90, p99, max (in
+         seconds) and ops_per_sec
+    """
+    ordered = sorted(latencies)
+    total = sum(ordered)
+
+    def percentile(fraction):
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1,
+                           int(math.ceil(fraction * len(ordered))) - 1)]
+    return {'count': len(ordered),
+            'failures': failures,
+            'total': total,
+            'mean': total / len(ordered) if ordered else 0.0,
+            'p50': percentile(0.5),
+            'p90': percentile(0.9),
+            'p99': percentile(0.99),
+            'max': ordered[-1] if ordered else 0.0,
+            'ops_per_sec': len(ordered) / total if total else 0.0}
+
+
+def growth_exponent(sizes, values):
+    """ Return k of values ~ sizes ** k by a least squares fit in log-log
+        space: about 0 for constant, 1 for linear, 2 for quadratic growth
+
+        :param list sizes: Database sizes
+        :param list values: Measured values (e.g. mean latency) per size
+        :return float: Exponent, None with less than two usable points
+    """
+    points = [(math.log(size), math.log(value))
+              for size, value in zip(sizes, values) if size > 0 and value > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var_x:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+
+class ShadowPerf(object):
+    """ Benchmark shadow-utils commands on a host
+
+        Operations are run by a loop on the host which times every
+        command, so the latencies do not include the round trip of the
+        multihost connection. Results are written as JSON files named
+        after the benchmark and the shadow-utils build.
+    """
+
+    def __init__(self, host, results_dir=PERF_RESULTS_DIR):
+        """ Initialize host
+            :param obj host: multihost object
+            :param str results_dir: Controller directory of result files
+        """
+        self.host = host
+        self.results_dir = results_dir
+        self._build = None
+
+    @property
+    def build(self):
+        """ Return name-version-release of installed shadow-utils """
+        if self._build is None:
+            cmd = self.host.run_command('rpm -q --qf "%{name}-%{version}-'
+                                        '%{release}.%{arch}" shadow-utils',
+                                        raiseonerr=False)
+            self._build = cmd.stdout_text.strip() or 'unknown'
+        return self._build
+
+    def populate(self, count, start, prefix='perfuser', users=True):
+        """ Add count users with a private group each (or only groups)
+            with ids start .. start + count - 1
+
+            :param int count: Number of entries
+            :param int start: First uid/gid
+            :param str prefix: Names are prefix followed by the index
+            :param bool users: Add users too, not only groups
+            :return list: Names of the entries
+            :Exception: Raises SSSDException
+        """
+        cmd = self.host.run_command(POPULATE_SCRIPT % {
+            'count': count, 'start': start, 'prefix': shlex.quote(prefix),
+            'users': int(users)}, raiseonerr=False)
+        if cmd.returncode != 0:
+            raise SSSDException('Unable to populate %d entries: %s' % (
+                count, cmd.stderr_text), 1)
+        return ['%s%d' % (prefix, index) for index in range(count)]
+
+    def populate_subids(self, count, start, size=65536, prefix='perfsub',
+                        first=0):
+        """ Add count consecutive subuid and subgid ranges
+
+            :param int count: Number of ranges
+            :param int start: First id of the first range
+            :param int size: Number of ids of every range
+            :param str prefix: Owners are prefix followed by the index
+            :param int first: Index of the first owner
+            :return list: Owners of the ranges
+            :Exception: Raises SSSDException
+        """
+        cmd = self.host.run_command(SUBID_SCRIPT % {
+            'count': count, 'first': first, 'start': start, 'size': size,
+            'prefix': shlex.quote(prefix)}, raiseonerr=False)
+        if cmd.returncode != 0:
+            raise SSSDException('Unable to populate %d subid ranges: %s' % (
+                count, cmd.stderr_text), 1)
+        return ['%s%d' % (prefix, index)
+                for index in range(first, first + count)]
+
+    def set_members(self, group, members):
+        """ Replace the members of a group in one pass
+
+            :param str group: Group name
+            :param list members: User names
+            :Exception: Raises SSSDException
+        """
+        self.host.put_file_contents(REMOTE_INPUT, ''.join(
+            '%s\n' % member for member in members))
+        cmd = self.host.run_command(MEMBERS_SCRIPT % {
+            'group': shlex.quote(group), 'input': REMOTE_INPUT},
+            raiseonerr=False)
+        if cmd.returncode != 0:
+            raise SSSDException('Unable to set %d members of %s: %s' % (
+                len(members), group, cmd.stderr_text), 1)
+
+    def time_commands(self, commands):
+        """ Run commands one after another on the host and time each
+
+            :param list commands: Shell commands, one line each
+            :return tuple: (latencies of successful commands in seconds,
+             number of failed commands)
+        """
+        self.host.put_file_contents(REMOTE_OPS, '\n'.join(commands) + '\n')
+        cmd = self.host.run_command(TIMED_LOOP % {'ops': REMOTE_OPS},
+                                    log_stdout=False)
+        latencies = []
+        failures = 0
+        for line in cmd.stdout_text.splitlines():
+            returncode, micro = line.split()
+            if returncode == '0':
+                latencies.append(int(micro) / 1e6)
+            else:
+                failures += 1
+        return latencies, failures
+
+    def benchmark(self, commands):
+        """ Time commands and return their statistics, see summarize """
+        return summarize(*self.time_commands(commands))
+
+    def bulk(self, command, lines):
+        """ Run a command reading lines on stdin, e.g. newusers/chpasswd
+
+            :param str command: Command to run
+            :param list lines: Input lines
+            :return dict: seconds, lines, lines_per_sec and max_rss_kb
+             (peak resident set size reported by /usr/bin/time)
+            :Exception: Raises SSSDException
+        """
+        self.host.put_file_contents(REMOTE_INPUT, '\n'.join(lines) + '\n')
+        cmd = self.host.run_command('/usr/bin/time -f "%%e %%M" -o %s %s '
+                                    '< %s' % (REMOTE_TIME, command,
+                                              REMOTE_INPUT), raiseonerr=False)
+        if cmd.returncode != 0:
+            raise SSSDException('%s failed: %s' % (command,
+                                                   cmd.stderr_text), 1)
+        seconds, rss = self.host.get_file_contents(
+            REMOTE_TIME, encoding='utf-8').split()[-2:]
+        seconds = float(seconds)
+        return {'seconds': seconds, 'lines': len(lines),
+                'lines_per_sec': len(lines) / seconds if seconds else 0.0,
+                'max_rss_kb': int(rss)}
+
+    def hash_supported(self, method, user='perfprobe'):
+        """ Return True if chpasswd hashes passwords with method
+
+            A throwaway user is created for the probe and removed again.
+
+            :param str method: Hash method passed to chpasswd -c
+            :param str user: Name of the throwaway user
+            :return bool: True if chpasswd succeeded
+        """
+        self.host.run_command('useradd -M %s' % user)
+        cmd = self.host.run_command('chpasswd -c %s' % method,
+                                    stdin_text='%s:Secret123' % user,
+                                    raiseonerr=False)
+        self.host.run_command('userdel %s' % user)
+        return cmd.returncode == 0
+
+    def lock_cycles(self, command, lines, database='/etc/shadow',
+                    sample=LOCK_SAMPLE):
+        """ Count how often a command locks and replaces a database
+
+            The command runs under strace on the first sample lines
+            only, so the hash cost of the full input is not paid again.
+
+            :param str command: Command to run
+            :param list lines: Input lines
+            :param str database: Path of the database
+            :param int sample: Number of input lines to trace
+            :return dict: locks and renames of the database and the
+             number of lines traced
+            :Exception: Raises SSSDException
+        """
+        lines = lines[:sample]
+        self.host.put_file_contents(REMOTE_INPUT, '\n'.join(lines) + '\n')
+        cmd = self.host.run_command('strace -f -qq -e trace=%s -o %s %s < %s'
+                                    % (LOCK_SYSCALLS, REMOTE_TRACE, command,
+                                       REMOTE_INPUT), raiseonerr=False)
+        if cmd.returncode != 0:
+            raise SSSDException('%s failed: %s' % (command,
+                                                   cmd.stderr_text), 1)
+        pattern = shlex.quote(database.replace('.', '\\.'))
+        cmd = self.host.run_command(
+            "grep -cE 'link(at)?\\(.*\"'%(db)s'\\.lock\"|"
+            "open(at)?\\(.*\"'%(db)s'\\.lock\".*O_EXCL' %(trace)s; "
+            "grep -cE 'rename[a-z0-9]*\\(.*\"'%(db)s'\"[,)]' %(trace)s; "
+            "rm -f %(trace)s" % {'db': pattern, 'trace': REMOTE_TRACE},
+            raiseonerr=False)
+        locks, renames = cmd.stdout_text.split()[:2]
+        return {'locks': int(locks), 'renames': int(renames),
+                'lock_sample': len(lines)}
+
+    def stress(self, operations, writers, duration, group='perfstg',
+               baseline=None):
+        """ Run operations from concurrent writers for duration seconds
+
+            Every writer runs the operations in turn; commands see $w,
+            the index of the writer, $n, its iteration, and the group
+            named group$w created for the writer.
+
+            :param list operations: (name, shell command) tuples
+            :param int writers: Number of concurrent writers
+            :param int duration: Seconds to run
+            :param str group: Prefix of the group of each writer
+            :param dict baseline: Operation name mapped to its uncontended
+             median latency, lock wait is latency above the median
+            :return dict: ops_per_sec, failure_rate, failures by reason
+             (lock, ebusy, other) and statistics per operation
+        """
+        script = STRESS_SCRIPT % {
+            'names': ' '.join(shlex.quote(name) for name, _ in operations),
+            'cmds': ' '.join(shlex.quote(cmd) for _, cmd in operations),
+            'writers': writers, 'duration': duration,
+            'group': shlex.quote(group)}
+        cmd = self.host.run_command(script, log_stdout=False)
+        latencies = dict((name, []) for name, _ in operations)
+        failures = {'lock': 0, 'ebusy': 0, 'other': 0}
+        failed = dict((name, 0) for name, _ in operations)
+        for line in cmd.stdout_text.splitlines():
+            _, name, returncode, micro, reason = line.split()
+            if returncode == '0':
+                latencies[name].append(int(micro) / 1e6)
+            else:
+                failures[reason] += 1
+                failed[name] += 1
+        done = sum(len(values) for values in latencies.values())
+        total = done + sum(failures.values())
+        results = {'writers': writers, 'duration': duration,
+                   'ops_per_sec': float(done) / duration,
+                   'failure_rate': float(total - done) / total if total
+                   else 0.0,
+                   'failures': failures, 'operations': {}}
+        for name, values in latencies.items():
+            results['operations'][name] = summarize(values, failed[name])
+            if baseline and name in baseline:
+                results['operations'][name]['lock_wait'] = summarize(
+                    [max(0.0, value - baseline[name]) for value in values])
+        return results
+
+    def libsubid_bench(self, owners, group=False, iterations=1000,
+                       threads=1, binary=LIST_SUBID_RANGES):
+        """ Time libsubid lookups in one process with list_subid_ranges -b
+
+            :param list owners: Owners looked up in every iteration
+            :param bool group: Look up subgid instead of subuid ranges
+            :param int iterations: Lookups of every owner per thread
+            :param int threads: Threads doing lookups, they take turns as
+             the files backend of libsubid is not thread-safe
+            :param str binary: Path of compiled list_subid_ranges
+            :return dict: calls, failures, min/max/mean/p50/p90/p99 and
+             log2 histogram of latencies in nanoseconds
+            :Exception: Raises SSSDException
+        """
+        self.host.put_file_contents(REMOTE_INPUT, ''.join(
+            '%s\n' % owner for owner in owners))
+        options = '-b -i %d -t %d' % (iterations, threads)
+        if group:
+            options += ' -g'
+        cmd = self.host.run_command('%s %s < %s' % (binary, options,
+                                                    REMOTE_INPUT),
+                                    log_stdout=False, raiseonerr=False)
+        try:
+            return json.loads(cmd.stdout_text)
+        except ValueError:
+            raise SSSDException('%s failed: %s' % (binary,
+                                                   cmd.stderr_text), 1)
+
+    def save_scaling(self, name, sizes, results):
+        """ Fit the growth of every operation over the sizes and write it
+            with the results of all sizes
+
+            :param str name: Name of the benchmark
+            :param list sizes: Sizes the benchmark ran at
+            :param dict results: size -> operation -> statistics, values
+             which are no statistics (e.g. a line length) are not fitted
+            :return str: Path of the result file
+        """
+        growth = {}
+        for operation, stats in results[sizes[0]].items():
+            if not isinstance(stats, dict):
+                continue
+            metric = [key for key in GROWTH_METRICS if key in stats][0]
+            growth[operation] = growth_exponent(
+                sizes, [results[size][operation][metric] for size in sizes])
+        return self.save(name, {'sizes': results, 'growth': growth})
+
+    def save(self, name, results):
+        """ Write results of a benchmark to the results directory
+
+            :param str name: Name of the benchmark
+            :param dict results: JSON serializable results
+            :return str: Path of the result file
+        """
+        os.makedirs(self.results_dir, exist_ok=True)
+        path = os.path.join(self.results_dir, 'shadow-perf-%s-%s.json' % (
+            name, self.build))
+        with open(path, 'w') as result_file:
+            json.dump({'benchmark': name, 'build': self.build,
+                       'results': results}, result_file, indent=1,
+                      sort_keys=True)
+        self.host.log.info('%s results of %s written to %s' % (
+            name, self.build, path))
+        return path
@@ -4,13 +4,17 @@ AD Operations and LDAP Operations"""
 from __future__ import print_function
 import os
 import tempfile
-import time
 import re
 import subprocess
 import array
 import random
 import socket
 import shlex
+import shutil
+import hashlib
+import fcntl
+import threading
+from concurrent.futures import ThreadPoolExecutor
 try:
     import ConfigParser
 except ImportError:
@@ -31,6 +35,8 @@ from .exceptions import PkiLibException
 from .exceptions import LdapException
 from .exceptions import SSSDException
 from .paths import SSSD_DEFAULT_CONF
+from .provision import PackageProvisioner
+from .runner import LocalRunner
 
 PARAMIKO_VERSION = (int(paramiko.__version__.split('.')[0]),
                     int(paramiko.__version__.split('.')[1]))
@@ -72,8 +78,8 @@ class sssdTools(object):
         distro = self.multihost.distro
         if '8.' in distro:
             pkgs = pkgs + extra_pkg
-        self.multihost.package_mgmt(pkgs, action='install')
-        self.multihost.package_mgmt(sssd_pkgs, action='install')
+        PackageProvisioner([self.multihost]).provision(
+            install=pkgs.split() + sssd_pkgs.split(), raiseonerr=False)
 
     def server_install_pkgs(self):
         """ Install common required packages on server"""
@@ -86,8 +92,8 @@ class sssdTools(object):
         if '8.' in distro:
             enable_idm = 'yum module enable idm:DL1 -y'
             self.multihost.run_command(enable_idm)
-        self.multihost.package_mgmt(pkgs, action='install')
-        self.multihost.package_mgmt(sssd_pkgs, action='install')
+        PackageProvisioner([self.multihost]).provision(
+            install=pkgs.split() + sssd_pkgs.split(), raiseonerr=False)
 
     def service_ctrl(self, action, target_service):
         """ Start, stop, restart, reload service with systemctl
@@ -97,14 +103,13 @@ class sssdTools(object):
             :return: str Return code of the systemctl command
             :Exception Raises exception
         """
-        cmd = self.multihost.run_command(['systemctl', action,
-                                          target_service], raiseonerr=False)
-        if cmd.returncode == 0:
-            time.sleep(10)
-            return cmd.returncode
-        else:
-            raise SSSDException('Unable to %s %s' % (action,
-                                                     target_service), 1)
+        self.multihost.services.apply(action, [target_service])
+        if target_service == 'sssd' and action != 'stop':
+            self.multihost.wait_for_sssd()
+        elif action != 'stop':
+            self.multihost.wait_for_service(target_service, timeout=30,
+                                            raiseonerr=False)
+        return 0
 
     def update_resolv_conf(self, ip_addr):
         """ Update /etc/resolv.conf with Windows AD IP address
@@ -356,13 +361,16 @@ class sssdTools(object):
     def realm_join(self, domainname, admin_password,
                    client_software='sssd',
                    server_software='active-directory',
-                   membership_software='adcli'):
+                   membership_software='adcli',
+                   ccache=None):
         """ Join system to AD/IPA Domain using realmOA
             :param str domainname: domain name of AD/IPA
             :param str admin_password: Administrator password required to join
             :param str client_software: client software to be used (sssd/samba)
             :param str server_software: server software (active-directory/ipa)
             :param str membership_software: membership software (samba/adcli)
+            :param str ccache: Kerberos ccache of the administrator (see
+             QeHost.kinit), the password is still given if realm asks
             :Exception: Raises SSSDException
         """
         realm_cmd = 'realm join %s --client-software=%s --server-software=%s '\
@@ -370,6 +378,8 @@ class sssdTools(object):
                                                      client_software,
                                                      server_software,
                                                      membership_software)
+        if ccache:
+            realm_cmd = 'KRB5CCNAME=%s %s' % (ccache, realm_cmd)
         print(realm_cmd)
         cmd = self.multihost.run_command(realm_cmd, stdin_text=admin_password,
                                          raiseonerr=False)
@@ -393,10 +403,12 @@ class sssdTools(object):
         if cmd.returncode != 0:
             raise SSSDException("Error: %s", cmd.stderr_text)
 
-    def join_ad(self, realm=None, adpassword=None, mem_sw=None):
+    def join_ad(self, realm=None, adpassword=None, mem_sw=None, ccache=None):
         """ Join AD using realm
         pass membership software as argumen
         use adcli ad default
+        the cached ticket of the administrator (QeHost.kinit) is used
+        unless a ccache is given
         """
         if not realm:
             realm = self.ad_realm
@@ -406,9 +418,17 @@ class sssdTools(object):
             prg = 'samba'
         else:
             prg = 'adcli'
+        if not ccache:
+            admin = '%s@%s' % (getattr(self, 'admin_user', 'Administrator'),
+                               realm.upper())
+            try:
+                ccache = self.multihost.kinit(admin, password=adpassword)
+            except SSSDException:
+                pytest.fail("kinit of %s failed" % (admin))
         try:
             output = self.realm_join(realm, adpassword,
-                                     membership_software=prg)
+                                     membership_software=prg,
+                                     ccache=ccache)
         except SSSDException:
             pytest.fail("Failed to join to AD")
         else:
@@ -503,7 +523,6 @@ class sssdTools(object):
         self.remove_sss_cache('/var/log/sssd')
         if start:
             self.multihost.service_sssd('start')
-            time.sleep(10)
 
     def domain_from_suffix(self, suffix):
         """ Domain name from the suffix
@@ -591,7 +610,8 @@ class sssdTools(object):
                         '-l ' + username + ' localhost whoami' + '\n'
         expect_script += 'expect "*assword: "\n'
         expect_script += 'send "' + password + '\r"\n'
-        expect_script += 'sleep 30 \n'
+        # wait up to 30s, but return as soon as the result shows up
+        expect_script += 'set timeout 30\n'
         expect_script += 'expect {\n'
         expect_script += '\ttimeout { set result_code 0 }\n'
         expect_script += '\t"' + username + '" { set result_code 3 }\n'
@@ -897,14 +917,25 @@ class sssdTools(object):
         restore_cmd = 'cp -af /etc/sssd/sssd.conf.orig /etc/sssd/sssd.conf'
         self.multihost.run_command(restore_cmd)
 
-    def add_service_principals(self, spn_list):
-        """ Add service principal to Windows AD """
+    def add_service_principals(self, spn_list, password=None):
+        """ Add service principal to Windows AD
+            :param list spn_list: Services (HTTP, nfs ...)
+            :param str password: Password of the AD administrator,
+             defaults to the password of the AD host
+        """
         host = self.multihost.sys_hostname
+        admin = '%s@%s' % (self.admin_user, self.ad_realm)
+        if password is None:
+            password = self.ad_password
+        try:
+            ccache = self.multihost.kinit(admin, password=password)
+        except SSSDException:
+            pytest.fail("kinit of %s failed" % (admin))
         for spn in spn_list:
-            cmd = "net ads keytab add_update_ads %s/%s "\
-                  "-U %s " % (spn, host, self.admin_user,)
+            cmd = "KRB5CCNAME=%s net ads keytab add_update_ads %s/%s "\
+                  "-k" % (ccache, spn, host)
             try:
-                self.multihost.run_command(cmd, stdin_text='Secret123')
+                self.multihost.run_command(cmd)
             except subprocess.CalledProcessError:
                 pytest.fail("Failed to add %s Service principal" % (spn))
 
@@ -1303,6 +1334,9 @@ class PkiTools(object):
         self.pwdfilepath = os.path.join(self.nssdb, self.pwdfilename)
         self.noise = array.array('B', os.urandom(128))
         self.noisefilepath = os.path.join(self.nssdb, self.noisefilename)
+        self.runner = LocalRunner()
+        # serializes the use of the CA key in the shared NSS DB
+        self._sign_lock = threading.Lock()
 
     def create_nssdb(self):
         """
@@ -1327,7 +1361,8 @@ class PkiTools(object):
                 capture_output=True,
                 raiseonerr=False,
                 env=None,
-                cwd=None):
+                cwd=None,
+                timeout=None):
         """
         Execute a command and return stdout, stderr and return code
 
@@ -1336,56 +1371,41 @@ class PkiTools(object):
         :param bool: capture_output: Capture output of the command
                      (default True)
         :param bool raiseonerr: Raise exception if command fails
-        :param str env: Env variables to be set before the command is run
+        :param str env: Env variables to be set before the command is run,
+                        the current environment is inherited if None
         :param str cwd: Current working Directory
+        :param float timeout: Kill the command after timeout seconds
 
         :return stdout, stderr and returncode: if command return code is 0
         :Exception: raises exception if raiseonerr is True
         """
-
-        p_in = None
-        p_out = None
-        p_err = None
-        if env is None:
-            env = os.environ.copy()
-        if capture_output:
-            p_out = subprocess.PIPE
-            p_err = subprocess.PIPE
-        try:
-            proc = subprocess.Popen(args, stdin=p_in, stdout=p_out,
-                                    stderr=p_err, close_fds=True,
-                                    env=env, cwd=cwd)
-            stdout, stderr = proc.communicate(stdin)
-        except KeyboardInterrupt:
-            proc.wait()
-            raise
-        if proc.returncode != 0 and raiseonerr:
-            raise subprocess.CalledProcessError(proc.returncode, args, stdout)
-        else:
-            return (stdout, stderr, proc.returncode)
-
-    def createselfsignedcerts(self,
-                              serverlist,
-                              ca_dn=None,
-                              passphrase='Secret12@38/-\245550',
-                              canickname='ExampleCA'):
+        result = self.runner.run(args, stdin=stdin,
+                                 capture_output=capture_output,
+                                 raiseonerr=raiseonerr, env=env, cwd=cwd,
+                                 timeout=timeout)
+        return (result.stdout, result.stderr, result.returncode)
+
+    def create_ca(self,
+                  ca_dn=None,
+                  passphrase='Secret12@38/-\245550',
+                  canickname='ExampleCA'):
         """
-        Creates a NSS DB in /tmp/nssDirxxxx where self signed Root CA
-        and Server Certs are created
-
-        :param str CA_DN: Distinguished Name for CA Cert
-        :param str Server_DN: Distinguished Name for Server Cert
+        Creates a NSS DB with a self signed Root CA and exports the CA
+        once as cacert.pem and ca.p12
+
+        :param str ca_dn: Distinguished Name for CA Cert
+        :param str passphrase: Passphrase written to pin.txt
+        :param str canickname: Nick name of the CA Cert
+        :return str nss_dir: path of the NSS DB Directory
+        :Exception: raises PkiLibException
         """
         if ca_dn is None:
             ca_dn = 'CN=ExampleCA,O=Example,L=Raleigh,C=US'
-        nss_passphrase = passphrase
         pin_filename = 'pin.txt'
         nss_dir = self.create_nssdb()
         pin_filepath = os.path.join(nss_dir, pin_filename)
         ca_pempath = os.path.join(nss_dir, 'cacert.pem')
-        server_pempath = os.path.join(nss_dir, 'server.pem')
         ca_p12_path = os.path.join(nss_dir, 'ca.p12')
-        # #server_p12_path = os.path.join(nss_dir, 'server.p12')
         with open(self.noisefilepath, 'w') as outfile:
             outfile.write(str(self.noise))
         keyUsage = 'digitalSignature,certSigning,crlSigning,critical'
@@ -1399,52 +1419,220 @@ class PkiTools(object):
         ca_pem = 'certutil -d %s -f %s -L -n "%s"' \
                  ' -a -o %s' % (nss_dir, self.pwdfilepath,
                                 canickname, ca_pempath)
+        export_ca_p12 = 'pk12util -d %s -o %s -n "%s"'\
+                        ' -k %s -w %s' % (nss_dir, ca_p12_path,
+                                          canickname, self.pwdfilepath,
+                                          self.pwdfilepath)
         with open(pin_filepath, 'w') as outfile:
-            outfile.write('Internal (Software) Token:%s' % nss_passphrase)
+            outfile.write('Internal (Software) Token:%s' % passphrase)
         _, _, return_code = self.execute(shlex.split(ca_args))
         if return_code != 0:
             raise PkiLibException('Could not create Self signed CA Cert')
-        else:
-            self.execute(shlex.split(ca_pem))
-        for server in serverlist:
-            server_cn = 'CN=%s' % (server)
-            server_nickname = 'Server-Cert-%s' % (server)
-            server_pem = 'certutil -d %s -f %s -L '\
-                         '-n "%s" -a -o %s' % (nss_dir,
-                                               self.pwdfilepath,
-                                               server_nickname,
-                                               server_pempath)
-            rand_var = str(random.randint(1000, 2000))
-            server_args = 'certutil -d %s -f %s -S -n "%s" -s %s -c "%s"'\
-                          ' -t u,u,u -v 720 -m %s -z %s' % (nss_dir,
-                                                            self.pwdfilepath,
-                                                            server_nickname,
-                                                            server_cn,
-                                                            canickname,
-                                                            rand_var,
-                                                            self.noisefilepath)
-            _, _, return_code = self.execute(shlex.split(server_args))
-            if return_code != 0:
-                raise PkiLibException('Could not create Server-Cert')
-            else:
-                _, _, return_code = self.execute(shlex.split(server_pem))
-                if return_code != 0:
-                    raise PkiLibException('Could not create Server pem file')
-                export_ca_p12 = 'pk12util -d %s -o %s -n "%s"'\
-                                ' -k %s -w %s' % (nss_dir, ca_p12_path,
-                                                  canickname, self.pwdfilepath,
-                                                  self.pwdfilepath)
-                _, _, return_code = self.execute(shlex.split(export_ca_p12))
-                server_pkcs12_file = '%s-%s' % (server, 'server.p12')
-                server_p12 = os.path.join(nss_dir, server_pkcs12_file)
-                export_svr_p12 = 'pk12util -d %s -o %s -n %s'\
-                                 ' -k %s -w %s' % (nss_dir, server_p12,
-                                                   server_nickname,
-                                                   self.pwdfilepath,
-                                                   self.pwdfilepath)
-                _, _, return_code = self.execute(shlex.split(export_svr_p12))
+        self.execute(shlex.split(ca_pem))
+        _, _, return_code = self.execute(shlex.split(export_ca_p12))
+        if return_code != 0:
+            raise PkiLibException('Could not export CA p12 file')
         return nss_dir
 
+    def _check(self, command, error):
+        """ Run a certutil/pk12util command line, raise PkiLibException
+        with error if it fails """
+        _, _, return_code = self.execute(shlex.split(command))
+        if return_code != 0:
+            raise PkiLibException(error)
+
+    def _issue(self, server, canickname, workdir):
+        """
+        Issue a Server Cert with its key in a private NSS DB in workdir
+        and export it as <server>-server.p12 and workdir/server.pem.
+        Key generation dominates the runtime and touches only workdir,
+        the shared NSS DB is only used to sign the request, one at a
+        time, as certutil does not support concurrent writers on it.
+
+        :param str server: Hostname used as CN of the Server Cert
+        :param str canickname: Nick name of the CA Cert
+        :param str workdir: Empty directory for the private NSS DB
+        :return str server_p12: path of the server p12 file
+        :Exception: raises PkiLibException
+        """
+        server_nickname = 'Server-Cert-%s' % (server)
+        server_p12 = os.path.join(self.nssdb, '%s-server.p12' % server)
+        server_csr = os.path.join(workdir, 'server.csr')
+        server_crt = os.path.join(workdir, 'server.crt')
+        # serial numbers have to be unique per issuer, certs issued to
+        # the cached CA in a later session must not collide
+        serial = str(random.SystemRandom().randint(1000, 2 ** 31 - 1))
+        self._check('certutil -N -d %s -f %s' % (workdir, self.pwdfilepath),
+                    'Could not setup NSS DB on %s' % workdir)
+        self._check('certutil -R -d %s -f %s -s CN=%s -z %s -o %s' % (
+            workdir, self.pwdfilepath, server, self.noisefilepath,
+            server_csr), 'Could not create Server-Cert request')
+        with self._sign_lock:
+            self._check('certutil -C -d %s -f %s -c "%s" -m %s -v 720 '
+                        '-i %s -o %s' % (self.nssdb, self.pwdfilepath,
+                                         canickname, serial, server_csr,
+                                         server_crt),
+                        'Could not create Server-Cert')
+        self._check('certutil -A -d %s -n "%s" -t "CT,," -a -i %s' % (
+            workdir, canickname, os.path.join(self.nssdb, 'cacert.pem')),
+            'Could not import CA Cert')
+        self._check('certutil -A -d %s -n "%s" -t u,u,u -i %s' % (
+            workdir, server_nickname, server_crt),
+            'Could not import Server-Cert')
+        self._check('certutil -d %s -f %s -L -n "%s" -a -o %s' % (
+            workdir, self.pwdfilepath, server_nickname,
+            os.path.join(workdir, 'server.pem')),
+            'Could not create Server pem file')
+        self._check('pk12util -d %s -o %s -n "%s" -k %s -w %s' % (
+            workdir, server_p12, server_nickname, self.pwdfilepath,
+            self.pwdfilepath), 'Could not export Server p12 file')
+        return server_p12
+
+    def issue_server_cert(self, server, canickname='ExampleCA'):
+        """
+        Issue a Server Cert signed by the CA and export it as
+        <server>-server.p12, server.pem holds the last issued Server Cert
+
+        :param str server: Hostname used as CN of the Server Cert
+        :param str canickname: Nick name of the CA Cert
+        :return str server_p12: path of the server p12 file
+        :Exception: raises PkiLibException
+        """
+        return self.issue_server_certs([server], canickname)[0]
+
+    def issue_server_certs(self, serverlist, canickname='ExampleCA',
+                           max_workers=None):
+        """
+        Issue Server Certs for all servers concurrently, see _issue.
+        server.pem holds the Server Cert of the last server.
+
+        :param list serverlist: Hostnames to issue Server Certs for
+        :param str canickname: Nick name of the CA Cert
+        :param int max_workers: Maximum number of concurrent certutil runs
+        :return list: paths of the server p12 files
+        :Exception: raises PkiLibException
+        """
+        if not serverlist:
+            return []
+        if max_workers is None:
+            max_workers = min(len(serverlist), os.cpu_count() or 1)
+        if not os.path.isfile(self.noisefilepath):
+            with open(self.noisefilepath, 'w') as outfile:
+                outfile.write(str(self.noise))
+        workdirs = [tempfile.mkdtemp(prefix='%s.' % server, dir=self.nssdb)
+                    for server in serverlist]
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                server_p12s = list(executor.map(
+                    self._issue, serverlist, [canickname] * len(serverlist),
+                    workdirs))
+            shutil.copyfile(os.path.join(workdirs[-1], 'server.pem'),
+                            os.path.join(self.nssdb, 'server.pem'))
+        finally:
+            for workdir in workdirs:
+                shutil.rmtree(workdir, ignore_errors=True)
+        return server_p12s
+
+    def createselfsignedcerts(self,
+                              serverlist,
+                              ca_dn=None,
+                              passphrase='Secret12@38/-\245550',
+                              canickname='ExampleCA'):
+        """
+        Creates a NSS DB in /tmp/nssDirxxxx where self signed Root CA
+        and Server Certs are created
+
+        :param list serverlist: Hostnames to issue Server Certs for
+        :param str CA_DN: Distinguished Name for CA Cert
+        :param str passphrase: Passphrase written to pin.txt
+        :param str canickname: Nick name of the CA Cert
+        """
+        nss_dir = self.create_ca(ca_dn, passphrase, canickname)
+        self.issue_server_certs(serverlist, canickname)
+        return nss_dir
+
+
+class PkiCertFactory(object):
+    """
+        PkiCertFactory creates the CA once and issues Server Certs on
+        demand. The NSS DB, PEM and p12 files are cached on disk keyed
+        by the CA DN, nickname and passphrase (one directory per CA) and
+        server name (one p12 per server), so later sessions reuse them instead of regenerating.
+        The cache directory defaults to $QE_PKI_CACHE_DIR or
+        <tmpdir>/qe-pki-cache. pki_kwargs are passed to pki_class, e.g.
+        the key_pool of CryptoPkiTools.
+    """
+    ca_files = ['pwfile', 'pin.txt', 'cacert.pem', 'ca.p12']
+    _lock = threading.Lock()
+
+    def __init__(self,
+                 cache_dir=None,
+                 ca_dn=None,
+                 passphrase='Secret12@38/-\245550',
+                 canickname='ExampleCA',
+                 pki_class=PkiTools,
+                 max_workers=None,
+                 pki_kwargs=None):
+        if cache_dir is None:
+            cache_dir = os.environ.get('QE_PKI_CACHE_DIR',
+                                       os.path.join(tempfile.gettempdir(),
+                                                    'qe-pki-cache'))
+        if ca_dn is None:
+            ca_dn = 'CN=ExampleCA,O=Example,L=Raleigh,C=US'
+        self.cache_dir = cache_dir
+        self.ca_dn = ca_dn
+        self.passphrase = passphrase
+        self.canickname = canickname
+        self.pki_class = pki_class
+        self.pki_kwargs = pki_kwargs or {}
+        self.max_workers = max_workers
+        cache_key = hashlib.sha256(('%s|%s|%s|%s' % (
+            pki_class.__name__, ca_dn, canickname,
+            passphrase)).encode()).hexdigest()
+        self.nss_dir = os.path.join(self.cache_dir, cache_key[:16])
+        self.lock_file = '%s.lock' % self.nss_dir
+
+    def _cached(self, filenames):
+        """ Return True if all files exist in the cached NSS DB """
+        return all(os.path.isfile(os.path.join(self.nss_dir, filename))
+                   for filename in filenames)
+
+    def get_certs(self, serverlist):
+        """
+        Return the NSS DB directory containing CA and Server Certs for
+        all servers in serverlist, creating only what is not cached yet.
+
+        :param list serverlist: Hostnames to issue Server Certs for
+        :return str nss_dir: path of the NSS DB Directory
+        :Exception: raises PkiLibException
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # the thread lock serializes factories within this process, the
+        # file lock serializes sessions sharing the same cache directory
+        with self._lock, open(self.lock_file, 'w') as lock_fd:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                if not self._cached(self.ca_files):
+                    # discard leftovers of an interrupted run
+                    shutil.rmtree(self.nss_dir, ignore_errors=True)
+                    os.makedirs(self.nss_dir)
+                    pki = self.pki_class(nssdir=self.nss_dir,
+                                         nssdir_pwd=self.passphrase,
+                                         **self.pki_kwargs)
+                    pki.create_ca(self.ca_dn, self.passphrase,
+                                  self.canickname)
+                else:
+                    pki = self.pki_class(nssdir=self.nss_dir,
+                                         nssdir_pwd=self.passphrase,
+                                         **self.pki_kwargs)
+                missing = [server for server in serverlist if not
+                           self._cached(['%s-server.p12' % server])]
+                pki.issue_server_certs(missing, self.canickname,
+                                       self.max_workers)
+            finally:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        return self.nss_dir
+
 
 class ADOperations(object):
     """